@@ -0,0 +1,10 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+
+Performance benchmarks for ingestion, scoring and page rendering, run on
+synthetic WMT-scale data in a temporary test database:
+
+    OCELOT_SECRET_KEY=... python -m benchmarks --help
+
+Load tests against a running server are in benchmarks.loadtest.
+"""
@@ -0,0 +1,106 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import argparse
+import json
+import os
+import sys
+from tempfile import TemporaryDirectory
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Runs OCELoT benchmarks on synthetic data',
+    )
+    parser.add_argument('--docs', default=20, type=int)
+    parser.add_argument('--segments', default=50, type=int)
+    parser.add_argument('--teams', default=10, type=int)
+    parser.add_argument('--submissions', default=3, type=int)
+    parser.add_argument('--repeat', default=5, type=int)
+    parser.add_argument(
+        '--only', nargs='+', metavar='NAME', help='Benchmarks to run'
+    )
+    parser.add_argument('--json', help='Write results to this JSON file')
+    parser.add_argument(
+        '--baseline',
+        help='Compare with results from a JSON file, exit 1 on regressions',
+    )
+    parser.add_argument(
+        '--tolerance',
+        default=0.2,
+        type=float,
+        help='Allowed relative increase of time and memory (default: 0.2)',
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Runs benchmarks in a temporary test database."""
+    args = _parse_args()
+
+    with TemporaryDirectory() as tmp_dir:
+        # Derived files and reference statistics must not mix with real ones
+        os.environ['OCELOT_DERIVED_ROOT'] = os.path.join(
+            tmp_dir, 'derived'
+        )
+        os.environ['OCELOT_REF_STATS_ROOT'] = os.path.join(
+            tmp_dir, 'stats'
+        )
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ocelot.settings')
+
+        import django
+
+        django.setup()
+
+        from django.db import connection
+        from django.test.utils import setup_test_environment
+        from django.test.utils import teardown_test_environment
+
+        from benchmarks.data import create_dataset
+        from benchmarks.suite import compare_results
+        from benchmarks.suite import format_results
+        from benchmarks.suite import run_benchmarks
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            dataset = create_dataset(
+                tmp_dir,
+                docs=args.docs,
+                segments=args.segments,
+                teams=args.teams,
+                submissions=args.submissions,
+            )
+            results = run_benchmarks(
+                dataset, repeat=args.repeat, names=args.only
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    print(format_results(results))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump(
+                {
+                    'params': vars(args),
+                    'results': [x._asdict() for x in results],
+                },
+                json_file,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as json_file:
+            baseline = json.load(json_file)['results']
+        regressions = compare_results(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
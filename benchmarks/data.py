@@ -0,0 +1,249 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import os
+import random
+import string
+from collections import namedtuple
+from datetime import datetime
+
+from django.utils import timezone
+
+from leaderboard.models import Competition
+from leaderboard.models import Language
+from leaderboard.models import process_scoring_queue
+from leaderboard.models import SGML_FILE
+from leaderboard.models import Submission
+from leaderboard.models import Team
+from leaderboard.models import TestSet
+from leaderboard.models import TEXT_FILE
+from leaderboard.models import XML_FILE
+
+# Synthetic data is built from this many distinct words
+VOCABULARY_SIZE = 5000
+
+# Share of reference words replaced in system translations
+HYP_NOISE = 0.3
+
+FILE_EXTENSIONS = {SGML_FILE: '.sgm', TEXT_FILE: '.txt', XML_FILE: '.xml'}
+
+Dataset = namedtuple(
+    'Dataset',
+    [
+        'directory',
+        'competition',
+        'test_set',
+        'teams',
+        'submissions',
+        'src_docs',
+        'ref_docs',
+    ],
+)
+
+
+def _make_vocabulary(rnd):
+    """Returns a list of random lowercase words."""
+    return [
+        ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(2, 10)))
+        for _ in range(VOCABULARY_SIZE)
+    ]
+
+
+def generate_docs(docs, segments, seed=0):
+    """Returns docs x segments random segments, as a list of lists."""
+    rnd = random.Random(seed)
+    vocabulary = _make_vocabulary(rnd)
+    return [
+        [
+            ' '.join(rnd.choices(vocabulary, k=rnd.randint(5, 40)))
+            for _ in range(segments)
+        ]
+        for _ in range(docs)
+    ]
+
+
+def translate_docs(ref_docs, seed=0, noise=HYP_NOISE):
+    """Returns a system translation replacing some words of ref_docs."""
+    rnd = random.Random(seed)
+    vocabulary = _make_vocabulary(rnd)
+    return [
+        [
+            ' '.join(
+                rnd.choice(vocabulary) if rnd.random() < noise else word
+                for word in segment.split()
+            )
+            for segment in doc
+        ]
+        for doc in ref_docs
+    ]
+
+
+def _write_segments(out_file, segments, indent=''):
+    """Writes <seg> elements, one per line."""
+    for seg_id, segment in enumerate(segments, 1):
+        out_file.write(
+            '{0}<seg id="{1}">{2}</seg>\n'.format(indent, seg_id, segment)
+        )
+
+
+def write_text_file(path, docs):
+    """Writes segments of all docs to a text file, one per line."""
+    with open(path, 'w', encoding='utf-8') as out_file:
+        for doc in docs:
+            for segment in doc:
+                out_file.write(segment + '\n')
+
+
+def write_sgml_file(path, docs, set_tag='tstset', sysid='ref'):
+    """Writes docs to a WMT SGML file, e.g. srcset, refset or tstset."""
+    with open(path, 'w', encoding='utf-8') as out_file:
+        out_file.write(
+            '<{0} setid="bench" srclang="en" trglang="de">\n'.format(
+                set_tag
+            )
+        )
+        for doc_id, doc in enumerate(docs):
+            out_file.write(
+                '<doc sysid="{0}" docid="doc.{1}" genre="news" '
+                'origlang="en">\n<p>\n'.format(sysid, doc_id)
+            )
+            _write_segments(out_file, doc)
+            out_file.write('</p>\n</doc>\n')
+        out_file.write('</{0}>\n'.format(set_tag))
+
+
+def write_xml_file(
+    path, src_docs, ref_docs=None, hyp_docs=None, system=''
+):
+    """Writes a WMT XML file with sources and a reference or system."""
+    with open(path, 'w', encoding='utf-8') as out_file:
+        out_file.write("<?xml version='1.0' encoding='utf8'?>\n")
+        out_file.write('<dataset id="bench">\n')
+        for doc_id, src_doc in enumerate(src_docs):
+            out_file.write(
+                '  <doc origlang="en" id="doc.{0}">\n'.format(doc_id)
+            )
+            out_file.write('    <src lang="en">\n      <p>\n')
+            _write_segments(out_file, src_doc, indent='        ')
+            out_file.write('      </p>\n    </src>\n')
+            if ref_docs is not None:
+                out_file.write('    <ref lang="de" translator="A">\n')
+                out_file.write('      <p>\n')
+                _write_segments(out_file, ref_docs[doc_id], '        ')
+                out_file.write('      </p>\n    </ref>\n')
+            if hyp_docs is not None:
+                out_file.write(
+                    '    <hyp system="{0}" lang="de">\n'.format(system)
+                )
+                out_file.write('      <p>\n')
+                _write_segments(out_file, hyp_docs[doc_id], '        ')
+                out_file.write('      </p>\n    </hyp>\n')
+            out_file.write('  </doc>\n')
+        out_file.write('</dataset>\n')
+
+
+def write_submission_file(path, file_format, src_docs, hyp_docs, system):
+    """Writes a system translation in the given file format."""
+    if file_format == XML_FILE:
+        write_xml_file(path, src_docs, hyp_docs=hyp_docs, system=system)
+    elif file_format == SGML_FILE:
+        write_sgml_file(path, hyp_docs, sysid=system)
+    else:
+        write_text_file(path, hyp_docs)
+
+
+def create_dataset(
+    directory,
+    docs=20,
+    segments=50,
+    teams=10,
+    submissions=3,
+    file_format=XML_FILE,
+    seed=0,
+):
+    """
+    Writes a test set of docs x segments in file_format to directory, and
+    creates a public competition with teams x submissions scored entries.
+    """
+    src_docs = generate_docs(docs, segments, seed=seed)
+    ref_docs = generate_docs(docs, segments, seed=seed + 1)
+    extension = FILE_EXTENSIONS[file_format]
+
+    src_path = os.path.join(directory, 'src' + extension)
+    ref_path = os.path.join(directory, 'ref' + extension)
+    if file_format == XML_FILE:
+        write_xml_file(src_path, src_docs)
+        write_xml_file(ref_path, src_docs, ref_docs=ref_docs)
+    elif file_format == SGML_FILE:
+        write_sgml_file(src_path, src_docs, set_tag='srcset')
+        write_sgml_file(ref_path, ref_docs, set_tag='refset')
+    else:
+        write_text_file(src_path, src_docs)
+        write_text_file(ref_path, ref_docs)
+
+    _next_year = datetime.now().year + 1
+    competition = Competition.objects.create(
+        is_active=True,
+        is_public=True,
+        name='Benchmark',
+        description='Synthetic benchmark competition',
+        deadline=datetime(_next_year, 1, 1, tzinfo=timezone.utc),
+    )
+    test_set = TestSet.objects.create(
+        is_active=True,
+        name='Benchmark',
+        source_language=Language.objects.get_or_create(
+            code='en', defaults={'name': 'English'}
+        )[0],
+        target_language=Language.objects.get_or_create(
+            code='de', defaults={'name': 'German'}
+        )[0],
+        file_format=file_format,
+        src_file=src_path,
+        ref_file=ref_path,
+        competition=competition,
+    )
+
+    team_list = []
+    submission_list = []
+    for team_id in range(teams):
+        team = Team.objects.create(
+            is_active=True,
+            is_verified=True,
+            name='Team {0}'.format(team_id),
+            email='team-{0}@example.com'.format(team_id),
+        )
+        team_list.append(team)
+
+        for sub_id in range(submissions):
+            system = 'team{0}-sys{1}'.format(team_id, sub_id)
+            hyp_path = os.path.join(directory, system + extension)
+            hyp_seed = seed + 2 + team_id * submissions + sub_id
+            hyp_docs = translate_docs(ref_docs, seed=hyp_seed)
+            write_submission_file(
+                hyp_path, file_format, src_docs, hyp_docs, system
+            )
+            submission_list.append(
+                Submission.objects.create(
+                    name=system,
+                    original_name=os.path.basename(hyp_path),
+                    test_set=test_set,
+                    submitted_by=team,
+                    file_format=file_format,
+                    hyp_file=hyp_path,
+                )
+            )
+
+    process_scoring_queue()
+    for submission in submission_list:
+        submission.refresh_from_db()
+
+    return Dataset(
+        directory,
+        competition,
+        test_set,
+        team_list,
+        submission_list,
+        src_docs,
+        ref_docs,
+    )
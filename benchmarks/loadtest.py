@@ -0,0 +1,619 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+
+Load generator replaying submission-week traffic against a running server,
+e.g. manage.py runserver or uWSGI. The setup command creates a synthetic
+competition in the configured database, the run command needs no Django:
+
+    OCELOT_SECRET_KEY=... python -m benchmarks.loadtest setup loadtest
+    python -m benchmarks.loadtest run loadtest/manifest.json \\
+        --url http://127.0.0.1:8000 --users 50 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import ssl
+import sys
+import time
+import uuid
+from collections import Counter
+from collections import defaultdict
+from collections import namedtuple
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+
+# Relative frequency of scenarios picked by virtual users
+SCENARIO_WEIGHTS = {
+    'leaderboard': 4,
+    'compare': 3,
+    'teampage': 2,
+    'submit': 1,
+}
+
+# Number of distinct files written by setup for the submit scenario
+UPLOAD_FILES = 3
+
+# Latency percentiles reported per endpoint
+PERCENTILES = (50, 95, 99)
+
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+
+EndpointResult = namedtuple(
+    'EndpointResult',
+    ['endpoint', 'requests', 'errors', 'p50', 'p95', 'p99', 'max'],
+)
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = max(int(math.ceil(pct / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+class LoadStats:
+    """Collects latencies and errors per endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def add(self, endpoint, elapsed, error=None):
+        """Records one request; error describes a failed request."""
+        self.latencies[endpoint].append(elapsed)
+        if error is not None:
+            self.errors[endpoint][error] += 1
+
+    def summarize(self):
+        """Returns an EndpointResult per endpoint, sorted by endpoint."""
+        results = []
+        for endpoint in sorted(self.latencies):
+            latencies = sorted(self.latencies[endpoint])
+            results.append(
+                EndpointResult(
+                    endpoint,
+                    len(latencies),
+                    sum(self.errors[endpoint].values()),
+                    *[percentile(latencies, x) for x in PERCENTILES],
+                    latencies[-1],
+                )
+            )
+        return results
+
+
+def _encode_body(fields, files):
+    """Returns (body, content type) for form fields and uploaded files.
+
+    Fields are (name, value) pairs, files are (name, file name, bytes).
+    """
+    if not files:
+        return urlencode(fields).encode('utf-8'), (
+            'application/x-www-form-urlencoded'
+        )
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields:
+        parts.append(
+            '--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n'
+            '{2}\r\n'.format(boundary, name, value).encode('utf-8')
+        )
+    for name, file_name, content in files:
+        header = (
+            '--{0}\r\nContent-Disposition: form-data; name="{1}"; '
+            'filename="{2}"\r\nContent-Type: application/xml\r\n\r\n'
+        ).format(boundary, name, file_name)
+        parts.append(header.encode('utf-8'))
+        parts.append(content + b'\r\n')
+    parts.append('--{0}--\r\n'.format(boundary).encode('utf-8'))
+    return b''.join(parts), 'multipart/form-data; boundary=' + boundary
+
+
+def _parse_response(data):
+    """Parses a raw HTTP response into a Response."""
+    head, _, body = data.partition(b'\r\n\r\n')
+    lines = head.decode('iso-8859-1').split('\r\n')
+    status_line = lines[0].split(' ', 2)
+    if len(status_line) < 2 or not status_line[0].startswith('HTTP/'):
+        raise ValueError('Invalid status line {0!r}'.format(lines[0]))
+
+    headers = []
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers.append((name.strip().lower(), value.strip()))
+    return Response(int(status_line[1]), headers, body)
+
+
+class HttpClient:
+    """Minimal HTTP/1.0 client keeping the cookies of one virtual user.
+
+    Every request uses a new connection and HTTP/1.0, so responses are
+    never chunked and end when the server closes the connection.
+    """
+
+    def __init__(self, base_url, stats, timeout=30.0):
+        parts = urlsplit(base_url)
+        self.base_url = base_url.rstrip('/')
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.ssl = (
+            ssl.create_default_context()
+            if parts.scheme == 'https'
+            else None
+        )
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = {}
+
+    async def request(
+        self,
+        endpoint,
+        method,
+        path,
+        fields=None,
+        files=None,
+        expect=(200,),
+    ):
+        """Sends a request and records its latency under endpoint.
+
+        Returns the Response, or None if the request failed or returned
+        a status not in expect.
+        """
+        headers = [
+            ('Host', self.host),
+            ('User-Agent', 'ocelot-loadtest'),
+            ('Referer', self.base_url + path),  # Checked by CSRF for HTTPS
+        ]
+        if self.cookies:
+            headers.append(
+                (
+                    'Cookie',
+                    '; '.join(
+                        '{0}={1}'.format(*x) for x in self.cookies.items()
+                    ),
+                )
+            )
+
+        body = b''
+        if method == 'POST':
+            fields = list(fields or [])
+            fields.append(
+                ('csrfmiddlewaretoken', self.cookies.get('csrftoken', ''))
+            )
+            body, content_type = _encode_body(fields, files)
+            headers.append(('Content-Type', content_type))
+            headers.append(('Content-Length', str(len(body))))
+
+        head = '{0} {1}{2} HTTP/1.0\r\n'.format(method, self.prefix, path)
+        head += ''.join('{0}: {1}\r\n'.format(*x) for x in headers)
+        request = (head + '\r\n').encode('iso-8859-1') + body
+
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self._send(request), self.timeout
+            )
+        except (OSError, ValueError, asyncio.TimeoutError) as exc:
+            self.stats.add(
+                endpoint, time.perf_counter() - start, type(exc).__name__
+            )
+            return None
+        elapsed = time.perf_counter() - start
+
+        self._update_cookies(response)
+        if response.status not in expect:
+            self.stats.add(
+                endpoint, elapsed, 'HTTP {0}'.format(response.status)
+            )
+            return None
+
+        self.stats.add(endpoint, elapsed)
+        return response
+
+    async def _send(self, request):
+        """Sends raw request bytes and returns the parsed Response."""
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl
+        )
+        try:
+            writer.write(request)
+            await writer.drain()
+            data = await reader.read()
+        finally:
+            writer.close()
+        return _parse_response(data)
+
+    def _update_cookies(self, response):
+        """Stores cookies set by the response, deleting emptied ones."""
+        for name, value in response.headers:
+            if name != 'set-cookie':
+                continue
+            cookie = value.split(';', 1)[0]
+            cookie_name, _, cookie_value = cookie.partition('=')
+            cookie_value = cookie_value.strip('"')
+            if cookie_value:
+                self.cookies[cookie_name.strip()] = cookie_value
+            else:
+                self.cookies.pop(cookie_name.strip(), None)
+
+
+class VirtualUser:
+    """Team member signing in and running scenarios, one at a time."""
+
+    def __init__(self, client, manifest, team, rnd):
+        self.client = client
+        self.manifest = manifest
+        self.team = team
+        self.rnd = rnd
+        self.uploads = 0
+
+    async def sign_in(self):
+        """Signs in with the team token, returns False on failure."""
+        await self.client.request('GET /sign-in', 'GET', '/sign-in')
+        response = await self.client.request(
+            'POST /sign-in',
+            'POST',
+            '/sign-in',
+            fields=[
+                ('name', self.team['name']),
+                ('email', self.team['email']),
+                ('token', self.team['token']),
+            ],
+            expect=(302,),
+        )
+        return response is not None and 'sessionid' in self.client.cookies
+
+    async def leaderboard(self):
+        """Refreshes the competition leaderboard."""
+        await self.client.request(
+            'GET /leaderboard/<id>',
+            'GET',
+            '/leaderboard/{0}'.format(self.manifest['competition']),
+        )
+
+    async def teampage(self):
+        """Opens the team page and toggles primary and contrastive runs."""
+        await self.client.request('GET /teampage', 'GET', '/teampage')
+
+        submissions = list(self.team['submissions'])
+        self.rnd.shuffle(submissions)
+        primary = submissions[0]
+        contrastive = submissions[1] if len(submissions) > 1 else ''
+        await self.client.request(
+            'POST /teampage',
+            'POST',
+            '/teampage',
+            fields=[
+                ('testset', self.manifest['test_set']),
+                ('withdrawn', '0'),
+                ('primary', primary),
+                ('constrained', self.rnd.choice('01')),
+                ('contrastive', contrastive),
+                ('constrained', self.rnd.choice('01')),
+            ],
+        )
+
+    async def compare(self):
+        """Browses a submission and its comparison with another one."""
+        sub_a, sub_b = self.rnd.sample(self.manifest['submissions'], 2)
+        page = self.rnd.randint(1, self.manifest['pages'])
+        await self.client.request(
+            'GET /submission/<id>',
+            'GET',
+            '/submission/{0}?page={1}'.format(sub_a, page),
+        )
+        await self.client.request(
+            'GET /submission/<id>/<id>',
+            'GET',
+            '/submission/{0}/{1}?page={2}&granularity={3}'.format(
+                sub_a, sub_b, page, self.rnd.choice(('word', 'char'))
+            ),
+        )
+
+    async def submit(self):
+        """Opens the submission form and uploads a system output."""
+        await self.client.request('GET /submit', 'GET', '/submit')
+
+        upload_files = self.manifest['upload_files']
+        upload_path = upload_files[self.uploads % len(upload_files)]
+        self.uploads += 1
+        with open(upload_path, 'rb') as upload_file:
+            content = upload_file.read()
+
+        await self.client.request(
+            'POST /submit',
+            'POST',
+            '/submit',
+            fields=[('test_set', self.manifest['test_set'])],
+            files=[('hyp_file', os.path.basename(upload_path), content)],
+            expect=(302,),
+        )
+
+
+async def run_load(
+    base_url,
+    manifest,
+    users=10,
+    duration=60.0,
+    iterations=None,
+    scenarios=None,
+    think_time=0.5,
+    ramp_up=0.0,
+    timeout=30.0,
+    seed=0,
+):
+    """Runs virtual users against base_url and returns LoadStats.
+
+    Users are assigned to teams of the manifest round-robin and start
+    within ramp_up seconds. Each user runs random scenarios, weighted by
+    SCENARIO_WEIGHTS, until duration seconds have passed or it has run
+    iterations scenarios, pausing for think_time seconds on average.
+    """
+    stats = LoadStats()
+    names = list(scenarios or SCENARIO_WEIGHTS)
+    weights = [SCENARIO_WEIGHTS[x] for x in names]
+    deadline = time.monotonic() + duration if duration else None
+
+    async def _run_user(index):
+        rnd = random.Random(seed + index)
+        await asyncio.sleep(ramp_up * index / users)
+
+        teams = manifest['teams']
+        client = HttpClient(base_url, stats, timeout=timeout)
+        user = VirtualUser(
+            client, manifest, teams[index % len(teams)], rnd
+        )
+        if not await user.sign_in():
+            return
+
+        count = 0
+        while iterations is None or count < iterations:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            await getattr(user, rnd.choices(names, weights)[0])()
+            count += 1
+            if think_time:
+                await asyncio.sleep(rnd.uniform(0, 2 * think_time))
+
+    await asyncio.gather(*[_run_user(x) for x in range(users)])
+    return stats
+
+
+def format_results(results, elapsed):
+    """Returns load test results as a plain text table."""
+    lines = [
+        '{0:<28} {1:>8} {2:>8} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+            'endpoint',
+            'requests',
+            'err rate',
+            'p50 ms',
+            'p95 ms',
+            'p99 ms',
+            'max ms',
+        )
+    ]
+    for result in results:
+        lines.append(
+            '{0:<28} {1:>8} {2:>8.1%} {3:>9.1f} {4:>9.1f} {5:>9.1f} '
+            '{6:>9.1f}'.format(
+                result.endpoint,
+                result.requests,
+                result.errors / result.requests,
+                result.p50 * 1000,
+                result.p95 * 1000,
+                result.p99 * 1000,
+                result.max * 1000,
+            )
+        )
+    total = sum(x.requests for x in results)
+    lines.append(
+        '{0} requests in {1:.1f} s, {2:.1f} requests/s'.format(
+            total, elapsed, total / elapsed if elapsed else 0.0
+        )
+    )
+    return '\n'.join(lines)
+
+
+def get_manifest(dataset, upload_files):
+    """Returns the manifest describing a Dataset for run_load()."""
+    # Imported here, the run command works without Django
+    from evaluation.views import SEGMENTS_PER_PAGE
+
+    segments = sum(len(x) for x in dataset.ref_docs)
+    return {
+        'competition': dataset.competition.id,
+        'test_set': dataset.test_set.id,
+        'pages': max(int(math.ceil(segments / SEGMENTS_PER_PAGE)), 1),
+        'submissions': [x.id for x in dataset.submissions],
+        'upload_files': upload_files,
+        'teams': [
+            {
+                'name': team.name,
+                'email': team.email,
+                'token': team.token,
+                'submissions': [
+                    x.id
+                    for x in dataset.submissions
+                    if x.submitted_by_id == team.id
+                ],
+            }
+            for team in dataset.teams
+        ],
+    }
+
+
+def setup(directory, docs=20, segments=50, teams=20, submissions=2):
+    """Creates a load test competition and returns its manifest.
+
+    Test set and upload files are written to directory, which must stay
+    readable by the server.
+    """
+    # Imported here, the run command works without Django
+    from benchmarks.data import create_dataset
+    from benchmarks.data import translate_docs
+    from benchmarks.data import write_submission_file
+    from leaderboard.models import XML_FILE
+
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    dataset = create_dataset(
+        directory,
+        docs=docs,
+        segments=segments,
+        teams=teams,
+        submissions=submissions,
+    )
+
+    upload_files = []
+    for upload_id in range(UPLOAD_FILES):
+        system = 'upload{0}'.format(upload_id)
+        upload_path = os.path.join(directory, system + '.xml')
+        hyp_docs = translate_docs(dataset.ref_docs, seed=1000 + upload_id)
+        write_submission_file(
+            upload_path, XML_FILE, dataset.src_docs, hyp_docs, system
+        )
+        upload_files.append(upload_path)
+
+    return get_manifest(dataset, upload_files)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.loadtest',
+        description='Generates submission-week load on an OCELoT server',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    setup_parser = commands.add_parser(
+        'setup', help='Create a load test competition in the database'
+    )
+    setup_parser.add_argument('directory', help='Directory for test files')
+    setup_parser.add_argument('--docs', default=20, type=int)
+    setup_parser.add_argument('--segments', default=50, type=int)
+    setup_parser.add_argument('--teams', default=20, type=int)
+    setup_parser.add_argument('--submissions', default=2, type=int)
+
+    run_parser = commands.add_parser('run', help='Run virtual users')
+    run_parser.add_argument('manifest', help='Manifest written by setup')
+    run_parser.add_argument('--url', default='http://127.0.0.1:8000')
+    run_parser.add_argument('--users', default=10, type=int)
+    run_parser.add_argument(
+        '--duration',
+        default=60.0,
+        type=float,
+        help='Seconds (default: 60)',
+    )
+    run_parser.add_argument(
+        '--iterations', type=int, help='Scenarios per user (default: none)'
+    )
+    run_parser.add_argument(
+        '--scenarios',
+        nargs='+',
+        choices=list(SCENARIO_WEIGHTS),
+        help='Scenarios to run (default: all)',
+    )
+    run_parser.add_argument(
+        '--think-time',
+        default=0.5,
+        type=float,
+        help='Average pause between scenarios in seconds (default: 0.5)',
+    )
+    run_parser.add_argument(
+        '--ramp-up',
+        default=0.0,
+        type=float,
+        help='Seconds until all users have started (default: 0)',
+    )
+    run_parser.add_argument('--timeout', default=30.0, type=float)
+    run_parser.add_argument('--seed', default=0, type=int)
+    run_parser.add_argument(
+        '--json', help='Write results to this JSON file'
+    )
+    run_parser.add_argument(
+        '--max-error-rate',
+        type=float,
+        help='Exit 1 if the overall error rate is higher, e.g. 0.01',
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Runs the setup or run command."""
+    args = _parse_args()
+
+    if args.command == 'setup':
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ocelot.settings')
+
+        import django
+
+        django.setup()
+
+        manifest = setup(
+            args.directory,
+            docs=args.docs,
+            segments=args.segments,
+            teams=args.teams,
+            submissions=args.submissions,
+        )
+        manifest_path = os.path.join(args.directory, 'manifest.json')
+        with open(manifest_path, 'w', encoding='utf-8') as json_file:
+            json.dump(manifest, json_file, indent=2)
+        print('Wrote {0}'.format(manifest_path))
+        return
+
+    with open(args.manifest, encoding='utf-8') as json_file:
+        manifest = json.load(json_file)
+
+    start = time.monotonic()
+    stats = asyncio.run(
+        run_load(
+            args.url,
+            manifest,
+            users=args.users,
+            duration=args.duration,
+            iterations=args.iterations,
+            scenarios=args.scenarios,
+            think_time=args.think_time,
+            ramp_up=args.ramp_up,
+            timeout=args.timeout,
+            seed=args.seed,
+        )
+    )
+    elapsed = time.monotonic() - start
+    results = stats.summarize()
+    print(format_results(results, elapsed))
+
+    for endpoint in sorted(stats.errors):
+        for error, count in stats.errors[endpoint].most_common():
+            print('{0}: {1} x {2}'.format(endpoint, count, error))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump(
+                {
+                    'params': vars(args),
+                    'elapsed': elapsed,
+                    'results': [x._asdict() for x in results],
+                    'errors': {
+                        x: dict(y) for x, y in stats.errors.items()
+                    },
+                },
+                json_file,
+                indent=2,
+            )
+
+    total = sum(x.requests for x in results)
+    errors = sum(x.errors for x in results)
+    if args.max_error_rate is not None and (
+        not total or errors / total > args.max_error_rate
+    ):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import os
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+from typing import Callable
+from typing import List
+from typing import Tuple
+
+from django.core.cache import cache
+from django.core.files import File
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from benchmarks.data import write_sgml_file
+from leaderboard.models import validate_xml_submission
+from leaderboard.utils import process_to_text
+from leaderboard.utils import process_xml_to_text
+
+# Registered benchmarks as (name, factory) pairs, in definition order
+BENCHMARKS = []  # type: List[Tuple[str, Callable]]
+
+# Slowdowns below this many seconds are never reported as regressions
+MIN_TIME_REGRESSION = 0.001
+
+Result = namedtuple(
+    'Result',
+    ['name', 'runs', 'min_time', 'median_time', 'queries', 'peak_memory'],
+)
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated factory is called once with the
+    Dataset and returns a function which runs the benchmark once.
+    """
+
+    def _register(factory):
+        BENCHMARKS.append((name, factory))
+        return factory
+
+    return _register
+
+
+def _signed_in_client(team):
+    """Returns a test client with the team signed in."""
+    client = Client()
+    session = client.session
+    session['ocelot_team_token'] = team.token
+    session.save()
+    return client
+
+
+def _get_page(client, url):
+    """Returns a function which gets the page and checks the status."""
+
+    def _run():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(
+                'GET {0} returned {1}'.format(url, response.status_code)
+            )
+
+    return _run
+
+
+@benchmark('validate_xml_submission')
+def _validate_xml_submission(dataset):
+    hyp_path = dataset.submissions[0].hyp_file.name
+
+    def _run():
+        with open(hyp_path, 'rb') as hyp_file:
+            validate_xml_submission(File(hyp_file, name=hyp_path))
+
+    return _run
+
+
+@benchmark('process_xml_to_text')
+def _process_xml_to_text(dataset):
+    submission = dataset.submissions[0]
+    hyp_path = submission.hyp_file.name
+    txt_path = os.path.join(dataset.directory, 'process_xml_to_text.txt')
+
+    def _run():
+        process_xml_to_text(hyp_path, txt_path, system=submission.name)
+
+    return _run
+
+
+@benchmark('process_to_text')
+def _process_to_text(dataset):
+    sgml_path = os.path.join(dataset.directory, 'process_to_text.sgm')
+    write_sgml_file(sgml_path, dataset.ref_docs)
+    txt_path = sgml_path.replace('.sgm', '.txt')
+
+    def _run():
+        if os.path.exists(txt_path):  # Otherwise nothing is processed
+            os.unlink(txt_path)
+        process_to_text(sgml_path, txt_path)
+
+    return _run
+
+
+@benchmark('compute_score')
+def _compute_score(dataset):
+    return dataset.submissions[0]._compute_score
+
+
+@benchmark('leaderboard')
+def _leaderboard(dataset):
+    url = '/leaderboard/{0}'.format(dataset.competition.id)
+    return _get_page(Client(), url)
+
+
+@benchmark('teampage')
+def _teampage(dataset):
+    return _get_page(_signed_in_client(dataset.teams[0]), '/teampage')
+
+
+@benchmark('submission')
+def _submission(dataset):
+    url = '/submission/{0}'.format(dataset.submissions[0].id)
+    return _get_page(_signed_in_client(dataset.teams[0]), url)
+
+
+@benchmark('compare_submissions')
+def _compare_submissions(dataset):
+    url = '/submission/{0}/{1}'.format(
+        dataset.submissions[0].id, dataset.submissions[-1].id
+    )
+    return _get_page(_signed_in_client(dataset.teams[0]), url)
+
+
+def measure(name, run, repeat=5):
+    """
+    Runs the benchmark once to count queries, once to measure peak memory
+    allocated by Python and repeat times to measure wall time. Caches are
+    cleared before every run, so pages are always rendered.
+    """
+    cache.clear()
+    with CaptureQueriesContext(connection) as context:
+        run()
+    queries = len(context)  # Later requests reset the query log
+
+    cache.clear()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        cache.clear()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    return Result(
+        name,
+        repeat,
+        min(times),
+        statistics.median(times),
+        queries,
+        peak_memory,
+    )
+
+
+def run_benchmarks(dataset, repeat=5, names=None):
+    """Runs registered benchmarks, or only names, and returns results."""
+    results = []
+    for name, factory in BENCHMARKS:
+        if names and name not in names:
+            continue
+        results.append(measure(name, factory(dataset), repeat=repeat))
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    """
+    Returns messages for results which are slower or use more memory than
+    the baseline by more than tolerance, or run more queries.
+    """
+    baseline = {x['name']: x for x in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None:
+            continue
+
+        allowed_time = max(
+            base['median_time'] * tolerance, MIN_TIME_REGRESSION
+        )
+        if result.median_time > base['median_time'] + allowed_time:
+            regressions.append(
+                '{0}: median time {1:.1f} ms, was {2:.1f} ms'.format(
+                    result.name,
+                    result.median_time * 1000,
+                    base['median_time'] * 1000,
+                )
+            )
+        if result.queries > base['queries']:
+            regressions.append(
+                '{0}: {1} queries, was {2}'.format(
+                    result.name, result.queries, base['queries']
+                )
+            )
+        if result.peak_memory > base['peak_memory'] * (1 + tolerance):
+            regressions.append(
+                '{0}: peak memory {1} KiB, was {2} KiB'.format(
+                    result.name,
+                    result.peak_memory // 1024,
+                    base['peak_memory'] // 1024,
+                )
+            )
+    return regressions
+
+
+def format_results(results):
+    """Returns results as a plain text table."""
+    lines = [
+        '{0:<24} {1:>12} {2:>12} {3:>8} {4:>12}'.format(
+            'benchmark', 'median ms', 'min ms', 'queries', 'peak KiB'
+        )
+    ]
+    for result in results:
+        lines.append(
+            '{0:<24} {1:>12.2f} {2:>12.2f} {3:>8} {4:>12}'.format(
+                result.name,
+                result.median_time * 1000,
+                result.min_time * 1000,
+                result.queries,
+                result.peak_memory // 1024,
+            )
+        )
+    return '\n'.join(lines)
@@ -3,10 +3,15 @@ Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
 """
 import os
 from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
 
 from django.test import TestCase
 from django.utils import timezone
 
+from evaluation import views
+from evaluation.views import _annotate_texts_with_span_diffs
 from leaderboard.models import Competition
 from leaderboard.models import Language
 from leaderboard.models import SGML_FILE
@@ -14,11 +19,23 @@ from leaderboard.models import Submission
 from leaderboard.models import Team
 from leaderboard.models import TestSet
 from leaderboard.models import TEXT_FILE
+from leaderboard.tempdirs import disable_temp_dirs
+from leaderboard.tempdirs import enable_temp_dirs
+from leaderboard.utils import get_line_index_path
+from leaderboard.utils import IndexedTextFile
 from ocelot.settings import BASE_DIR
 
 TESTDATA_DIR = os.path.join(BASE_DIR, 'leaderboard/testdata')
 
 
+def setUpModule():
+    enable_temp_dirs()
+
+
+def tearDownModule():
+    disable_temp_dirs()
+
+
 class ComparisonTests(TestCase):
     """Tests submission output comparison."""
 
@@ -146,3 +163,125 @@ class ComparisonTests(TestCase):
         self.assertContains(response, str(self.sub_1))
         self.assertContains(response, str(self.sub_2))
         self.assertContains(response, '<span class="diff')
+
+    def test_compare_with_lists_only_public_or_own_submissions(self):
+        """Checks that submission/a offers only visible submissions."""
+        self.sub_1.is_public = True
+        self.sub_1.save()
+        self.sub_2.is_public = False
+        self.sub_2.save()
+
+        # Signed in as team A, which may see only its own submission
+        response = self.client.get('/submission/{0}'.format(self.sub_1.id))
+        self.assertEqual(response.context['compare_with'], [])
+
+        self.sub_1.test_set.is_public = True
+        self.sub_1.test_set.save()
+        response = self.client.get('/submission/{0}'.format(self.sub_1.id))
+        sub_2 = Submission.objects.get(id=self.sub_2.id)
+        self.assertTrue(sub_2.effective_is_public)
+        self.assertEqual(
+            response.context['compare_with'], [(sub_2.id, str(sub_2))]
+        )
+
+    def test_submission_pages_are_read_with_line_index(self):
+        """Checks that submission/a shows the segments of the requested page."""
+        self.sub_1.is_public = True
+        self.sub_1.save()
+
+        hyp_path = self.sub_1.get_hyp_text(path_only=True)
+        with open(hyp_path, encoding='utf-8') as hyp_file:
+            hyp_lines = hyp_file.readlines()
+
+        with patch('evaluation.views.SEGMENTS_PER_PAGE', 10):
+            response = self.client.get(
+                '/submission/{0}?page=3'.format(self.sub_1.id)
+            )
+        page = response.context['page']
+        self.assertEqual(page.paginator.count, len(hyp_lines))
+        self.assertEqual(
+            [hyp for _, hyp in page.object_list], hyp_lines[20:30]
+        )
+        self.assertTrue(Path(get_line_index_path(hyp_path)).exists())
+
+    def test_line_index_splits_lines_like_text_mode(self):
+        """Checks that \\n, \\r\\n and lone \\r end lines in IndexedTextFile."""
+        with TemporaryDirectory() as tmp_dir:
+            txt_path = os.path.join(tmp_dir, 'hyp.txt')
+            with open(txt_path, 'wb') as txt_file:
+                txt_file.write('a\rb\r\nč\n\rd'.encode('utf-8'))
+            with open(txt_path, encoding='utf-8') as txt_file:
+                expected = txt_file.readlines()
+
+            with patch('leaderboard.utils.TEXT_CHUNK_SIZE', 4):
+                lines = IndexedTextFile(txt_path)
+                self.assertEqual(len(lines), len(expected))
+                self.assertEqual(lines[:], expected)
+                self.assertEqual(lines[1], 'b\n')
+
+    def test_comparison_diffs_only_the_requested_page(self):
+        """Checks that submission/a/b/ annotates and caches a single page."""
+        views._DIFF_CACHE.clear()
+        self.sub_1.is_public = True
+        self.sub_1.save()
+        self.sub_2.is_public = True
+        self.sub_2.save()
+        url = '/submission/{0}/{1}?page=2'.format(
+            self.sub_1.id, self.sub_2.id
+        )
+
+        with patch('evaluation.views.SEGMENTS_PER_PAGE', 10), patch(
+            'evaluation.views._annotate_texts_with_span_diffs',
+            wraps=_annotate_texts_with_span_diffs,
+        ) as annotate:
+            self.client.get(url)
+            self.assertEqual(annotate.call_count, 10)
+
+            response = self.client.get(url)
+            self.assertEqual(annotate.call_count, 10)  # Cached
+
+            self.client.get(url + '&granularity=char')
+            self.assertEqual(annotate.call_count, 20)
+
+        self.assertEqual(response.context['page'].number, 2)
+        self.assertIn(
+            (
+                self.sub_1.get_hyp_text(path_only=True),
+                self.sub_2.get_hyp_text(path_only=True),
+                2,
+                'word',
+            ),
+            views._DIFF_CACHE,
+        )
+
+    def test_comparison_diffs_changed_hypothesis_again(self):
+        """Checks that cached diffs are not served for a replaced file."""
+        views._DIFF_CACHE.clear()
+        self.sub_1.is_public = True
+        self.sub_1.save()
+        self.sub_2.is_public = True
+        self.sub_2.save()
+        url = '/submission/{0}/{1}'.format(self.sub_1.id, self.sub_2.id)
+
+        with TemporaryDirectory() as tmp_dir, patch(
+            'evaluation.views.SEGMENTS_PER_PAGE', 10
+        ), patch(
+            'evaluation.views._annotate_texts_with_span_diffs',
+            wraps=_annotate_texts_with_span_diffs,
+        ) as annotate:
+            self.client.get(url)
+            self.assertEqual(annotate.call_count, 10)
+
+            hyp_path = os.path.join(tmp_dir, self.sub_2.name)
+            with open(hyp_path, 'w', encoding='utf-8') as hyp_file:
+                hyp_file.writelines(
+                    'Changed ' + x for x in self.sub_2.get_hyp_text()
+                )
+            self.sub_2.hyp_file = hyp_path
+            self.sub_2.save()
+
+            response = self.client.get(url)
+            self.assertEqual(annotate.call_count, 20)
+
+        _, first_b = response.context['page'].object_list[0]
+        self.assertIn('Changed', first_b)
@@ -1,19 +1,51 @@
 """
 Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
 """
+import threading
+from collections import OrderedDict
 from difflib import SequenceMatcher
 
 from django.contrib import messages
 from django.core.paginator import Paginator
+from django.db.models import Q
 from django.http import Http404
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 
 from leaderboard.models import Submission
+from leaderboard.utils import IndexedTextFile
+from leaderboard.utils import ZippedSequence
 from leaderboard.views import _get_team_data
 
 SEGMENTS_PER_PAGE = 100
 
+WORD_GRANULARITY = 'word'
+CHAR_GRANULARITY = 'char'
+
+# Bounded LRU cache of annotated pages keyed by
+# (submission A ID, submission B ID, page number, granularity)
+DIFF_CACHE_SIZE = 256
+_DIFF_CACHE = OrderedDict()  # type: OrderedDict
+_DIFF_CACHE_LOCK = threading.Lock()
+
+
+def _get_cached_diffs(key):
+    """Returns annotated page for the key or None if not cached."""
+    with _DIFF_CACHE_LOCK:
+        annotated = _DIFF_CACHE.get(key)
+        if annotated is not None:
+            _DIFF_CACHE.move_to_end(key)
+        return annotated
+
+
+def _set_cached_diffs(key, annotated):
+    """Caches annotated page, evicting the least recently used pages."""
+    with _DIFF_CACHE_LOCK:
+        _DIFF_CACHE[key] = annotated
+        _DIFF_CACHE.move_to_end(key)
+        while len(_DIFF_CACHE) > DIFF_CACHE_SIZE:
+            _DIFF_CACHE.popitem(last=False)
+
 
 def _annotate_texts_with_span_diffs(text1, text2, char_based=False):
     """
@@ -99,15 +131,20 @@ def submission(request, sub_id=None):
         is_valid=True,  # Ignore invalid submissions
     ).exclude(id=sub_id)
 
+    # Exclude anonymous submissions that are not yours
+    visible = Q(effective_is_public=True)
+    if ocelot_team_token is not None:
+        visible |= Q(submitted_by__token=ocelot_team_token)
+
     compare_with = [
-        (sub.id, str(sub))
-        for sub in _subs
-        # Exclude anonymous submissions that are not yours
-        if not sub.is_anonymous() or sub.is_yours(ocelot_team_token)
+        (sub.id, str(sub)) for sub in _subs.filter(visible).order_by('id')
     ]
 
-    # Paginate
-    data = list(zip(sub.get_src_text(), sub.get_hyp_text()))
+    # Paginate; only segments of the requested page are read from the files
+    data = ZippedSequence(
+        IndexedTextFile(sub.test_set.get_src_text_path()),
+        IndexedTextFile(sub.get_hyp_text(path_only=True)),
+    )
     paginator = Paginator(data, SEGMENTS_PER_PAGE)
     page_num = request.GET.get('page', 1)
     page_data = paginator.get_page(page_num)
@@ -170,23 +207,39 @@ def compare_submissions(request, sub_a_id=None, sub_b_id=None):
         messages.warning(request, _msg)
         return HttpResponseRedirect('/')
 
-    text1 = sub_a.get_hyp_text()
-    text2 = sub_b.get_hyp_text()
-    data = []
-    # TODO: Annotate with span diffs only the current page
-    for sent1, sent2 in zip(text1, text2):
-        data.append(_annotate_texts_with_span_diffs(sent1, sent2))
+    granularity = request.GET.get('granularity', WORD_GRANULARITY)
+    if granularity not in (WORD_GRANULARITY, CHAR_GRANULARITY):
+        granularity = WORD_GRANULARITY
 
-    # Paginate
+    # Paginate; only segments of the requested page are read and diffed
+    hyp_a_path = sub_a.get_hyp_text(path_only=True)
+    hyp_b_path = sub_b.get_hyp_text(path_only=True)
+    data = ZippedSequence(
+        IndexedTextFile(hyp_a_path), IndexedTextFile(hyp_b_path)
+    )
     paginator = Paginator(data, SEGMENTS_PER_PAGE)
     page_num = request.GET.get('page', 1)
     page_data = paginator.get_page(page_num)
 
+    # Text paths are content-addressed, so changed files get new entries
+    cache_key = (hyp_a_path, hyp_b_path, page_data.number, granularity)
+    annotated = _get_cached_diffs(cache_key)
+    if annotated is None:
+        annotated = [
+            _annotate_texts_with_span_diffs(
+                sent1, sent2, char_based=granularity == CHAR_GRANULARITY
+            )
+            for sent1, sent2 in page_data.object_list
+        ]
+        _set_cached_diffs(cache_key, annotated)
+    page_data.object_list = annotated
+
     context = {
         'page': page_data,
         'page_size': SEGMENTS_PER_PAGE,
         'submission_a': str(sub_a),
         'submission_b': str(sub_b),
+        'granularity': granularity,
         'ocelot_team_name': ocelot_team_name,
         'ocelot_team_email': ocelot_team_email,
         'ocelot_team_token': ocelot_team_token,
@@ -1,40 +1,41 @@
 """
 Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
 """
-import json
-from pathlib import Path
-from tempfile import NamedTemporaryFile
-from zipfile import ZIP_DEFLATED
-from zipfile import ZipFile
-
 from django.contrib import admin
-from django.forms.models import model_to_dict
+from django.contrib import messages
+from django.core.files.base import ContentFile
+from django.db.models import Count
+from django.db.models import Q
 from django.http import FileResponse
-
+from django.http import Http404
+from django.http import StreamingHttpResponse
+from django.urls import path
+from django.urls import reverse
+from django.utils.html import format_html
+
+from leaderboard.exports import enqueue_export
+from leaderboard.exports import iter_submission_files
+from leaderboard.exports import iter_testset_files
+from leaderboard.exports import make_team_json
 from leaderboard.models import Competition
+from leaderboard.models import ExportJob
 from leaderboard.models import Language
 from leaderboard.models import Submission
 from leaderboard.models import Team
 from leaderboard.models import TestSet
+from leaderboard.utils import iter_zip_stream
 
 
-def _make_submission_filename(submission):
-    """Creates a readable filename for a submission."""
-    publication_name = submission.submitted_by.publication_name
-    if not submission.submitted_by.publication_name:
-        publication_name = submission.name
-
-    file_extension = submission.hyp_file.name.split('.')[-1]
-
-    filename = 'submissions/{0}.{1}-{2}.{3}.{4}.{5}'.format(
-        submission.test_set.name,
-        submission.test_set.source_language.code,
-        submission.test_set.target_language.code,
-        publication_name,
-        submission.id,
-        file_extension,
+def _make_zip_response(entries, filename):
+    """Streams zip file with (arcname, file) entries to the client."""
+    response = StreamingHttpResponse(
+        iter_zip_stream(entries),
+        content_type='application/x-zip-compressed',
+    )
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+        filename
     )
-    return filename.replace(' ', '_').lower()
+    return response
 
 
 def download_submission_files(modeladmin, request, queryset):
@@ -42,23 +43,9 @@ def download_submission_files(modeladmin, request, queryset):
     del modeladmin  # unused
     del request  # unused
 
-    tmp_file = NamedTemporaryFile(delete=False)
-    with ZipFile(tmp_file, 'w', ZIP_DEFLATED) as zip_file:
-        for submission in queryset:
-            new_filename = _make_submission_filename(submission)
-            zip_file.writestr(
-                Path(new_filename).name,
-                submission.hyp_file.open('rb').read(),
-            )
-
-    tmp_file.seek(0)
-    response = FileResponse(
-        open(tmp_file.name, 'rb'),
-        as_attachment=True,
-        content_type='application/x-zip-compressed',
-        filename='submissions.zip',
+    return _make_zip_response(
+        iter_submission_files(queryset), 'submissions.zip'
     )
-    return response
 
 
 download_submission_files.short_description = (  # type: ignore
@@ -71,38 +58,7 @@ def download_testset_files(modeladmin, request, queryset):
     del modeladmin  # unused
     del request  # unused
 
-    tmp_file = NamedTemporaryFile(delete=False)
-    with ZipFile(tmp_file, 'w', ZIP_DEFLATED) as zip_file:
-        for test_set in queryset:
-            for the_file in (test_set.src_file, test_set.ref_file):
-                file_extension = the_file.name.split('.')[-1]
-
-                file_type = 'src'
-                if the_file == test_set.ref_file:
-                    file_type = 'ref'
-
-                new_filename = 'testsets/{0}.{1}-{2}.{3}.{4}'.format(
-                    test_set.name,
-                    test_set.source_language.code,
-                    test_set.target_language.code,
-                    file_type,
-                    file_extension,
-                )
-                new_filename.replace(' ', '_').lower()
-
-                zip_file.writestr(
-                    Path(new_filename).name,
-                    the_file.open('rb').read(),
-                )
-
-    tmp_file.seek(0)
-    response = FileResponse(
-        open(tmp_file.name, 'rb'),
-        as_attachment=True,
-        content_type='application/x-zip-compressed',
-        filename='testsets.zip',
-    )
-    return response
+    return _make_zip_response(iter_testset_files(queryset), 'testsets.zip')
 
 
 download_testset_files.short_description = (  # type: ignore
@@ -110,6 +66,92 @@ download_testset_files.short_description = (  # type: ignore
 )
 
 
+def _enqueue_export(modeladmin, request, description, **objects):
+    """Enqueues export job and tells the admin where to find it."""
+    job = enqueue_export(description, **objects)
+    url = reverse('admin:leaderboard_exportjob_changelist')
+    modeladmin.message_user(
+        request,
+        format_html(
+            '{0} has been queued. Follow its progress in '
+            '<a href="{1}">export jobs</a>.',
+            job,
+            url,
+        ),
+        messages.SUCCESS,
+    )
+
+
+def export_submission_files(modeladmin, request, queryset):
+    """Enqueues export of XML, SGML or text files for queryset."""
+    _enqueue_export(
+        modeladmin,
+        request,
+        '{0} submission(s)'.format(queryset.count()),
+        submissions=queryset,
+    )
+
+
+export_submission_files.short_description = (  # type: ignore
+    "Export XML, SGML or text files for selected submissions in background"
+)
+
+
+def export_testset_files(modeladmin, request, queryset):
+    """Enqueues export of XML, SGML or text files for queryset."""
+    _enqueue_export(
+        modeladmin,
+        request,
+        '{0} test set(s)'.format(queryset.count()),
+        test_sets=queryset,
+    )
+
+
+export_testset_files.short_description = (  # type: ignore
+    "Export XML, SGML or text files for selected test sets in background"
+)
+
+
+def export_team_file(modeladmin, request, queryset):
+    """Enqueues export of JSON file with team information for queryset."""
+    _enqueue_export(
+        modeladmin,
+        request,
+        '{0} team(s)'.format(queryset.count()),
+        teams=queryset,
+    )
+
+
+export_team_file.short_description = (  # type: ignore
+    "Export JSON file with primary submissions for selected teams "
+    "in background"
+)
+
+
+def export_competition_files(modeladmin, request, queryset):
+    """Enqueues export of submissions, test sets and teams for queryset."""
+    for competition in queryset:
+        submissions = Submission.objects.filter(
+            test_set__competition=competition
+        )
+        _enqueue_export(
+            modeladmin,
+            request,
+            str(competition),
+            submissions=submissions,
+            test_sets=TestSet.objects.filter(competition=competition),
+            teams=Team.objects.filter(
+                id__in=submissions.values('submitted_by')
+            ),
+        )
+
+
+export_competition_files.short_description = (  # type: ignore
+    "Export submissions, test sets and teams for selected competitions "
+    "in background"
+)
+
+
 class LanguageAdmin(admin.ModelAdmin):
     """Model admin for Language objects."""
 
@@ -121,7 +163,11 @@ class LanguageAdmin(admin.ModelAdmin):
 class SubmissionAdmin(admin.ModelAdmin):
     """Model admin for Submission objects."""
 
-    actions = [download_submission_files, download_testset_files]
+    actions = [
+        download_submission_files,
+        download_testset_files,
+        export_submission_files,
+    ]
 
     fields = [
         'name',
@@ -139,6 +185,7 @@ class SubmissionAdmin(admin.ModelAdmin):
         'is_withdrawn',
         'score',
         'score_chrf',
+        'score_status',
     ]
 
     list_display = [
@@ -151,9 +198,16 @@ class SubmissionAdmin(admin.ModelAdmin):
         'file_format',
         '_score',
         '_chrf',
+        'score_status',
         'date_created',
     ]
 
+    list_select_related = (
+        'submitted_by',
+        'test_set__source_language',
+        'test_set__target_language',
+    )
+
     list_filter = [
         'test_set',
         'test_set__source_language',
@@ -168,6 +222,7 @@ class SubmissionAdmin(admin.ModelAdmin):
         'is_removed',
         'is_valid',
         'is_withdrawn',
+        'score_status',
     ]
 
     ordering = (
@@ -184,70 +239,12 @@ def download_team_file(modeladmin, request, queryset):
     del modeladmin  # unused
     del request  # unused
 
-    team_list = []
-    for team in queryset:
-        team_data = model_to_dict(
-            team,
-            fields=[
-                'description',
-                'email',
-                'institution_name',
-                'name',
-                'publication_name',
-                'publication_url',
-            ],
-        )
-
-        primary_submissions = team.submission_set.filter(
-            is_primary=True, is_valid=True
-        )
-        team_data['number_of_primary_submissions'] = len(
-            primary_submissions
-        )
-
-        submission_list = []
-        for submission in primary_submissions:
-            submission_data = model_to_dict(
-                submission,
-                fields=[
-                    'is_constrained',
-                    'is_primary',
-                    'is_removed',
-                    'score',
-                    'score_chrf',
-                ],
-            )
-            submission_data[
-                'competition'
-            ] = submission.test_set.competition.name
-            submission_data['file_name'] = _make_submission_filename(
-                submission
-            )
-            submission_data['submission_id'] = submission.id
-            submission_data['test_set'] = submission.test_set.name
-            language_pair = "{0}-{1}".format(
-                submission.test_set.source_language.code,
-                submission.test_set.target_language.code,
-            )
-            submission_data['language_pair'] = language_pair
-            submission_list.append(submission_data)
-        team_data['primary_submissions'] = submission_list
-
-        team_list.append(team_data)
-    team_json = json.dumps(list(team_list), indent=2, sort_keys=True)
+    team_json = make_team_json(queryset)
 
-    tmp_file = NamedTemporaryFile(delete=False)
-    with ZipFile(tmp_file, 'w', ZIP_DEFLATED) as zip_file:
-        zip_file.writestr('teams.json', team_json)
-
-    tmp_file.seek(0)
-    response = FileResponse(
-        open(tmp_file.name, 'rb'),
-        as_attachment=True,
-        content_type='application/x-zip-compressed',
-        filename='teams.zip',
+    return _make_zip_response(
+        [('teams.json', ContentFile(team_json.encode('utf-8')))],
+        'teams.zip',
     )
-    return response
 
 
 download_team_file.short_description = (  # type: ignore
@@ -258,7 +255,7 @@ download_team_file.short_description = (  # type: ignore
 class TeamAdmin(admin.ModelAdmin):
     """Model admin for Team objects."""
 
-    actions = [download_team_file]
+    actions = [download_team_file, export_team_file]
 
     fields = [
         'name',
@@ -291,10 +288,36 @@ class TeamAdmin(admin.ModelAdmin):
 
     ordering = ('name',)
 
+    def get_queryset(self, request):
+        # Count submissions for all rows in the changelist query
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                submission_count=Count('submission'),
+                primary_submission_count=Count(
+                    'submission', filter=Q(submission__is_primary=True)
+                ),
+            )
+        )
+
+    @admin.display(description='Submissions', ordering='submission_count')
+    def _submissions(self, obj):
+        return obj.submission_count
+
+    @admin.display(
+        description='Primary submissions',
+        ordering='primary_submission_count',
+    )
+    def _primary_submissions(self, obj):
+        return obj.primary_submission_count
+
 
 class TestSetAdmin(admin.ModelAdmin):
     """Model admin for TestSet objects."""
 
+    actions = [download_testset_files, export_testset_files]
+
     fields = [
         'name',
         'source_language',
@@ -330,6 +353,8 @@ class TestSetAdmin(admin.ModelAdmin):
 class CompetitionAdmin(admin.ModelAdmin):
     """Model admin for Competition objects."""
 
+    actions = [export_competition_files]
+
     fields = [
         'name',
         'description',
@@ -353,8 +378,87 @@ class CompetitionAdmin(admin.ModelAdmin):
     ordering = ('-name',)
 
 
+class ExportJobAdmin(admin.ModelAdmin):
+    """Model admin for ExportJob objects."""
+
+    fields = [
+        'description',
+        'status',
+        'processed_files',
+        'total_files',
+        'error',
+        'date_created',
+        'date_finished',
+    ]
+
+    readonly_fields = [
+        'description',
+        'status',
+        'processed_files',
+        'total_files',
+        'error',
+        'date_created',
+        'date_finished',
+    ]
+
+    list_display = [
+        '__str__',
+        'status',
+        '_progress',
+        'date_created',
+        'date_finished',
+        '_download',
+    ]
+
+    list_filter = ['status']
+
+    ordering = ('-date_created',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:job_id>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='leaderboard_exportjob_download',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, job_id):
+        """Sends zip file of a finished export job."""
+        del request  # unused
+
+        job = ExportJob.objects.filter(id=job_id).first()
+        if job is None or not job.archive:
+            raise Http404('Export #{0} has no zip file'.format(job_id))
+
+        return FileResponse(
+            job.archive.open('rb'),
+            as_attachment=True,
+            content_type='application/x-zip-compressed',
+            filename='export-{0}.zip'.format(job.id),
+        )
+
+    @admin.display(description='Progress')
+    def _progress(self, obj):
+        return '{0} / {1}'.format(obj.processed_files, obj.total_files)
+
+    @admin.display(description='Download')
+    def _download(self, obj):
+        if not obj.archive:
+            return '-'
+        url = reverse(
+            'admin:leaderboard_exportjob_download', args=[obj.id]
+        )
+        return format_html('<a href="{0}">export-{1}.zip</a>', url, obj.id)
+
+
 admin.site.register(Language, LanguageAdmin)
 admin.site.register(Submission, SubmissionAdmin)
 admin.site.register(Team, TeamAdmin)
 admin.site.register(TestSet, TestSetAdmin)
 admin.site.register(Competition, CompetitionAdmin)
+admin.site.register(ExportJob, ExportJobAdmin)
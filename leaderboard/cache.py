@@ -0,0 +1,112 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+
+from ocelot.settings import PAGE_CACHE_TIMEOUT
+from ocelot.settings import TEAM_CACHE_TIMEOUT
+
+# Page scopes; cached pages are invalidated by bumping the scope version
+COMPETITION_SCOPE = 'competition'  # pages of a single competition
+COMPETITIONS_SCOPE = 'competitions'  # pages listing all competitions
+STATIC_SCOPE = 'static'  # pages which do not depend on the database
+
+
+def _get_version_key(scope, competition_id=None):
+    if scope == COMPETITION_SCOPE:
+        return 'ocelot:version:competition:{0}'.format(competition_id)
+    return 'ocelot:version:{0}'.format(scope)
+
+
+def get_page_version(scope, competition_id=None):
+    """Returns the current cache version for the page scope."""
+    key = _get_version_key(scope, competition_id)
+    cache.add(key, 1, timeout=None)
+    return cache.get(key, 1)
+
+
+def _bump_page_version(scope, competition_id=None):
+    key = _get_version_key(scope, competition_id)
+    try:
+        cache.incr(key)
+    except ValueError:  # Key does not exist or has been evicted
+        cache.set(key, 2, timeout=None)
+
+
+def invalidate_competition_pages(*competition_ids):
+    """Invalidates cached pages of the given competitions.
+
+    Pages listing all competitions are invalidated as well.
+    """
+    for competition_id in set(competition_ids) - {None}:
+        _bump_page_version(COMPETITION_SCOPE, competition_id)
+    _bump_page_version(COMPETITIONS_SCOPE)
+
+
+def _is_cacheable_request(request):
+    """Checks if the request is anonymous and without pending messages."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    # Signed-in teams see their own navigation, so never share their pages
+    if request.session.get('ocelot_team_token'):
+        return False
+
+    # len() does not mark messages as used, unlike iterating over them
+    return len(get_messages(request)) == 0
+
+
+def cache_anonymous_page(scope=STATIC_SCOPE):
+    """Caches full responses of the view for anonymous requests.
+
+    For COMPETITION_SCOPE, the view must take a competition_id argument.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            competition_id = None
+            if scope == COMPETITION_SCOPE:
+                competition_id = kwargs.get('competition_id')
+
+            key = 'ocelot:page:{0}:{1}:{2}:{3}'.format(
+                scope,
+                competition_id,
+                get_page_version(scope, competition_id),
+                request.get_full_path(),
+            )
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.cookies:
+                    cache.set(key, response, PAGE_CACHE_TIMEOUT)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _get_team_key(token):
+    return 'ocelot:team:{0}'.format(token)
+
+
+def get_cached_team_data(token):
+    """Returns cached (name, email, is_verified) tuple for team token."""
+    return cache.get(_get_team_key(token))
+
+
+def set_cached_team_data(token, team_data):
+    """Caches (name, email, is_verified) tuple for team token."""
+    cache.set(_get_team_key(token), team_data, TEAM_CACHE_TIMEOUT)
+
+
+def invalidate_team_data(*tokens):
+    """Invalidates cached data of teams with the given tokens."""
+    cache.delete_many([_get_team_key(x) for x in set(tokens) if x])
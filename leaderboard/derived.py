@@ -0,0 +1,126 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import hashlib
+import json
+import os
+import time
+from uuid import uuid4
+
+from django.conf import settings
+
+from leaderboard.utils import build_line_index
+from leaderboard.utils import file_sha256
+from leaderboard.utils import get_line_index_path
+
+# Derived files younger than this are never collected, as they may belong
+# to an upload which is still being processed
+GC_GRACE_SECONDS = 3600
+
+# Part of every key; bump it when an extraction function changes its output
+# so that existing derived files are extracted again
+DERIVED_VERSION = 2
+
+
+def get_derived_key(source_path, extract, dependencies=(), **params):
+    """
+    Returns the key of a derived file. The key is the SHA-256 of the source
+    and dependency file contents, the extraction function and parameters,
+    and DERIVED_VERSION.
+    """
+    key_data = json.dumps(
+        [
+            DERIVED_VERSION,
+            file_sha256(source_path),
+            [file_sha256(x) for x in dependencies],
+            extract.__name__,
+            params,
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+
+def get_derived_path(key, suffix='.txt'):
+    """Returns path of the derived file with the given key."""
+    return os.path.join(settings.DERIVED_ROOT, key[:2], key + suffix)
+
+
+def derive_file(
+    source_path,
+    extract,
+    suffix='.txt',
+    dependencies=(),
+    create=True,
+    **params
+):
+    """
+    Returns path of the file derived from source_path by calling
+    extract(source_path, target_path, *dependencies, **params).
+
+    Derived files are content-addressed, see get_derived_key(), so
+    identical uploads share one file and changed uploads are extracted
+    again. Text files get a line-offset index. If create is False, or the
+    extraction does not write anything, the returned path may not exist.
+    """
+    derived_path = get_derived_path(
+        get_derived_key(source_path, extract, dependencies, **params),
+        suffix,
+    )
+    if not create or os.path.exists(derived_path):
+        return derived_path
+
+    os.makedirs(os.path.dirname(derived_path), exist_ok=True)
+
+    # Extract to a unique temporary file, so concurrent extractions of the
+    # same file never see partial results
+    tmp_path = '{0}.{1}.tmp'.format(derived_path, uuid4().hex)
+    tmp_idx_path = get_line_index_path(tmp_path)
+    try:
+        extract(source_path, tmp_path, *dependencies, **params)
+        if os.path.exists(tmp_path):
+            if suffix == '.txt':
+                build_line_index(tmp_path)
+                os.replace(tmp_idx_path, get_line_index_path(derived_path))
+            os.replace(tmp_path, derived_path)
+    finally:
+        for path in (tmp_path, tmp_idx_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    return derived_path
+
+
+def iter_derived_files():
+    """Yields paths of all files in the derived file store."""
+    for dir_path, _, file_names in os.walk(settings.DERIVED_ROOT):
+        for file_name in file_names:
+            yield os.path.join(dir_path, file_name)
+
+
+def collect_garbage(live_paths, dry_run=False):
+    """
+    Deletes derived files which are not in live_paths, including their
+    line-offset indexes. Files younger than GC_GRACE_SECONDS are kept.
+
+    Returns the list of deleted (or, if dry_run, deletable) paths.
+    """
+    live_paths = {os.path.abspath(x) for x in live_paths if x}
+    live_paths.update(get_line_index_path(x) for x in list(live_paths))
+    threshold = time.time() - GC_GRACE_SECONDS
+
+    deleted = []
+    for path in iter_derived_files():
+        if os.path.abspath(path) in live_paths:
+            continue
+
+        try:
+            if os.path.getmtime(path) > threshold:
+                continue
+            if not dry_run:
+                os.unlink(path)
+        except FileNotFoundError:  # Deleted by a concurrent process
+            continue
+        deleted.append(path)
+
+    return deleted
@@ -0,0 +1,313 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import QuerySet
+from django.forms.models import model_to_dict
+from django.utils import timezone
+
+from leaderboard.models import EXPORT_DONE
+from leaderboard.models import EXPORT_FAILED
+from leaderboard.models import EXPORT_QUEUED
+from leaderboard.models import EXPORT_RUNNING
+from leaderboard.models import ExportJob
+from leaderboard.models import get_primary_submissions
+from leaderboard.models import Submission
+from leaderboard.models import Team
+from leaderboard.models import TestSet
+from leaderboard.utils import write_zip_file
+from ocelot.settings import EXPORT_READ_WORKERS
+from ocelot.settings import EXPORT_RETENTION_DAYS
+
+# Number of queued export jobs inspected per attempt to claim a job
+EXPORT_QUEUE_BATCH_SIZE = 10
+
+# Progress of export jobs is saved after this number of files
+EXPORT_PROGRESS_STEP = 20
+
+LOGGER = logging.getLogger(__name__)
+
+
+def make_submission_filename(submission):
+    """Creates a readable filename for a submission."""
+    publication_name = submission.submitted_by.publication_name
+    if not submission.submitted_by.publication_name:
+        publication_name = submission.name
+
+    file_extension = submission.hyp_file.name.split('.')[-1]
+
+    filename = 'submissions/{0}.{1}-{2}.{3}.{4}.{5}'.format(
+        submission.test_set.name,
+        submission.test_set.source_language.code,
+        submission.test_set.target_language.code,
+        publication_name,
+        submission.id,
+        file_extension,
+    )
+    return filename.replace(' ', '_').lower()
+
+
+def iter_submission_files(queryset):
+    """Yields (file name, file) pairs for submissions in queryset."""
+    submissions = queryset.select_related(
+        'submitted_by',
+        'test_set__source_language',
+        'test_set__target_language',
+    )
+    for submission in submissions.iterator():
+        new_filename = make_submission_filename(submission)
+        yield Path(new_filename).name, submission.hyp_file
+
+
+def iter_testset_files(queryset):
+    """Yields (file name, file) pairs for test sets in queryset."""
+    test_sets = queryset.select_related(
+        'source_language', 'target_language'
+    )
+    for test_set in test_sets.iterator():
+        for the_file in (test_set.src_file, test_set.ref_file):
+            if not the_file:  # Reference file may not exist
+                continue
+
+            file_extension = the_file.name.split('.')[-1]
+
+            file_type = 'src'
+            if the_file == test_set.ref_file:
+                file_type = 'ref'
+
+            new_filename = 'testsets/{0}.{1}-{2}.{3}.{4}'.format(
+                test_set.name,
+                test_set.source_language.code,
+                test_set.target_language.code,
+                file_type,
+                file_extension,
+            )
+            new_filename.replace(' ', '_').lower()
+
+            yield Path(new_filename).name, the_file
+
+
+def make_team_json(queryset):
+    """Creates JSON with team information and primary submissions."""
+    team_list = []
+    for team in queryset:
+        team_data = model_to_dict(
+            team,
+            fields=[
+                'description',
+                'email',
+                'institution_name',
+                'name',
+                'publication_name',
+                'publication_url',
+            ],
+        )
+
+        primary_submissions = get_primary_submissions(team)
+        team_data['number_of_primary_submissions'] = len(
+            primary_submissions
+        )
+
+        submission_list = []
+        for submission in primary_submissions:
+            submission_data = model_to_dict(
+                submission,
+                fields=[
+                    'is_constrained',
+                    'is_primary',
+                    'is_removed',
+                    'score',
+                    'score_chrf',
+                ],
+            )
+            competition = submission.test_set.competition
+            submission_data['competition'] = competition.name
+            submission_data['file_name'] = make_submission_filename(
+                submission
+            )
+            submission_data['submission_id'] = submission.id
+            submission_data['test_set'] = submission.test_set.name
+            language_pair = "{0}-{1}".format(
+                submission.test_set.source_language.code,
+                submission.test_set.target_language.code,
+            )
+            submission_data['language_pair'] = language_pair
+            submission_list.append(submission_data)
+        team_data['primary_submissions'] = submission_list
+
+        team_list.append(team_data)
+    return json.dumps(list(team_list), indent=2, sort_keys=True)
+
+
+def _get_sorted_ids(objects):
+    """Returns sorted ids of objects; querysets only select the ids."""
+    if isinstance(objects, QuerySet):
+        return list(objects.order_by('id').values_list('id', flat=True))
+    return sorted(x.id for x in objects)
+
+
+def enqueue_export(description, submissions=(), test_sets=(), teams=()):
+    """Creates an export job for the given objects or querysets."""
+    return ExportJob.objects.create(
+        description=description,
+        submission_ids=_get_sorted_ids(submissions),
+        test_set_ids=_get_sorted_ids(test_sets),
+        team_ids=_get_sorted_ids(teams),
+    )
+
+
+def _read_file(the_file):
+    """Returns content of a Django File."""
+    with the_file.open('rb') as opened_file:
+        return opened_file.read()
+
+
+def _iter_prefetched_files(entries, workers):
+    """
+    Yields (file name, ContentFile) pairs in the order of entries while
+    up to 2 * workers files are read in parallel threads.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()  # type: deque
+        for arcname, the_file in entries:
+            pending.append(
+                (arcname, executor.submit(_read_file, the_file))
+            )
+            if len(pending) >= 2 * workers:
+                arcname, future = pending.popleft()
+                yield arcname, ContentFile(future.result())
+
+        while pending:
+            arcname, future = pending.popleft()
+            yield arcname, ContentFile(future.result())
+
+
+def _get_export_entries(job):
+    """Returns list of (file name, file) pairs exported by the job."""
+    entries = []
+    if job.submission_ids:
+        entries.extend(
+            iter_submission_files(
+                Submission.objects.filter(id__in=job.submission_ids)
+            )
+        )
+
+    if job.test_set_ids:
+        entries.extend(
+            iter_testset_files(
+                TestSet.objects.filter(id__in=job.test_set_ids)
+            )
+        )
+
+    if job.team_ids:
+        team_json = make_team_json(
+            Team.objects.filter(id__in=job.team_ids)
+        )
+        entries.append(('teams.json', ContentFile(team_json.encode())))
+
+    return entries
+
+
+def _track_progress(job, entries):
+    """Yields entries while saving progress of the job."""
+    for processed, entry in enumerate(entries, start=1):
+        yield entry
+        if processed % EXPORT_PROGRESS_STEP == 0:
+            ExportJob.objects.filter(id=job.id).update(
+                processed_files=processed
+            )
+
+
+def run_export_job(job, workers=EXPORT_READ_WORKERS):
+    """Builds the zip file for the export job."""
+    entries = _get_export_entries(job)
+    job.total_files = len(entries)
+    job.save(update_fields=['total_files'])
+
+    archive_name = 'exports/export-{0}.zip'.format(job.id)
+    archive_path = default_storage.path(archive_name)
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+
+    # Write to a temporary file first so nobody downloads partial files
+    with NamedTemporaryFile(
+        dir=os.path.dirname(archive_path), delete=False
+    ) as tmp_file:
+        try:
+            write_zip_file(
+                tmp_file,
+                _track_progress(
+                    job, _iter_prefetched_files(entries, workers)
+                ),
+            )
+        except BaseException:
+            os.unlink(tmp_file.name)
+            raise
+    os.replace(tmp_file.name, archive_path)
+
+    job.archive.name = archive_name
+    job.processed_files = job.total_files
+    job.save(update_fields=['archive', 'processed_files'])
+
+
+def export_next_job():
+    """Claims the oldest queued export job and runs it.
+
+    Returns the finished job, or None if the queue is empty.
+    """
+    queued_ids = (
+        ExportJob.objects.filter(status=EXPORT_QUEUED)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+    for job_id in queued_ids[:EXPORT_QUEUE_BATCH_SIZE]:
+        # The conditional update guarantees that concurrent workers cannot
+        # claim the same job
+        claimed = ExportJob.objects.filter(
+            id=job_id, status=EXPORT_QUEUED
+        ).update(status=EXPORT_RUNNING)
+        if not claimed:
+            continue  # Another worker has been faster
+
+        job = ExportJob.objects.get(id=job_id)
+        try:
+            run_export_job(job)
+            job.status = EXPORT_DONE
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.exception('Export job #%s failed', job_id)
+            job.status = EXPORT_FAILED
+            job.error = str(error)
+        job.date_finished = timezone.now()
+        job.save(update_fields=['status', 'error', 'date_finished'])
+        return job
+
+    return None
+
+
+def purge_old_exports(retention_days=EXPORT_RETENTION_DAYS):
+    """Deletes export jobs and their files older than retention_days.
+
+    Returns the number of deleted jobs.
+    """
+    threshold = timezone.now() - timedelta(days=retention_days)
+    old_jobs = ExportJob.objects.filter(
+        date_created__lt=threshold
+    ).exclude(status=EXPORT_RUNNING)
+
+    deleted = 0
+    for job in old_jobs:
+        if job.archive:
+            job.archive.delete(save=False)
+        job.delete()
+        deleted += 1
+    return deleted
@@ -0,0 +1,3 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
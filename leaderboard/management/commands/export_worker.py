@@ -0,0 +1,49 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from leaderboard.exports import export_next_job
+from leaderboard.exports import purge_old_exports
+
+
+class Command(BaseCommand):
+    """Builds zip files for queued export jobs."""
+
+    help = 'Builds zip files for queued export jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the export queue is empty',
+        )
+        parser.add_argument(
+            '--sleep',
+            default=5.0,
+            type=float,
+            help='Seconds to wait while the export queue is empty',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = export_next_job()
+            if job is not None:
+                self.stdout.write(
+                    'Exported job #{0}: {1} ({2} file(s))'.format(
+                        job.id, job.status, job.total_files
+                    )
+                )
+                continue
+
+            purged = purge_old_exports()
+            if purged:
+                self.stdout.write(
+                    'Purged {0} old export job(s)'.format(purged)
+                )
+
+            if options['once']:
+                break
+            sleep(options['sleep'])
@@ -0,0 +1,48 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+from django.core.management.base import BaseCommand
+
+from leaderboard.derived import collect_garbage
+from leaderboard.models import Submission
+from leaderboard.models import TestSet
+
+
+class Command(BaseCommand):
+    """Deletes derived files which no test set or submission uses."""
+
+    help = (
+        'Deletes files in DERIVED_ROOT which are not derived from any '
+        'current test set or submission file'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List unused derived files without deleting them',
+        )
+
+    def handle(self, *args, **options):
+        live_paths = []
+        for test_set in TestSet.objects.iterator():
+            try:
+                live_paths.extend(test_set.get_derived_paths())
+            except OSError:  # Uploaded file is missing
+                continue
+
+        submissions = Submission.objects.select_related('test_set')
+        for submission in submissions.iterator():
+            try:
+                live_paths.extend(submission.get_derived_paths())
+            except OSError:  # Uploaded file is missing
+                continue
+
+        deleted = collect_garbage(live_paths, dry_run=options['dry_run'])
+        for path in deleted:
+            self.stdout.write(path)
+        self.stdout.write(
+            '{0} {1} unused derived file(s)'.format(
+                'Found' if options['dry_run'] else 'Deleted', len(deleted)
+            )
+        )
@@ -0,0 +1,21 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+from django.core.management.base import BaseCommand
+
+from leaderboard.models import reconcile_primary_submissions
+
+
+class Command(BaseCommand):
+    """Stores default primary submissions for teams without a choice."""
+
+    help = (
+        'Stores the highest-scoring or latest submission as primary for '
+        'every team and test set without a primary submission'
+    )
+
+    def handle(self, *args, **options):
+        reconciled = reconcile_primary_submissions()
+        self.stdout.write(
+            'Selected {0} primary submission(s)'.format(reconciled)
+        )
@@ -0,0 +1,37 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+
+from django.core.management.base import BaseCommand
+
+from leaderboard.models import refresh_leaderboards
+from leaderboard.models import TestSet
+
+
+class Command(BaseCommand):
+    """Rebuilds precomputed leaderboard entries."""
+
+    help = 'Rebuilds precomputed leaderboard entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--competition',
+            type=int,
+            help='Refresh the leaderboard of this competition only',
+        )
+
+    def handle(self, *args, **options):
+        test_sets = TestSet.objects.filter(competition__isnull=False)
+        if options['competition']:
+            test_sets = test_sets.filter(
+                competition__id=options['competition']
+            )
+
+        test_set_ids = list(test_sets.values_list('id', flat=True))
+        refresh_leaderboards(test_set_ids)
+
+        self.stdout.write(
+            'Refreshed leaderboards for {0} test set(s)'.format(
+                len(test_set_ids)
+            )
+        )
@@ -0,0 +1,173 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from leaderboard.cache import invalidate_competition_pages
+from leaderboard.models import refresh_leaderboards
+from leaderboard.models import SCORE_DONE
+from leaderboard.models import SCORE_FAILED
+from leaderboard.models import Submission
+from leaderboard.utils import compute_scores
+
+BULK_UPDATE_BATCH_SIZE = 500
+
+
+def _rescore(job):
+    """Computes scores for a (submission id, hyp, ref, tokenize, stats) job.
+
+    Runs in a worker process, hence it must not access the database.
+    """
+    submission_id, hyp_text_path, ref_text_path, tokenize, stats_path = job
+    try:
+        bleu, chrf = compute_scores(
+            hyp_text_path, ref_text_path, tokenize, stats_path
+        )
+    except Exception:  # pylint: disable=broad-except
+        return submission_id, -1, None, SCORE_FAILED
+    return submission_id, bleu, chrf, SCORE_DONE
+
+
+class Command(BaseCommand):
+    """Recomputes automatic scores for many submissions in parallel."""
+
+    help = 'Recomputes automatic scores for many submissions in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--competition',
+            type=int,
+            help='Rescore submissions to all test sets of this competition',
+        )
+        parser.add_argument(
+            '--test-set',
+            type=int,
+            help='Rescore submissions to this test set',
+        )
+        parser.add_argument(
+            '--language-pair',
+            help='Rescore submissions for this language pair, e.g. en-de',
+        )
+        parser.add_argument(
+            '--workers',
+            default=os.cpu_count(),
+            type=int,
+            help='Number of worker processes (default: number of cores)',
+        )
+
+    def handle(self, *args, **options):
+        if not any(
+            options[x]
+            for x in ('competition', 'test_set', 'language_pair')
+        ):
+            raise CommandError(
+                'Specify --competition, --test-set or --language-pair'
+            )
+
+        submissions = Submission.objects.filter(
+            test_set__compute_scores=True,
+        ).select_related('test_set__target_language')
+
+        if options['competition']:
+            submissions = submissions.filter(
+                test_set__competition__id=options['competition']
+            )
+
+        if options['test_set']:
+            submissions = submissions.filter(
+                test_set__id=options['test_set']
+            )
+
+        if options['language_pair']:
+            try:
+                source, target = options['language_pair'].split('-')
+            except ValueError:
+                raise CommandError(
+                    'Invalid language pair {0}'.format(
+                        options['language_pair']
+                    )
+                )
+            submissions = submissions.filter(
+                test_set__source_language__code=source,
+                test_set__target_language__code=target,
+            )
+
+        start_time = perf_counter()
+
+        # Text files are extracted in the main process, only the scoring
+        # itself is fanned out to the worker processes
+        by_id = {}
+        jobs = []
+        stats_paths = {}
+        for submission in submissions.order_by('id'):
+            test_set = submission.test_set
+            if not test_set.has_references():
+                continue
+
+            by_id[submission.id] = submission
+            try:
+                # Precompute reference statistics once per test set, so
+                # that worker processes only process the hypotheses
+                if test_set.id not in stats_paths:
+                    test_set._cache_reference_stats()  # pylint: disable=protected-access
+                    stats_path = test_set.get_ref_stats_path()
+                    stats_paths[test_set.id] = stats_path
+
+                jobs.append(
+                    (
+                        submission.id,
+                        submission.get_hyp_text(path_only=True),
+                        submission.get_ref_text(path_only=True),
+                        test_set.get_tokenize(),
+                        stats_paths[test_set.id],
+                    )
+                )
+            except Exception:  # pylint: disable=broad-except
+                submission.score = -1
+                submission.score_chrf = None
+                submission.score_status = SCORE_FAILED
+
+        workers = max(1, options['workers'] or 1)
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for submission_id, bleu, chrf, status in executor.map(
+                _rescore, jobs, chunksize=chunksize
+            ):
+                submission = by_id[submission_id]
+                submission.score = bleu
+                submission.score_chrf = chrf
+                submission.score_status = status
+
+        Submission.objects.bulk_update(
+            by_id.values(),
+            ['score', 'score_chrf', 'score_status'],
+            batch_size=BULK_UPDATE_BATCH_SIZE,
+        )
+
+        # bulk_update() bypasses save(), so refresh leaderboards explicitly
+        refresh_leaderboards(
+            {submission.test_set_id for submission in by_id.values()}
+        )
+        invalidate_competition_pages(
+            *{
+                submission.test_set.competition_id
+                for submission in by_id.values()
+            }
+        )
+
+        elapsed = perf_counter() - start_time
+        failed = len(
+            [x for x in by_id.values() if x.score_status == SCORE_FAILED]
+        )
+        throughput = len(by_id) / elapsed if elapsed else 0.0
+        self.stdout.write(
+            'Rescored {0} submission(s), {1} failed, with {2} worker(s) '
+            'in {3:.2f}s ({4:.1f} submissions/s)'.format(
+                len(by_id), failed, workers, elapsed, throughput
+            )
+        )
@@ -0,0 +1,57 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from leaderboard.models import requeue_running_submissions
+from leaderboard.models import score_next_submission
+
+
+class Command(BaseCommand):
+    """Computes automatic scores for queued submissions."""
+
+    help = 'Computes automatic scores for queued submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the scoring queue is empty',
+        )
+        parser.add_argument(
+            '--sleep',
+            default=5.0,
+            type=float,
+            help='Seconds to wait while the scoring queue is empty',
+        )
+        parser.add_argument(
+            '--requeue-running',
+            action='store_true',
+            help='Requeue submissions left running by a terminated worker',
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue_running']:
+            requeued = requeue_running_submissions()
+            self.stdout.write(
+                'Requeued {0} submission(s)'.format(requeued)
+            )
+
+        while True:
+            submission = score_next_submission()
+            if submission is not None:
+                self.stdout.write(
+                    'Scored submission #{0}: {1} (BLEU={2}, chrF={3})'.format(
+                        submission.id,
+                        submission.score_status,
+                        submission.score,
+                        submission.score_chrf,
+                    )
+                )
+                continue
+
+            if options['once']:
+                break
+            sleep(options['sleep'])
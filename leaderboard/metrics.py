@@ -0,0 +1,530 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import fcntl
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from datetime import timezone
+from glob import glob
+from uuid import uuid4
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.django import reraise
+from django.template.backends.django import Template
+
+from ocelot.settings import METRICS_FLUSH_SECONDS
+from ocelot.settings import SLOW_REQUEST_SECONDS
+from ocelot.settings import SLOW_REQUEST_TOP_QUERIES
+
+# Upper bounds in seconds of request duration histogram buckets
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Files in METRICS_ROOT holding metrics of exited processes and the lock
+# serializing merges into it, see merge_exited_processes()
+MERGED_METRICS_FILE = 'merged.json'
+METRICS_LOCK_FILE = 'merged.lock'
+
+# Metric names mapped to (type, help text)
+METRIC_FAMILIES = {
+    'ocelot_http_requests_total': (
+        'counter',
+        'Requests by view, method and status code.',
+    ),
+    'ocelot_http_request_duration_seconds': (
+        'histogram',
+        'Wall time of requests by view.',
+    ),
+    'ocelot_http_response_bytes_total': (
+        'counter',
+        'Bytes served by view.',
+    ),
+    'ocelot_db_queries_total': (
+        'counter',
+        'Database queries by view.',
+    ),
+    'ocelot_db_query_duration_seconds_total': (
+        'counter',
+        'Time spent in database queries by view.',
+    ),
+    'ocelot_template_render_duration_seconds_total': (
+        'counter',
+        'Time spent rendering templates by view.',
+    ),
+    'ocelot_slow_requests_total': (
+        'counter',
+        'Requests slower than SLOW_REQUEST_SECONDS by view.',
+    ),
+}
+
+LOGGER = logging.getLogger('ocelot.performance')
+SLOW_LOGGER = logging.getLogger('ocelot.performance.slow')
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    """Queries and template render time of the current request.
+
+    Only the slowest SQL statements are kept, without parameters, so
+    tokens and other submitted values never end up in the logs.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self._top_queries = []
+        self._counter = itertools.count()
+
+    def add_query(self, sql, elapsed):
+        """Adds a query, keeping the slowest SLOW_REQUEST_TOP_QUERIES."""
+        self.queries += 1
+        self.query_time += elapsed
+        entry = (elapsed, next(self._counter), sql)
+        if len(self._top_queries) < SLOW_REQUEST_TOP_QUERIES:
+            heapq.heappush(self._top_queries, entry)
+        elif entry > self._top_queries[0]:
+            heapq.heapreplace(self._top_queries, entry)
+
+    def get_top_queries(self):
+        """Returns (sql, seconds) of the slowest queries, slowest first."""
+        return [
+            (sql, elapsed)
+            for elapsed, _, sql in sorted(self._top_queries, reverse=True)
+        ]
+
+
+def start_request():
+    """Starts collecting RequestMetrics in the current thread."""
+    _local.metrics = RequestMetrics()
+    return _local.metrics
+
+
+def finish_request():
+    """Stops collecting RequestMetrics in the current thread."""
+    _local.metrics = None
+
+
+def get_request_metrics():
+    """Returns RequestMetrics of the current request or None."""
+    return getattr(_local, 'metrics', None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper timing queries of the current request."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics = get_request_metrics()
+        if request_metrics is not None:
+            request_metrics.add_query(sql, time.perf_counter() - start)
+
+
+class TimedTemplate(Template):
+    """Template adding its render time to the current request."""
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            request_metrics = get_request_metrics()
+            if request_metrics is not None:
+                request_metrics.template_time += (
+                    time.perf_counter() - start
+                )
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend measuring template render time.
+
+    Templates included by other templates are rendered by the engine
+    directly, so their time is only counted once.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(
+                self.engine.get_template(template_name), self
+            )
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def _escape_label(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{0}}}'.format(
+        ','.join(
+            '{0}="{1}"'.format(name, _escape_label(value))
+            for name, value in labels
+        )
+    )
+
+
+def _add_histogram(histograms, key, histogram):
+    """Adds bucket counts, count and sum of histogram to histograms."""
+    total = histograms.get(key)
+    if total is None:
+        histograms[key] = list(histogram)
+    else:
+        for index, value in enumerate(histogram):
+            total[index] += value
+
+
+def _load_metrics_file(path, counters, histograms):
+    """Adds metrics stored by _write_metrics_file() to the totals.
+
+    Returns the loaded data, or None if the file does not exist.
+    """
+    try:
+        with open(path, encoding='utf-8') as metrics_file:
+            data = json.load(metrics_file)
+    except (FileNotFoundError, ValueError):  # Deleted or invalid
+        return None
+
+    for name, labels, value in data['counters']:
+        counters[(name, tuple(tuple(x) for x in labels))] += value
+    for name, labels, histogram in data['histograms']:
+        key = (name, tuple(tuple(x) for x in labels))
+        _add_histogram(histograms, key, histogram)
+    return data
+
+
+def _write_metrics_file(path, counters, histograms, merged_files=()):
+    """Replaces the metrics file at path atomically."""
+    data = json.dumps(
+        {
+            'counters': [
+                [name, labels, value]
+                for (name, labels), value in counters.items()
+            ],
+            'histograms': [
+                [name, labels, histogram]
+                for (name, labels), histogram in histograms.items()
+            ],
+            'merged_files': sorted(merged_files),
+        }
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{0}.{1}.tmp'.format(path, uuid4().hex)
+    with open(tmp_path, 'w', encoding='utf-8') as metrics_file:
+        metrics_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def _is_running(pid):
+    """Checks if a process with the given pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Exists, but belongs to another user
+        return True
+    return True
+
+
+def _get_process_files(metrics_root):
+    """Returns (pid, path) of metrics files written by processes."""
+    process_files = []
+    for path in glob(os.path.join(metrics_root, '*-*.json')):
+        pid = os.path.basename(path).split('-', 1)[0]
+        if pid.isdigit():
+            process_files.append((int(pid), path))
+    return process_files
+
+
+def merge_exited_processes(metrics_root):
+    """Merges metrics files of exited processes into MERGED_METRICS_FILE.
+
+    Keeps the number of files read by render() bounded by the number of
+    running processes. Names of merged files are stored in the merged
+    file, so a file which could not be deleted is never counted twice.
+    """
+    os.makedirs(metrics_root, exist_ok=True)
+    lock_path = os.path.join(metrics_root, METRICS_LOCK_FILE)
+    with open(lock_path, 'a', encoding='utf-8') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        merged_path = os.path.join(metrics_root, MERGED_METRICS_FILE)
+        counters = defaultdict(float)  # type: defaultdict
+        histograms = {}  # type: dict
+        merged = _load_metrics_file(merged_path, counters, histograms)
+        merged_files = set(merged['merged_files'] if merged else ())
+
+        exited = []
+        for pid, path in _get_process_files(metrics_root):
+            name = os.path.basename(path)
+            if name not in merged_files and not _is_running(pid):
+                if _load_metrics_file(path, counters, histograms):
+                    exited.append(path)
+        if not exited:
+            return
+
+        # Names of deleted files are no longer needed
+        merged_files = {
+            x
+            for x in merged_files
+            if os.path.exists(os.path.join(metrics_root, x))
+        }
+        merged_files.update(os.path.basename(x) for x in exited)
+        _write_metrics_file(
+            merged_path, counters, histograms, merged_files
+        )
+
+        for path in exited:
+            os.unlink(path)
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms of this process.
+
+    Each process stores its metrics in a file of its own in METRICS_ROOT,
+    at most every METRICS_FLUSH_SECONDS, and render() adds up the files
+    of all processes. Files of exited processes are merged into a single
+    file, so counters do not drop when workers are restarted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._file_name = '{0}-{1}.json'.format(self._pid, uuid4().hex)
+        self._flushed = 0.0
+        self._counters = defaultdict(float)  # type: defaultdict
+        self._histograms = {}  # type: dict
+
+    def _reset(self):
+        self._flushed = 0.0
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def _check_process(self):
+        """Starts with empty metrics in a forked process; needs _lock."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._file_name = '{0}-{1}.json'.format(self._pid, uuid4().hex)
+            self._reset()
+
+    def clear(self):
+        """Resets all metrics of this process."""
+        with self._lock:
+            self._check_process()
+            self._reset()
+
+    def inc(self, name, labels, value=1):
+        """Increases a counter; labels is a tuple of (name, value)."""
+        with self._lock:
+            self._check_process()
+            self._counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        """Adds value to a histogram with DURATION_BUCKETS."""
+        with self._lock:
+            self._check_process()
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = [0] * len(DURATION_BUCKETS) + [0, 0.0]
+                self._histograms[(name, labels)] = histogram
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def get_value(self, name, labels):
+        """Returns the value of a counter of this process, or 0."""
+        with self._lock:
+            self._check_process()
+            return self._counters.get((name, labels), 0)
+
+    def flush(self, force=False):
+        """Stores metrics of this process for render().
+
+        Unless force is set, metrics are stored at most every
+        METRICS_FLUSH_SECONDS. The file is replaced atomically.
+        """
+        with self._lock:
+            self._check_process()
+            now = time.monotonic()
+            if not force and now - self._flushed < METRICS_FLUSH_SECONDS:
+                return
+            self._flushed = now
+            counters = dict(self._counters)
+            histograms = {
+                key: list(histogram)
+                for key, histogram in self._histograms.items()
+            }
+            metrics_path = os.path.join(
+                settings.METRICS_ROOT, self._file_name
+            )
+
+        _write_metrics_file(metrics_path, counters, histograms)
+
+    def render(self):
+        """Returns metrics of all processes in Prometheus text format."""
+        self.flush(force=True)
+        merge_exited_processes(settings.METRICS_ROOT)
+
+        counter_totals = defaultdict(float)  # type: defaultdict
+        histogram_totals = {}  # type: dict
+        merged = _load_metrics_file(
+            os.path.join(settings.METRICS_ROOT, MERGED_METRICS_FILE),
+            counter_totals,
+            histogram_totals,
+        )
+        merged_files = set(merged['merged_files'] if merged else ())
+        for _, path in _get_process_files(settings.METRICS_ROOT):
+            if os.path.basename(path) not in merged_files:
+                _load_metrics_file(path, counter_totals, histogram_totals)
+        counters = sorted(counter_totals.items())
+        histograms = sorted(histogram_totals.items())
+
+        lines = []
+        for family, (metric_type, help_text) in METRIC_FAMILIES.items():
+            lines.append('# HELP {0} {1}'.format(family, help_text))
+            lines.append('# TYPE {0} {1}'.format(family, metric_type))
+            for (name, labels), value in counters:
+                if name == family:
+                    lines.append(
+                        '{0}{1} {2!r}'.format(
+                            name, _format_labels(labels), float(value)
+                        )
+                    )
+            for (name, labels), histogram in histograms:
+                if name != family:
+                    continue
+                for bound, count in zip(
+                    DURATION_BUCKETS + ('+Inf',), histogram[:-1]
+                ):
+                    lines.append(
+                        '{0}_bucket{1} {2}'.format(
+                            name,
+                            _format_labels(labels + (('le', bound),)),
+                            count,
+                        )
+                    )
+                lines.append(
+                    '{0}_sum{1} {2!r}'.format(
+                        name, _format_labels(labels), histogram[-1]
+                    )
+                )
+                lines.append(
+                    '{0}_count{1} {2}'.format(
+                        name, _format_labels(labels), histogram[-2]
+                    )
+                )
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+
+
+def _get_view_name(request):
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'unresolved'
+    return resolver_match.view_name
+
+
+def _count_streamed_bytes(content, labels):
+    """Yields streamed chunks, adding their size to the bytes counter."""
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        METRICS.inc('ocelot_http_response_bytes_total', labels, size)
+
+
+def record_request(request, response, request_metrics, duration):
+    """Records metrics of a finished request and logs them.
+
+    Requests slower than SLOW_REQUEST_SECONDS are also logged to the
+    slow request log with their slowest queries.
+    """
+    view = _get_view_name(request)
+    labels = (('view', view),)
+
+    if not response.streaming:
+        response_bytes = len(response.content)
+    elif response.has_header('Content-Length'):
+        response_bytes = int(response['Content-Length'])
+    else:  # Counted once the response has been sent
+        response_bytes = None
+        response.streaming_content = _count_streamed_bytes(
+            response.streaming_content, labels
+        )
+
+    status = str(response.status_code)
+    METRICS.inc(
+        'ocelot_http_requests_total',
+        labels + (('method', request.method), ('status', status)),
+    )
+    METRICS.observe(
+        'ocelot_http_request_duration_seconds', labels, duration
+    )
+    if response_bytes is not None:
+        METRICS.inc(
+            'ocelot_http_response_bytes_total', labels, response_bytes
+        )
+    METRICS.inc('ocelot_db_queries_total', labels, request_metrics.queries)
+    METRICS.inc(
+        'ocelot_db_query_duration_seconds_total',
+        labels,
+        request_metrics.query_time,
+    )
+    METRICS.inc(
+        'ocelot_template_render_duration_seconds_total',
+        labels,
+        request_metrics.template_time,
+    )
+
+    record = {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'view': view,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'db_queries': request_metrics.queries,
+        'db_ms': round(request_metrics.query_time * 1000, 3),
+        'template_ms': round(request_metrics.template_time * 1000, 3),
+        'bytes': response_bytes,
+    }
+    if LOGGER.isEnabledFor(logging.INFO):
+        LOGGER.info(json.dumps(record))
+
+    if duration >= SLOW_REQUEST_SECONDS:
+        METRICS.inc('ocelot_slow_requests_total', labels)
+        record['top_queries'] = [
+            {'sql': sql, 'ms': round(elapsed * 1000, 3)}
+            for sql, elapsed in request_metrics.get_top_queries()
+        ]
+        SLOW_LOGGER.warning(json.dumps(record))
+
+    METRICS.flush()
@@ -0,0 +1,82 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+
+from leaderboard.cache import get_cached_team_data
+from leaderboard.cache import set_cached_team_data
+from leaderboard.metrics import finish_request
+from leaderboard.metrics import record_query
+from leaderboard.metrics import record_request
+from leaderboard.metrics import start_request
+from leaderboard.models import Team
+
+
+def get_team_data(request):
+    """Returns (name, email, token, is_verified) for session token.
+
+    Team data is cached per token, so signed-in page views do not query
+    the Team table. Anonymous requests return (None, None, None, False).
+    """
+    token = request.session.get('ocelot_team_token')
+    if not token:
+        return (None, None, None, False)
+
+    team_data = get_cached_team_data(token)
+    if team_data is None:
+        the_team = Team.objects.get(token=token)
+        team_data = (the_team.name, the_team.email, the_team.is_verified)
+        set_cached_team_data(token, team_data)
+
+    name, email, is_verified = team_data
+    return (name, email, token, is_verified)
+
+
+class TeamMiddleware:
+    """Resolves the signed-in team once per request.
+
+    Sets request.ocelot_team to the lazily evaluated result of
+    get_team_data(). Must be placed after SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.ocelot_team = SimpleLazyObject(
+            lambda: get_team_data(request)
+        )
+        return self.get_response(request)
+
+
+class PerformanceMiddleware:
+    """Records wall time, queries, template time and bytes per view.
+
+    Metrics are served by the metrics view and each request is logged,
+    see record_request(). Should be placed first, so time spent in other
+    middleware is included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = start_request()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(record_query)
+                    )
+                response = self.get_response(request)
+        finally:
+            finish_request()
+
+        duration = time.perf_counter() - start
+        record_request(request, response, request_metrics, duration)
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+
+def set_score_status_for_scored_submissions(apps, schema_editor):
+    """Existing submissions have been scored synchronously on save()."""
+    Submission = apps.get_model("leaderboard", "Submission")
+    Submission.objects.filter(score=-1).update(score_status="FAILED")
+    Submission.objects.exclude(score=-1).update(score_status="DONE")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "leaderboard",
+            "0036_submission_is_contrastive_submission_is_withdrawn",
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="submission",
+            name="score_status",
+            field=models.CharField(
+                choices=[
+                    ("QUEUED", "Queued"),
+                    ("RUNNING", "Running"),
+                    ("DONE", "Done"),
+                    ("FAILED", "Failed"),
+                ],
+                db_index=True,
+                default="QUEUED",
+                help_text="Status of automatic scoring",
+                max_length=7,
+            ),
+        ),
+        migrations.RunPython(
+            set_score_status_for_scored_submissions,
+            migrations.RunPython.noop,
+        ),
+    ]
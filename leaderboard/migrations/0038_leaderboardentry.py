@@ -0,0 +1,79 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("leaderboard", "0037_submission_score_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardEntry",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("test_set_name", models.CharField(max_length=200)),
+                ("test_set_label", models.CharField(max_length=250)),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("name", models.CharField(max_length=250)),
+                (
+                    "team_token",
+                    models.CharField(blank=True, max_length=10, null=True),
+                ),
+                ("is_anonymous", models.BooleanField(default=True)),
+                ("score_bleu", models.FloatField(blank=True, null=True)),
+                ("score_chrf", models.FloatField(blank=True, null=True)),
+                (
+                    "date_created",
+                    models.DateTimeField(blank=True, null=True),
+                ),
+                (
+                    "competition",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="leaderboard.competition",
+                    ),
+                ),
+                (
+                    "submission",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="leaderboard.submission",
+                    ),
+                ),
+                (
+                    "test_set",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="leaderboard.testset",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=[
+                            "competition",
+                            "test_set_name",
+                            "test_set",
+                            "rank",
+                        ],
+                        name="leaderboard_entry_order_idx",
+                    )
+                ],
+            },
+        ),
+    ]
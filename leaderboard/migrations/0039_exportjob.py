@@ -0,0 +1,101 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("leaderboard", "0038_leaderboardentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExportJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date_created",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        help_text="Creation date of this export job",
+                    ),
+                ),
+                (
+                    "date_finished",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Date when the export job finished",
+                        null=True,
+                    ),
+                ),
+                (
+                    "description",
+                    models.CharField(
+                        help_text="What is being exported", max_length=200
+                    ),
+                ),
+                (
+                    "submission_ids",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="IDs of exported submissions",
+                    ),
+                ),
+                (
+                    "test_set_ids",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="IDs of exported test sets",
+                    ),
+                ),
+                (
+                    "team_ids",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="IDs of exported teams",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("QUEUED", "Queued"),
+                            ("RUNNING", "Running"),
+                            ("DONE", "Done"),
+                            ("FAILED", "Failed"),
+                        ],
+                        db_index=True,
+                        default="QUEUED",
+                        help_text="Status of the export job",
+                        max_length=7,
+                    ),
+                ),
+                (
+                    "processed_files",
+                    models.PositiveIntegerField(default=0),
+                ),
+                ("total_files", models.PositiveIntegerField(default=0)),
+                (
+                    "archive",
+                    models.FileField(
+                        blank=True,
+                        help_text="Zip file with exported files",
+                        null=True,
+                        upload_to="exports/",
+                    ),
+                ),
+                ("error", models.TextField(blank=True, default="")),
+            ],
+        ),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("leaderboard", "0039_exportjob"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="submission",
+            name="is_constrained",
+            field=models.BooleanField(
+                default=False, help_text="Is constrained sumission?"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="is_contrastive",
+            field=models.BooleanField(
+                default=False, help_text="Is contrastive submission?"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="is_flagged",
+            field=models.BooleanField(
+                default=False, help_text="Is flagged?"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="is_primary",
+            field=models.BooleanField(
+                default=False, help_text="Is primary sumission?"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="is_public",
+            field=models.BooleanField(
+                default=False,
+                help_text="Is publicly visible? Can be overwritten by settings of the test set or competition",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="is_removed",
+            field=models.BooleanField(
+                default=False, help_text="Is removed?"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="is_valid",
+            field=models.BooleanField(
+                default=False, help_text="Is valid?"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="is_withdrawn",
+            field=models.BooleanField(
+                default=False, help_text="Is withdrawn?"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="score_status",
+            field=models.CharField(
+                choices=[
+                    ("QUEUED", "Queued"),
+                    ("RUNNING", "Running"),
+                    ("DONE", "Done"),
+                    ("FAILED", "Failed"),
+                ],
+                default="QUEUED",
+                help_text="Status of automatic scoring",
+                max_length=7,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="submitted_by",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="leaderboard.team",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="submission",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_removed", False), ("is_valid", True)
+                ),
+                fields=["test_set", "-score_chrf", "-id"],
+                name="submission_ranking_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="submission",
+            index=models.Index(
+                fields=["submitted_by", "test_set"],
+                name="submission_team_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="submission",
+            index=models.Index(
+                condition=models.Q(("score_status", "QUEUED")),
+                fields=["id"],
+                name="submission_queued_idx",
+            ),
+        ),
+    ]
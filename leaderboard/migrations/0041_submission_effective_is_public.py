@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+def set_effective_is_public(apps, schema_editor):
+    """Same as leaderboard.models.update_effective_visibility()."""
+    Submission = apps.get_model("leaderboard", "Submission")
+    for is_public in (True, False):
+        Submission.objects.filter(
+            test_set__competition__is_public=is_public
+        ).update(effective_is_public=is_public)
+
+    submissions = Submission.objects.filter(
+        test_set__competition__is_public__isnull=True
+    )
+    for is_public in (True, False):
+        submissions.filter(test_set__is_public=is_public).update(
+            effective_is_public=is_public
+        )
+    submissions.filter(test_set__is_public__isnull=True).update(
+        effective_is_public=models.F("is_public")
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("leaderboard", "0040_submission_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="submission",
+            name="effective_is_public",
+            field=models.BooleanField(
+                default=False,
+                editable=False,
+                help_text="Is publicly visible, taking into account settings at test set and competition levels?",
+            ),
+        ),
+        migrations.RunPython(
+            set_effective_is_public,
+            migrations.RunPython.noop,
+        ),
+    ]
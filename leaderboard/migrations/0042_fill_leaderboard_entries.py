@@ -0,0 +1,83 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:30
+
+from django.db import migrations
+
+# Same as leaderboard.models.LEADERBOARD_SIZE
+LEADERBOARD_SIZE = 10
+
+
+def fill_leaderboard_entries(apps, schema_editor):
+    """Same as leaderboard.models.refresh_leaderboards() for all test sets.
+
+    Runs after 0041, as entries depend on effective_is_public.
+    """
+    LeaderboardEntry = apps.get_model("leaderboard", "LeaderboardEntry")
+    TestSet = apps.get_model("leaderboard", "TestSet")
+
+    test_sets = TestSet.objects.filter(
+        competition__isnull=False
+    ).select_related("source_language", "target_language")
+
+    entries = []
+    for test_set in test_sets.iterator():
+        # Test sets without scores are ordered by newest first
+        ordering = ("-id",)
+        if test_set.compute_scores:
+            ordering = ("-score_chrf", "-id")
+
+        submissions = (
+            test_set.submission_set.filter(is_valid=True, is_removed=False)
+            .select_related("submitted_by")
+            .order_by(*ordering)[:LEADERBOARD_SIZE]
+        )
+        for rank, submission in enumerate(submissions, start=1):
+            score_bleu = submission.score
+            score_chrf = submission.score_chrf
+            if not test_set.compute_scores:
+                score_bleu = None
+                score_chrf = None
+
+            name = submission.name
+            if not submission.effective_is_public:
+                name = "Anonymous"
+
+            entries.append(
+                LeaderboardEntry(
+                    competition_id=test_set.competition_id,
+                    test_set=test_set,
+                    submission=submission,
+                    test_set_name=test_set.name,
+                    test_set_label="{0} test set ({1}-{2})".format(
+                        test_set.name,
+                        test_set.source_language.code,
+                        test_set.target_language.code,
+                    ),
+                    rank=rank,
+                    name="{0} submission #{1}".format(name, submission.id),
+                    team_token=(
+                        submission.submitted_by.token
+                        if submission.submitted_by
+                        else None
+                    ),
+                    is_anonymous=not submission.effective_is_public,
+                    score_bleu=score_bleu,
+                    score_chrf=score_chrf,
+                    date_created=submission.date_created,
+                )
+            )
+
+    LeaderboardEntry.objects.all().delete()
+    LeaderboardEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("leaderboard", "0041_submission_effective_is_public"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            fill_leaderboard_entries,
+            migrations.RunPython.noop,
+        ),
+    ]
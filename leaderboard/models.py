@@ -1,23 +1,49 @@
 """
 Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
 """
+import logging
+import os
 import re
+import threading
 import xml
-from pathlib import Path
+from typing import Any
+from typing import Dict
 from uuid import uuid4
 
 import lxml.etree as ET
 import xmlschema
-from bs4 import BeautifulSoup
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import DEFAULT_DB_ALIAS
 from django.db import models
-from sacrebleu import corpus_bleu  # type: ignore
-from sacrebleu import corpus_chrf  # type: ignore
-
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import Exists
+from django.db.models import F
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Value
+from django.db.models import When
+from django.db.models import Window
+from django.db.models.functions import RowNumber
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from leaderboard.cache import invalidate_competition_pages
+from leaderboard.cache import invalidate_team_data
+from leaderboard.derived import derive_file
 from leaderboard.utils import analyze_xml_file
+from leaderboard.utils import analyze_xml_tree
+from leaderboard.utils import cache_reference_stats
+from leaderboard.utils import compute_scores
+from leaderboard.utils import extract_xml_text
+from leaderboard.utils import filter_sgml_docs
+from leaderboard.utils import get_reference_stats_path
+from leaderboard.utils import get_sgml_docids
 from leaderboard.utils import process_to_text  # type: ignore
-from leaderboard.utils import process_xml_to_text
+from leaderboard.utils import XML_REFERENCE
+from leaderboard.utils import XML_SOURCE
+from leaderboard.utils import XML_SYSTEM
 from ocelot.settings import MEDIA_ROOT
 
 MAX_CODE_LENGTH = 10  # ISO 639 codes need 3 chars, but better add buffer
@@ -25,6 +51,14 @@ MAX_NAME_LENGTH = 200
 MAX_DESCRIPTION_LENGTH = 2000
 MAX_TOKEN_LENGTH = 10
 
+# Number of queued submissions inspected per attempt to claim a scoring job
+SCORING_QUEUE_BATCH_SIZE = 10
+
+# Number of top submissions per test set stored in LeaderboardEntry
+LEADERBOARD_SIZE = 10
+
+LOGGER = logging.getLogger(__name__)
+
 SGML_FILE = 'SGML'  # supported extensions: .sgm
 TEXT_FILE = 'TEXT'  # supported extensions: .txt
 XML_FILE = 'XML'  # supported extensions: .xml
@@ -35,6 +69,30 @@ FILE_FORMAT_CHOICES = (
     (XML_FILE, 'XML format'),
 )
 
+SCORE_QUEUED = 'QUEUED'  # waiting for a scoring worker
+SCORE_RUNNING = 'RUNNING'  # claimed by a scoring worker
+SCORE_DONE = 'DONE'
+SCORE_FAILED = 'FAILED'
+
+SCORE_STATUS_CHOICES = (
+    (SCORE_QUEUED, 'Queued'),
+    (SCORE_RUNNING, 'Running'),
+    (SCORE_DONE, 'Done'),
+    (SCORE_FAILED, 'Failed'),
+)
+
+EXPORT_QUEUED = 'QUEUED'  # waiting for an export worker
+EXPORT_RUNNING = 'RUNNING'  # claimed by an export worker
+EXPORT_DONE = 'DONE'
+EXPORT_FAILED = 'FAILED'
+
+EXPORT_STATUS_CHOICES = (
+    (EXPORT_QUEUED, 'Queued'),
+    (EXPORT_RUNNING, 'Running'),
+    (EXPORT_DONE, 'Done'),
+    (EXPORT_FAILED, 'Failed'),
+)
+
 SGML_XSD_SCHEMA = """<?xml version="1.0"?>
 <xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
   <xs:element name="tstset" type="TestSetType"/>
@@ -220,12 +278,59 @@ XML_RNG_SCHEMA = """<?xml version="1.0" encoding="UTF-8"?>
 """
 
 
+# Process-level registry of compiled schema validators, built lazily once
+_VALIDATORS = {}  # type: Dict[str, Any]
+_VALIDATORS_LOCK = threading.Lock()
+
+# lxml keeps the error log of the last validation on the RelaxNG object, so
+# validate() and reading error_log must not interleave between threads
+_RELAXNG_LOCK = threading.Lock()
+
+
+def _build_sgml_validator():
+    """Returns XSD schema for SGML files."""
+    return xmlschema.XMLSchema(SGML_XSD_SCHEMA)
+
+
+def _build_xml_validator():
+    """Returns RelaxNG schema for XML files."""
+    # Could not make it working with a RNC schema, so using RNG instead.
+    # lxml did not use rnc2rng as described in the documentation:
+    # https://lxml.de/validation.html#relaxng
+    schema = ET.fromstring(XML_RNG_SCHEMA.encode())
+    return ET.RelaxNG(schema)
+
+
+_VALIDATOR_FACTORIES = {
+    SGML_FILE: _build_sgml_validator,
+    XML_FILE: _build_xml_validator,
+}
+
+
+def get_schema_validator(file_format):
+    """Returns compiled schema validator for SGML_FILE or XML_FILE."""
+    validator = _VALIDATORS.get(file_format)
+    if validator is None:
+        with _VALIDATORS_LOCK:
+            validator = _VALIDATORS.get(file_format)
+            if validator is None:
+                validator = _VALIDATOR_FACTORIES[file_format]()
+                _VALIDATORS[file_format] = validator
+    return validator
+
+
+def warm_up_validators():
+    """Compiles all schema validators; called at WSGI startup."""
+    for file_format in _VALIDATOR_FACTORIES:
+        get_schema_validator(file_format)
+
+
 def validate_sgml_schema(hyp_file):
     """Validates SGML file based on XSD schema."""
     if not hyp_file.name.endswith('.sgm'):
         return  # Skip validation for other format files.
 
-    schema = xmlschema.XMLSchema(SGML_XSD_SCHEMA)
+    schema = get_schema_validator(SGML_FILE)
 
     try:
         schema.validate(hyp_file)
@@ -282,11 +387,12 @@ def validate_xml_submission(xml_file):
     if not xml_file.name.endswith('.xml'):
         return  # Skip validation for other formats
 
-    validate_xml_schema(xml_file)
+    hyp_doc = validate_xml_schema(xml_file)
     xml_file.seek(0)  # To be able to read() again
 
-    # Check if the submission has some translations from one system only
-    _, _, _, _, systems = analyze_xml_file(xml_file)
+    # Check if the submission has some translations from one system only;
+    # reuse the tree parsed for schema validation instead of parsing again
+    _, _, _, _, systems = analyze_xml_tree(hyp_doc)
     if len(systems) == 0:
         _msg = 'No system found in the XML file {0}'.format(xml_file.name)
         raise ValidationError(_msg)
@@ -299,21 +405,21 @@ def validate_xml_submission(xml_file):
 
 
 def validate_xml_schema(xml_file):
-    """Validates XML file based on RNG schema."""
+    """Validates XML file based on RNG schema. Returns the parsed tree."""
 
     if not xml_file.name.endswith('.xml'):
-        return  # Skip validation for other format files.
+        return None  # Skip validation for other format files.
 
     is_valid = False
-    relaxng = None
+    errors = []
     try:
-        # Could not make it working with a RNC schema, so using RNG instead.
-        # lxml did not use rnc2rng as described in the documentation:
-        # https://lxml.de/validation.html#relaxng
-        schema = ET.fromstring(XML_RNG_SCHEMA.encode())
-        relaxng = ET.RelaxNG(schema)
+        relaxng = get_schema_validator(XML_FILE)
         hyp_doc = ET.parse(xml_file)
-        is_valid = relaxng.validate(hyp_doc)
+        with _RELAXNG_LOCK:
+            is_valid = relaxng.validate(hyp_doc)
+            if not is_valid:
+                # Display only the first error
+                errors = list(relaxng.error_log)[:1]
     except Exception as error:
         _msg = 'XML file invalid: {0}'.format(error)
         raise ValidationError(_msg)
@@ -322,13 +428,12 @@ def validate_xml_schema(xml_file):
         _msg = 'XML file invalid: {0}. It does not validate against the XML Schema:'.format(
             xml_file,
         )
-        if relaxng:
-            for _err in relaxng.error_log[
-                :1
-            ]:  # Display only the first error
-                _msg += " Line %s: %s\n" % (_err.line, _err.message)
+        for _err in errors:
+            _msg += " Line %s: %s\n" % (_err.line, _err.message)
         raise ValidationError(_msg)
 
+    return hyp_doc
+
 
 def validate_team_name(value):
     """Validates team name matches r'^[a-zA-Z0-9_\\- ]{2,32}$'."""
@@ -370,6 +475,26 @@ def validate_token(value):
         raise ValidationError(_msg)
 
 
+def _snapshot_leaderboard_fields(instance):
+    """Remembers values of instance.LEADERBOARD_FIELDS as stored in DB."""
+    instance._leaderboard_values = {
+        name: instance.__dict__.get(name, models.DEFERRED)
+        for name in instance.LEADERBOARD_FIELDS
+    }
+
+
+def _leaderboard_fields_changed(instance):
+    """Checks if any of instance.LEADERBOARD_FIELDS differs from DB."""
+    previous = getattr(instance, '_leaderboard_values', None)
+    if previous is None:
+        return True  # Not loaded from DB, e.g. a new instance
+    return any(
+        previous[name] is models.DEFERRED
+        or previous[name] != getattr(instance, name)
+        for name in instance.LEADERBOARD_FIELDS
+    )
+
+
 class Competition(models.Model):
     """Models a competition."""
 
@@ -425,6 +550,9 @@ class Competition(models.Model):
         null=True,
     )
 
+    # Fields affecting leaderboard entries, see refresh_leaderboards()
+    LEADERBOARD_FIELDS = ('is_public',)
+
     def __repr__(self):
         return (
             'Competition(name={0}, start_time={1}, deadline={2})'.format(
@@ -435,6 +563,34 @@ class Competition(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        _snapshot_leaderboard_fields(instance)
+        return instance
+
+    def save(
+        self,
+        force_insert=False,
+        force_update=False,
+        using=DEFAULT_DB_ALIAS,
+        update_fields=None,
+    ):
+        """Refreshes leaderboard entries if visibility changes on save()."""
+        refresh = not self._state.adding and _leaderboard_fields_changed(
+            self
+        )
+        super().save(force_insert, force_update, using, update_fields)
+        _snapshot_leaderboard_fields(self)
+        if refresh:
+            update_effective_visibility(
+                Submission.objects.filter(test_set__competition=self)
+            )
+            refresh_leaderboards(
+                self.test_sets.values_list('id', flat=True)
+            )
+        invalidate_competition_pages(self.id)
+
 
 class Language(models.Model):
     """Models a language."""
@@ -559,6 +715,16 @@ class TestSet(models.Model):
         ),
     )
 
+    # Fields affecting leaderboard entries, see refresh_leaderboards()
+    LEADERBOARD_FIELDS = (
+        'name',
+        'is_public',
+        'compute_scores',
+        'competition_id',
+        'source_language_id',
+        'target_language_id',
+    )
+
     def __repr__(self):
         return 'TestSet(name={0}, source={1}, target={2}, src={3}, ref={4}, collection={5})'.format(
             self.name,
@@ -580,61 +746,106 @@ class TestSet(models.Model):
         """
         Creates test set text files from SGML or XML files.
         If files are already in text format, do nothing.
+        """
+        self.get_src_text_path()
+        if self.has_references():  # Reference file may not exist
+            self.get_ref_text_path()
+
+    def _get_text_path(self, the_file, field, create=True):
+        """
+        Returns path to the text version of a test set file. SGML and XML
+        files are extracted to the derived file store, see derive_file().
         For XML format, it extracts data only from the collection if defined.
         """
-        if self.file_format == TEXT_FILE:
-            return
+        file_path = _get_media_path(the_file.name)
 
         if self.file_format == SGML_FILE:
-            for sgml_file in (self.ref_file, self.src_file):
-                sgml_path = str(sgml_file.name)
-                text_path = sgml_path.replace('.sgm', '.txt')
-                if not Path(text_path).exists():
-                    process_to_text(sgml_path, text_path)
-
-        elif self.file_format == XML_FILE:
-            # Extract source text
-            src_path = str(self.src_file.name)
-            if MEDIA_ROOT and MEDIA_ROOT not in src_path:
-                src_path = '{0}{1}'.format(MEDIA_ROOT, src_path)
-
-            txt_path = src_path.replace('.xml', '.txt')
-
-            if not Path(txt_path).exists():
-                # After validation it's guaranteed that src_langs has only one element
-                _, src_langs, _, _, _ = analyze_xml_file(src_path)
-                process_xml_to_text(
-                    src_path,
-                    txt_path,
-                    source=src_langs.pop(),
-                    collection=self.collection,
-                )
+            return derive_file(file_path, process_to_text, create=create)
+
+        if self.file_format == XML_FILE:
+            # For references, the first translator in sorted order is used
+            # to guarantee reproducibility; scores are computed against it
+            return derive_file(
+                file_path,
+                extract_xml_text,
+                create=create,
+                field=field,
+                collection=self.collection,
+            )
 
-            if not self.has_references():  # Reference file may not exist
-                return
-
-            # Extract reference texts; multiple references will be tab-separated
-            ref_path = str(self.ref_file.name)
-            if MEDIA_ROOT and MEDIA_ROOT not in ref_path:
-                ref_path = '{0}{1}'.format(MEDIA_ROOT, ref_path)
-            txt_path = ref_path.replace('.xml', '.txt')
-
-            if not Path(txt_path).exists():
-                _, _, _, translators, _ = analyze_xml_file(ref_path)
-                # Sort to guarantee reproducibility
-                # Scores will be computed against the first reference only
-                translator = sorted(list(translators))[0]
-                process_xml_to_text(
-                    ref_path,
-                    txt_path,
-                    reference=translator,
-                    collection=self.collection,
-                )
+        return file_path
 
     def has_references(self):
         """Returns True when self.ref_file is not None."""
         return bool(self.ref_file)
 
+    def get_src_text_path(self):
+        """Returns path to the source text file."""
+        return self._get_text_path(self.src_file, XML_SOURCE)
+
+    def get_ref_text_path(self):
+        """Returns path to the reference text file."""
+        if not self.has_references():  # Reference file may not exist
+            return None
+        # By design, the reference only contains valid docids
+        return self._get_text_path(self.ref_file, XML_REFERENCE)
+
+    def get_derived_paths(self):
+        """Returns paths of derived files without creating them."""
+        paths = [self._get_text_path(self.src_file, XML_SOURCE, False)]
+        if self.has_references():
+            paths.append(
+                self._get_text_path(self.ref_file, XML_REFERENCE, False)
+            )
+        return paths
+
+    def get_ref_stats_path(self):
+        """Returns path to precomputed reference statistics."""
+        return get_reference_stats_path(
+            settings.REF_STATS_ROOT,
+            self.id,
+            self.get_tokenize(),
+            self.get_ref_text_path(),
+        )
+
+    def _cache_reference_stats(self):
+        """
+        Precomputes reference statistics so that scoring submissions only
+        needs to process the hypothesis side.
+        """
+        if not self.has_references() or not self.compute_scores:
+            return
+
+        try:
+            cache_reference_stats(
+                self.get_ref_text_path(),
+                self.get_tokenize(),
+                self.get_ref_stats_path(),
+            )
+        except OSError:
+            # Scoring falls back to processing the reference text file
+            LOGGER.exception(
+                'Could not cache reference statistics for %r', self
+            )
+
+    def get_tokenize(self):
+        """Returns sacreBLEU tokenizer name for the target language."""
+        target_language_code = None
+        if self.target_language:
+            target_language_code = self.target_language.code
+
+        if target_language_code == 'ja':
+            # We use char-based tokenizer as MeCab was slow/unstable
+            return 'char'
+
+        if target_language_code == 'km':
+            return 'char'
+
+        if target_language_code == 'zh':
+            return 'zh'
+
+        return '13a'
+
     def full_clean(self, exclude=None, validate_unique=True):
         """Validates test set files."""
         for current_file in (self.ref_file, self.src_file):
@@ -671,6 +882,12 @@ class TestSet(models.Model):
             exclude=exclude, validate_unique=validate_unique
         )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        _snapshot_leaderboard_fields(instance)
+        return instance
+
     def save(
         self,
         force_insert=False,
@@ -678,10 +895,27 @@ class TestSet(models.Model):
         using=DEFAULT_DB_ALIAS,
         update_fields=None,
     ):
-        """Creates test set text files on save()."""
+        """Creates test set text files and reference statistics on save().
+
+        Leaderboard entries are refreshed if the test set changes them.
+        """
+        refresh = not self._state.adding and _leaderboard_fields_changed(
+            self
+        )
+        previous = getattr(self, '_leaderboard_values', {})
         super().save(force_insert, force_update, using, update_fields)
+        _snapshot_leaderboard_fields(self)
         if self.id:
             self._create_text_files()
+            self._cache_reference_stats()
+        if refresh:
+            update_effective_visibility(
+                Submission.objects.filter(test_set=self)
+            )
+            refresh_leaderboard(self.id)
+        invalidate_competition_pages(
+            self.competition_id, previous.get('competition_id')
+        )
 
 
 class Team(models.Model):
@@ -789,14 +1023,8 @@ class Team(models.Model):
     def __str__(self):
         return '{0} ({1})'.format(self.name, self.email)
 
-    def _submissions(self):
-        return Submission.objects.filter(submitted_by=self).count()
-
-    def _primary_submissions(self):
-        return Submission.objects.filter(
-            submitted_by=self,
-            is_primary=True,
-        ).count()
+    # Fields affecting leaderboard entries, see refresh_leaderboards()
+    LEADERBOARD_FIELDS = ('name', 'token')
 
     def _compute_token(self):
         token = uuid4().hex[:MAX_TOKEN_LENGTH]
@@ -810,11 +1038,51 @@ class Team(models.Model):
         using=DEFAULT_DB_ALIAS,
         update_fields=None,
     ):
-        """Compute token on save()."""
+        """Compute token on save().
+
+        Cached team data is invalidated for the old and the new token.
+        Leaderboard entries are refreshed if the team changes them.
+        """
+        refresh = not self._state.adding and _leaderboard_fields_changed(
+            self
+        )
         super().save(force_insert, force_update, using, update_fields)
+        _snapshot_leaderboard_fields(self)
+        invalidate_team_data(
+            self.token, getattr(self, '_stored_token', None)
+        )
+        self._stored_token = self.token
+        if refresh:
+            refresh_leaderboards(
+                Submission.objects.filter(submitted_by=self)
+                .values_list('test_set_id', flat=True)
+                .distinct()
+            )
         if not self.token and self.id:
             self._compute_token()
 
+    def delete(self, using=None, keep_parents=False):
+        """Invalidates cached team data on delete()."""
+        invalidate_team_data(
+            self.token, getattr(self, '_stored_token', None)
+        )
+        return super().delete(using, keep_parents)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_token = instance.__dict__.get('token')
+        _snapshot_leaderboard_fields(instance)
+        return instance
+
+
+def _get_media_path(file_name):
+    """Prefixes the file name with MEDIA_ROOT if needed."""
+    file_name = str(file_name)
+    if MEDIA_ROOT and MEDIA_ROOT not in file_name:
+        return '{0}{1}'.format(MEDIA_ROOT, file_name)
+    return file_name
+
 
 def _get_submission_upload_path(instance, filename):
     """Construct upload path based on test set and team data."""
@@ -861,57 +1129,58 @@ class Submission(models.Model):
 
     is_constrained = models.BooleanField(
         blank=False,
-        db_index=True,
         default=False,
         help_text='Is constrained sumission?',
     )
 
     is_contrastive = models.BooleanField(
         blank=False,
-        db_index=True,
         default=False,
         help_text='Is contrastive submission?',
     )
 
     is_flagged = models.BooleanField(
         blank=False,
-        db_index=True,
         default=False,
         help_text='Is flagged?',
     )
 
     is_primary = models.BooleanField(
         blank=False,
-        db_index=True,
         default=False,
         help_text='Is primary sumission?',
     )
 
     is_public = models.BooleanField(
         blank=False,
-        db_index=True,
         default=False,
         help_text='Is publicly visible? '
         'Can be overwritten by settings of the test set or competition',
     )
 
+    # Denormalized visibility, see _compute_effective_is_public()
+    effective_is_public = models.BooleanField(
+        blank=False,
+        default=False,
+        editable=False,
+        help_text='Is publicly visible, taking into account settings at '
+        'test set and competition levels?',
+    )
+
     is_removed = models.BooleanField(
         blank=False,
-        db_index=True,
         default=False,
         help_text='Is removed?',
     )
 
     is_valid = models.BooleanField(
         blank=False,
-        db_index=True,
         default=False,
         help_text='Is valid?',
     )
 
     is_withdrawn = models.BooleanField(
         blank=False,
-        db_index=True,
         default=False,
         help_text='Is withdrawn?',
     )
@@ -945,6 +1214,14 @@ class Submission(models.Model):
         blank=True, db_index=True, help_text='chrF score', null=True
     )
 
+    # Scores are computed by the scoring worker, see process_scoring_queue()
+    score_status = models.CharField(
+        choices=SCORE_STATUS_CHOICES,
+        default=SCORE_QUEUED,
+        help_text='Status of automatic scoring',
+        max_length=7,
+    )
+
     file_format = models.CharField(
         choices=FILE_FORMAT_CHOICES,
         default=XML_FILE,
@@ -960,26 +1237,77 @@ class Submission(models.Model):
 
     test_set = models.ForeignKey(TestSet, on_delete=models.PROTECT)
 
+    # Indexed by submission_team_idx, see Meta
     submitted_by = models.ForeignKey(
-        Team, on_delete=models.PROTECT, blank=True, null=True
+        Team,
+        on_delete=models.PROTECT,
+        blank=True,
+        db_index=False,
+        null=True,
+    )
+
+    class Meta:
+        # Indexes follow the queries in refresh_leaderboards(), teampage(),
+        # submit() and _get_submission_upload_path(). Boolean flags are
+        # too unselective to be indexed on their own, so they are used as
+        # conditions of partial indexes instead. Databases without partial
+        # indexes, e.g. MySQL, skip those.
+        indexes = [
+            models.Index(
+                fields=['test_set', '-score_chrf', '-id'],
+                condition=Q(is_valid=True, is_removed=False),
+                name='submission_ranking_idx',
+            ),
+            models.Index(
+                fields=['submitted_by', 'test_set'],
+                name='submission_team_idx',
+            ),
+            models.Index(
+                fields=['id'],
+                condition=Q(score_status=SCORE_QUEUED),
+                name='submission_queued_idx',
+            ),
+        ]
+
+    # Fields affecting leaderboard entries, see refresh_leaderboards()
+    LEADERBOARD_FIELDS = (
+        'name',
+        'score',
+        'score_chrf',
+        'effective_is_public',
+        'is_removed',
+        'is_valid',
+        'test_set_id',
+        'submitted_by_id',
     )
 
     def is_anonymous(self):
         """Checks if the submission is not publicly visible, taking into
-        account settings at test set and competition levels."""
+        account settings at test set and competition levels.
+
+        Uses the stored effective_is_public field, so no related objects
+        are loaded.
+        """
+        return not self.effective_is_public
+
+    def _compute_effective_is_public(self):
+        """Computes visibility from test set and competition settings.
+
+        Keep in sync with update_effective_visibility().
+        """
         # If the submission's test set is a part of a competition and the
         # competition has public visibility set (i.e. is not Unknown)
         if (
             self.test_set.competition
             and self.test_set.competition.is_public is not None
         ):
-            return not self.test_set.competition.is_public
+            return self.test_set.competition.is_public
         # If the submission's test set has public visibility set (i.e. is not
         # Unknown)
         if self.test_set.is_public is not None:
-            return not self.test_set.is_public
+            return self.test_set.is_public
         # Otherwise, look at the submission public visibility only
-        return not self.is_public
+        return self.is_public
 
     def __repr__(self):
         return 'Submission(name={0}, is_primary={1})'.format(
@@ -990,75 +1318,73 @@ class Submission(models.Model):
         _name = 'Anonymous' if self.is_anonymous() else self.name
         return '{0} submission #{1}'.format(_name, self.id)
 
-    def get_hyp_text(self, path_only=False):
-        """Returns a list of hypothesis segments.
-
-        Args:
-            path_only (bool): Return a path to the hypothesis file instead of
-                a list of hypothesis segments
+    def _get_hyp_paths(self, create=True):
+        """Returns paths of files derived from the hypothesis file.
 
-        Returns:
-            list/str: A list of segments unless path_only and a file path
-                otherwise
+        The last path is the hypothesis text file. If create is False,
+        stops at the first derived file which does not exist.
         """
-
-        hyp_path = self.hyp_file.name
+        hyp_path = _get_media_path(self.hyp_file.name)
 
         if self.file_format == SGML_FILE:
+            paths = []
             if self.test_set.file_format == SGML_FILE:
-                hyp_filtered_path = hyp_path.replace(
-                    '.sgm', '.filtered.sgm'
+                ref_path = _get_media_path(self.test_set.ref_file.name)
+
+                # Filter hyp SGML in matching order, skipping testsuite-* docs
+                hyp_path = derive_file(
+                    hyp_path,
+                    Submission._filter_sgml_by_reference,
+                    suffix='.sgm',
+                    dependencies=[ref_path],
+                    create=create,
                 )
-                if not Path(hyp_filtered_path).exists():
-                    # Get docids from ref SGML path -- these are non "testsuite-"
-                    ref_docids = Submission._get_docids_from_path(
-                        self.test_set.ref_file.name
-                    )
-
-                    # Filter hyp SGML in matching order, skipping testsuite-* docs
-                    hyp_filtered_path = Submission._filter_sgml_by_docids(
-                        self.hyp_file.name,
-                        ref_docids,
-                    )
-            else:
-                hyp_filtered_path = hyp_path
+                paths.append(hyp_path)
+                if not os.path.exists(hyp_path):
+                    return paths
 
             # Create text version of (possibly filtered) hyp SGML
-            hyp_text_path = hyp_filtered_path.replace('.sgm', '.txt')
-            if not Path(hyp_text_path).exists():
-                process_to_text(hyp_filtered_path, hyp_text_path)
+            paths.append(
+                derive_file(hyp_path, process_to_text, create=create)
+            )
+            return paths
+
+        if self.file_format == XML_FILE:
+            # It should never happen that there is no system translations
+            # thanks to validation, but then no text file is created
+            return [
+                derive_file(
+                    hyp_path,
+                    extract_xml_text,
+                    create=create,
+                    field=XML_SYSTEM,
+                    collection=self.test_set.collection,
+                )
+            ]
 
-        elif self.file_format == XML_FILE:
-            # Prefix the XML file name with MEDIA_ROOT if needed
-            if MEDIA_ROOT and MEDIA_ROOT not in hyp_path:
-                hyp_path = '{0}{1}'.format(MEDIA_ROOT, hyp_path)
-
-            hyp_text_path = hyp_path.replace('.xml', '.txt')
-            if not Path(hyp_text_path).exists():
-                _, _, _, _, sys_names = analyze_xml_file(hyp_path)
-                # There will be no text version if no collection found
-                # if self.test_set.collection and self.test_set.collection not in collections:
-                # hyp_text_path = None
-                # It should never happen that there is no system translations
-                # thanks to validation, but better to check
-                if len(sys_names) > 0:
-                    process_xml_to_text(
-                        hyp_path,
-                        hyp_text_path,
-                        system=sys_names.pop(),
-                        collection=self.test_set.collection,
-                    )
+        return [hyp_path]
 
-        elif self.file_format == TEXT_FILE:
-            hyp_text_path = hyp_path
+    def get_hyp_text(self, path_only=False):
+        """Returns a list of hypothesis segments.
 
-        if MEDIA_ROOT and MEDIA_ROOT not in hyp_text_path:
-            hyp_text_path = '{0}{1}'.format(MEDIA_ROOT, hyp_text_path)
+        Args:
+            path_only (bool): Return a path to the hypothesis file instead of
+                a list of hypothesis segments
+
+        Returns:
+            list/str: A list of segments unless path_only and a file path
+                otherwise
+        """
+        hyp_text_path = self._get_hyp_paths()[-1]
 
         if path_only:
             return hyp_text_path
         return (x for x in open(hyp_text_path, encoding='utf-8'))
 
+    def get_derived_paths(self):
+        """Returns paths of derived files without creating them."""
+        return self._get_hyp_paths(create=False)
+
     def get_ref_text(self, path_only=False):
         """Returns a list of reference segments.
 
@@ -1074,21 +1400,7 @@ class Submission(models.Model):
         if not self.test_set.has_references():
             return
 
-        if self.test_set.file_format == SGML_FILE:
-            # By design, the reference only contains valid docids
-            ref_sgml_path = self.test_set.ref_file.name
-            ref_text_path = ref_sgml_path.replace('.sgm', '.txt')
-
-        elif self.test_set.file_format == XML_FILE:
-            # By design, the reference only contains valid docids
-            ref_xml_path = self.test_set.ref_file.name
-            ref_text_path = ref_xml_path.replace('.xml', '.txt')
-
-        elif self.test_set.file_format == TEXT_FILE:
-            ref_text_path = self.test_set.ref_file.name
-
-        if MEDIA_ROOT:
-            ref_text_path = '{0}{1}'.format(MEDIA_ROOT, ref_text_path)
+        ref_text_path = self.test_set.get_ref_text_path()
 
         if path_only:
             return ref_text_path
@@ -1096,22 +1408,7 @@ class Submission(models.Model):
 
     def get_src_text(self):
         """Returns a list of source segments."""
-        if self.test_set.file_format == SGML_FILE:
-            # By design, the reference only contains valid docids
-            src_sgml_path = self.test_set.src_file.name
-            src_text_path = src_sgml_path.replace('.sgm', '.txt')
-
-        elif self.test_set.file_format == XML_FILE:
-            # By design, the reference only contains valid docids
-            src_xml_path = self.test_set.src_file.name
-            src_text_path = src_xml_path.replace('.xml', '.txt')
-
-        elif self.test_set.file_format == TEXT_FILE:
-            src_text_path = self.test_set.src_file.name
-
-        if MEDIA_ROOT:
-            src_text_path = '{0}{1}'.format(MEDIA_ROOT, src_text_path)
-
+        src_text_path = self.test_set.get_src_text_path()
         src_stream = (r for r in open(src_text_path, encoding='utf-8'))
         return src_stream
 
@@ -1125,99 +1422,62 @@ class Submission(models.Model):
     @staticmethod
     def _get_docids_from_path(sgml_path, encoding='utf-8'):
         """Gets list of docids from SGML path."""
+        return get_sgml_docids(sgml_path, encoding=encoding)
 
-        with open(sgml_path, encoding=encoding) as sgml_handle:
-            sgml_soup = BeautifulSoup(sgml_handle, 'lxml-xml')
-
-        sgml_docids = []
-        sgml_regexp = re.compile('doc', re.IGNORECASE)
-        for doc in sgml_soup.find_all(sgml_regexp):
-            docid = doc.attrs.get('docid')
-            sgml_docids.append(docid)
-
-        return sgml_docids
+    @staticmethod
+    def _filter_sgml_by_reference(sgml_path, filtered_path, ref_path):
+        """Creates filtered SGML file with docids of the reference."""
+        # Get docids from ref SGML path -- these are non "testsuite-"
+        ref_docids = Submission._get_docids_from_path(ref_path)
+        Submission._filter_sgml_by_docids(
+            sgml_path, ref_docids, filtered_path=filtered_path
+        )
 
     @staticmethod
-    def _filter_sgml_by_docids(sgml_path, docids, encoding='utf-8'):
+    def _filter_sgml_by_docids(
+        sgml_path, docids, encoding='utf-8', filtered_path=None
+    ):
         """Creates filtered SGML file which contains only docids."""
-
-        valid_docids = [x.lower() for x in docids]
-
-        with open(sgml_path, encoding=encoding) as sgml_handle:
-            sgml_soup = BeautifulSoup(sgml_handle, 'lxml-xml')
-
-        sgml_docs = {}
-        sgml_regexp = re.compile('doc', re.IGNORECASE)
-        for doc in sgml_soup.find_all(sgml_regexp):
-            docid = doc.attrs.get('docid', '').lower()
-            if not docid in valid_docids:
-                doc.extract()
-                continue
-            sgml_docs[docid] = doc.extract()
-
-        for docid in valid_docids:
-            if docid in sgml_docs.keys() and sgml_soup.tstset:
-                sgml_soup.tstset.append(sgml_docs[docid])
-
-        sgml_filtered_path = sgml_path.replace('.sgm', '.filtered.sgm')
-        with open(sgml_filtered_path, 'w', encoding=encoding) as out_file:
-            out_soup = str(sgml_soup)
-            out_soup = out_soup.replace(
-                '<?xml version="1.0" encoding="utf-8"?>', ''
-            )
-            out_file.write(out_soup.strip())
-
-        return sgml_filtered_path
+        sgml_filtered_path = filtered_path
+        if sgml_filtered_path is None:
+            sgml_filtered_path = sgml_path.replace('.sgm', '.filtered.sgm')
+        return filter_sgml_docs(
+            sgml_path, docids, sgml_filtered_path, encoding=encoding
+        )
 
     def _compute_score(self):
         """Computes sacreBLEU scores for current submission."""
 
-        # Reference file may not exist
-        if not self.test_set.has_references():
-            return
-
-        # Do not compute scores if instructed not to do so
-        if not self.test_set.compute_scores:
+        # Reference file may not exist and scores may not be requested; in
+        # both cases there is nothing left to do for the scoring queue
+        if (
+            not self.test_set.has_references()
+            or not self.test_set.compute_scores
+        ):
+            self.score_status = SCORE_DONE
+            self.save()
             return
 
-        tokenize = '13a'
-        target_language_code = self.test_set.target_language.code
-        if target_language_code == 'ja':
-            # We use char-based tokenizer as MeCab was slow/unstable
-            tokenize = 'char'
-
-        elif target_language_code == 'km':
-            tokenize = 'char'
-
-        elif target_language_code == 'zh':
-            tokenize = 'zh'
-
-        # _msg = 'language: {0}, tokenize: {1}'.format(
-        # target_language_code, tokenize
-        # )
-        # print(_msg)
-
-        hyp_text_path = self.get_hyp_text(path_only=True)
-        ref_text_path = self.get_ref_text(path_only=True)
-
         try:
-            hyp_stream = [x for x in open(hyp_text_path, encoding='utf-8')]
-            ref_stream = [r for r in open(ref_text_path, encoding='utf-8')]
-
-            bleu = corpus_bleu(hyp_stream, [ref_stream], tokenize=tokenize)
-            self.score = bleu.score
-
-            chrf = corpus_chrf(hyp_stream, [ref_stream])
-            self.score_chrf = chrf.score
+            hyp_text_path = self.get_hyp_text(path_only=True)
+            ref_text_path = self.get_ref_text(path_only=True)
+
+            self.score, self.score_chrf = compute_scores(
+                hyp_text_path,
+                ref_text_path,
+                self.test_set.get_tokenize(),
+                self.test_set.get_ref_stats_path(),
+            )
+            self.score_status = SCORE_DONE
 
         except Exception:
-            # Don't set score to None, as that would trigger infinite loop
             # TODO: this should provide an error message to the user
             # TODO: the error message should be specific. A simple yet ugly
             # solution would be to use self.score as error codes to propagate
             # the source of the error
             self.score = -1
             self.score_chrf = None
+            self.score_status = SCORE_FAILED
 
         finally:
             self.save()
@@ -1250,6 +1510,14 @@ class Submission(models.Model):
         """Returns test set target language."""
         return self.test_set.target_language
 
+    def is_scoring_pending(self):
+        """Checks if the submission still waits for automatic scores."""
+        return self.score_status in (SCORE_QUEUED, SCORE_RUNNING)
+
+    def is_scoring_failed(self):
+        """Checks if automatic scoring failed for the submission."""
+        return self.score_status == SCORE_FAILED
+
     def _team_name(self):
         """Returns team publication name if set, or the original name otherwise."""
         return self.submitted_by.publication_name or self.submitted_by.name
@@ -1300,55 +1568,542 @@ class Submission(models.Model):
         using=DEFAULT_DB_ALIAS,
         update_fields=None,
     ):
-        """Compute sacreBLEU score on save()."""
+        """Marks submission as valid on save().
+
+        Scores are not computed here, but by the scoring worker, see
+        process_scoring_queue(). New submissions start as SCORE_QUEUED.
+        Leaderboard entries are refreshed if the submission changes them.
+        """
         self.is_valid = True
+        self.effective_is_public = self._compute_effective_is_public()
+        refresh = _leaderboard_fields_changed(self)
+        previous = getattr(self, '_leaderboard_values', {})
         super().save(force_insert, force_update, using, update_fields)
-        if not self.score and self.id:
-            self._compute_score()
+        _snapshot_leaderboard_fields(self)
+        if refresh:
+            refresh_leaderboards(
+                {self.test_set_id, previous.get('test_set_id')} - {None}
+            )
+        invalidate_competition_pages(self.test_set.competition_id)
 
-    def set_primary(self):
-        """Make this the primary submission for user/test set."""
-        self.is_primary = True
-        self.is_contrastive = False
-        self.save()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        _snapshot_leaderboard_fields(instance)
+        return instance
+
+    def _select_siblings_for_update(self):
+        """Locks and returns submissions of the same team and test set.
 
-        other_submissions = Submission.objects.filter(
-            submitted_by=self.submitted_by,
-            test_set=self.test_set,
+        Must be called inside a transaction. The rows stay locked until
+        the transaction ends, so concurrent changes cannot race.
+        """
+        siblings = Submission.objects.filter(
+            submitted_by=self.submitted_by_id,
+            test_set=self.test_set_id,
         )
-        for other_submission in other_submissions:
-            if self.is_contrastive:
-                continue  # Leave current contrastive submission as-is
+        list(siblings.select_for_update().values_list('id', flat=True))
+        return siblings
+
+    def set_primary(self):
+        """Make this the primary submission for user/test set.
+
+        Stores is_constrained of this submission with UPDATE queries
+        instead of save(), as neither scores nor leaderboard entries
+        depend on primary or contrastive flags.
+        """
+        with transaction.atomic():
+            siblings = self._select_siblings_for_update()
+            siblings.filter(id=self.id).update(
+                is_constrained=self.is_constrained,
+                is_contrastive=False,
+                is_primary=True,
+            )
+            siblings.exclude(id=self.id).filter(
+                Q(is_constrained=True)
+                | Q(is_contrastive=True)
+                | Q(is_primary=True)
+            ).update(
+                is_constrained=False,
+                is_contrastive=False,
+                is_primary=False,
+            )
 
-            if other_submission.id != self.id:
-                other_submission.is_constrained = False
-                other_submission.is_contrastive = False
-                other_submission.is_primary = False
-                other_submission.save()
+        self.is_primary = True
+        self.is_contrastive = False
 
     def set_contrastive(self):
         """Make this the contrastive submission for user/test set."""
         if self.is_primary:
             return
 
-        self.is_contrastive = True
-        self.save()
-
-        other_submissions = Submission.objects.filter(
-            submitted_by=self.submitted_by,
-            test_set=self.test_set,
-        )
-        for other_submission in other_submissions:
-            if other_submission.is_primary:
-                continue  # Leave current primary submission as-is
+        with transaction.atomic():
+            siblings = self._select_siblings_for_update()
+            siblings.filter(id=self.id).update(
+                is_constrained=self.is_constrained, is_contrastive=True
+            )
+            siblings.exclude(id=self.id).exclude(is_primary=True).filter(
+                Q(is_constrained=True) | Q(is_contrastive=True)
+            ).update(is_constrained=False, is_contrastive=False)
 
-            if other_submission.id != self.id:
-                other_submission.is_constrained = False
-                other_submission.is_contrastive = False
-                other_submission.is_primary = False
-                other_submission.save()
+        self.is_contrastive = True
 
     @property
     def get_name(self):
         """Make __str__() accessible in admin listings."""
         return str(self)
+
+
+class LeaderboardEntry(models.Model):
+    """Models a precomputed row of a competition leaderboard.
+
+    Entries are rebuilt per test set by refresh_leaderboards() whenever
+    scores or visibility of submissions, test sets or competitions change.
+    """
+
+    competition = models.ForeignKey(
+        Competition, on_delete=models.CASCADE, related_name='+'
+    )
+
+    test_set = models.ForeignKey(
+        TestSet, on_delete=models.CASCADE, related_name='+'
+    )
+
+    submission = models.ForeignKey(
+        Submission, on_delete=models.CASCADE, related_name='+'
+    )
+
+    # Used for ordering test sets on the leaderboard
+    test_set_name = models.CharField(max_length=MAX_NAME_LENGTH)
+
+    # str(test_set)
+    test_set_label = models.CharField(max_length=MAX_NAME_LENGTH + 50)
+
+    rank = models.PositiveSmallIntegerField()
+
+    # str(submission)
+    name = models.CharField(max_length=MAX_NAME_LENGTH + 50)
+
+    team_token = models.CharField(
+        blank=True, max_length=MAX_TOKEN_LENGTH, null=True
+    )
+
+    is_anonymous = models.BooleanField(default=True)
+
+    score_bleu = models.FloatField(blank=True, null=True)
+
+    score_chrf = models.FloatField(blank=True, null=True)
+
+    date_created = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=[
+                    'competition',
+                    'test_set_name',
+                    'test_set',
+                    'rank',
+                ],
+                name='leaderboard_entry_order_idx',
+            ),
+        ]
+
+    def __repr__(self):
+        return 'LeaderboardEntry(test_set={0}, rank={1}, name={2})'.format(
+            self.test_set_label, self.rank, self.name
+        )
+
+    def __str__(self):
+        return '{0} #{1}: {2}'.format(
+            self.test_set_label, self.rank, self.name
+        )
+
+
+class ExportJob(models.Model):
+    """Models a background job building a zip file for admins.
+
+    Jobs are processed by the export_worker management command, see
+    leaderboard/exports.py.
+    """
+
+    date_created = models.DateTimeField(
+        auto_now_add=True,
+        help_text='Creation date of this export job',
+    )
+
+    date_finished = models.DateTimeField(
+        blank=True,
+        help_text='Date when the export job finished',
+        null=True,
+    )
+
+    description = models.CharField(
+        max_length=MAX_NAME_LENGTH,
+        help_text='What is being exported',
+    )
+
+    submission_ids = models.JSONField(
+        blank=True, default=list, help_text='IDs of exported submissions'
+    )
+
+    test_set_ids = models.JSONField(
+        blank=True, default=list, help_text='IDs of exported test sets'
+    )
+
+    team_ids = models.JSONField(
+        blank=True, default=list, help_text='IDs of exported teams'
+    )
+
+    status = models.CharField(
+        choices=EXPORT_STATUS_CHOICES,
+        db_index=True,
+        default=EXPORT_QUEUED,
+        help_text='Status of the export job',
+        max_length=7,
+    )
+
+    processed_files = models.PositiveIntegerField(default=0)
+
+    total_files = models.PositiveIntegerField(default=0)
+
+    archive = models.FileField(
+        blank=True,
+        help_text='Zip file with exported files',
+        null=True,
+        upload_to='exports/',
+    )
+
+    error = models.TextField(blank=True, default='')
+
+    def __repr__(self):
+        return 'ExportJob(description={0}, status={1})'.format(
+            self.description, self.status
+        )
+
+    def __str__(self):
+        return 'Export #{0}: {1}'.format(self.id, self.description)
+
+
+def update_effective_visibility(submissions):
+    """Recomputes effective_is_public for the submissions queryset.
+
+    Runs UPDATE queries instead of saving every submission. Keep in sync
+    with Submission._compute_effective_is_public().
+    """
+    # Competition settings win over test set settings
+    competition_is_public = 'test_set__competition__is_public'
+    for is_public in (True, False):
+        submissions.filter(**{competition_is_public: is_public}).update(
+            effective_is_public=is_public
+        )
+
+    # Test set settings win over submission settings
+    submissions = submissions.filter(
+        **{competition_is_public + '__isnull': True}
+    )
+    for is_public in (True, False):
+        submissions.filter(test_set__is_public=is_public).update(
+            effective_is_public=is_public
+        )
+    submissions.filter(test_set__is_public__isnull=True).update(
+        effective_is_public=F('is_public')
+    )
+
+
+def get_ranked_submissions(test_set_ids):
+    """Returns top submissions of the test sets annotated with rank.
+
+    All test sets are ranked in a single query using ROW_NUMBER()
+    partitioned by test set.
+    """
+    return (
+        Submission.objects.filter(
+            test_set_id__in=test_set_ids,
+            test_set__competition__isnull=False,
+            is_valid=True,  # Ignore invalid submissions
+            is_removed=False,  # Ignore any removed submissions
+        )
+        .select_related(
+            'submitted_by',
+            'test_set__source_language',
+            'test_set__target_language',
+        )
+        .annotate(
+            rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('test_set')],
+                order_by=[
+                    # Test sets without scores are ordered by newest first
+                    Case(
+                        When(
+                            test_set__compute_scores=False,
+                            then=Value(None),
+                        ),
+                        default=F('score_chrf'),
+                    ).desc(),
+                    F('id').desc(),
+                ],
+            )
+        )
+        .filter(rank__lte=LEADERBOARD_SIZE)
+    )
+
+
+def refresh_leaderboards(test_set_ids):
+    """Rebuilds leaderboard entries for the given test sets."""
+    test_set_ids = list(test_set_ids)
+    if not test_set_ids:
+        return
+
+    entries = []
+    for submission in get_ranked_submissions(test_set_ids):
+        test_set = submission.test_set
+        score_bleu = submission.score
+        score_chrf = submission.score_chrf
+        if not test_set.compute_scores:
+            score_bleu = None
+            score_chrf = None
+
+        entries.append(
+            LeaderboardEntry(
+                competition_id=test_set.competition_id,
+                test_set=test_set,
+                submission=submission,
+                test_set_name=test_set.name,
+                test_set_label=str(test_set),
+                rank=submission.rank,
+                name=str(submission),
+                team_token=(
+                    submission.submitted_by.token
+                    if submission.submitted_by
+                    else None
+                ),
+                is_anonymous=not submission.effective_is_public,
+                score_bleu=score_bleu,
+                score_chrf=score_chrf,
+                date_created=submission.date_created,
+            )
+        )
+
+    with transaction.atomic():
+        LeaderboardEntry.objects.filter(
+            test_set_id__in=test_set_ids
+        ).delete()
+        LeaderboardEntry.objects.bulk_create(entries)
+
+
+def refresh_leaderboard(test_set_id):
+    """Rebuilds leaderboard entries for a single test set."""
+    refresh_leaderboards([test_set_id])
+
+
+@receiver(post_delete, sender=Submission)
+def _refresh_leaderboard_on_delete(sender, instance, **kwargs):
+    """Refreshes leaderboard entries when a submission is deleted.
+
+    Unlike a delete() method, this also runs for queryset and cascading
+    deletes, so the next submission is promoted in every case.
+    """
+    del sender, kwargs  # not used
+    refresh_leaderboard(instance.test_set_id)
+    invalidate_competition_pages(
+        *TestSet.objects.filter(id=instance.test_set_id).values_list(
+            'competition_id', flat=True
+        )
+    )
+
+
+def score_next_submission():
+    """Claims the oldest queued submission and computes its scores.
+
+    Returns the scored submission, or None if the queue is empty.
+    """
+    queued_ids = (
+        Submission.objects.filter(score_status=SCORE_QUEUED)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+    for submission_id in queued_ids[:SCORING_QUEUE_BATCH_SIZE]:
+        # The conditional update guarantees that concurrent workers cannot
+        # claim the same submission; it works on both SQLite and Postgres
+        claimed = Submission.objects.filter(
+            id=submission_id, score_status=SCORE_QUEUED
+        ).update(score_status=SCORE_RUNNING)
+        if not claimed:
+            continue  # Another worker has been faster
+
+        submission = Submission.objects.get(id=submission_id)
+        try:
+            submission._compute_score()  # pylint: disable=protected-access
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception(
+                'Scoring failed for submission #%s', submission_id
+            )
+            Submission.objects.filter(id=submission_id).update(
+                score=-1, score_chrf=None, score_status=SCORE_FAILED
+            )
+            submission.refresh_from_db()
+            refresh_leaderboard(submission.test_set_id)
+            invalidate_competition_pages(
+                submission.test_set.competition_id
+            )
+        return submission
+
+    return None
+
+
+def process_scoring_queue(max_jobs=None):
+    """Scores queued submissions until the queue is empty.
+
+    Args:
+        max_jobs (int): Stop after this many submissions if not None
+
+    Returns:
+        int: The number of processed submissions
+    """
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        if score_next_submission() is None:
+            break
+        processed += 1
+    return processed
+
+
+def requeue_running_submissions():
+    """Requeues submissions left running by a terminated worker."""
+    return Submission.objects.filter(score_status=SCORE_RUNNING).update(
+        score_status=SCORE_QUEUED
+    )
+
+
+def reconcile_primary_submissions():
+    """Stores default primary submissions for teams without a choice.
+
+    Like the team page, this selects the highest-scoring or the latest
+    submission which has not been withdrawn for every team and test set
+    without a primary submission.
+
+    Returns the number of new primary submissions.
+    """
+    valid_submissions = Submission.objects.filter(
+        is_valid=True, submitted_by__isnull=False
+    )
+    has_primary = valid_submissions.filter(
+        submitted_by=OuterRef('submitted_by'),
+        test_set=OuterRef('test_set'),
+        is_primary=True,
+    )
+    candidates = (
+        valid_submissions.filter(is_withdrawn=False)
+        .exclude(Exists(has_primary))
+        .only('id', 'is_constrained', 'submitted_by', 'test_set')
+        .order_by(
+            'submitted_by', 'test_set', '-score_chrf', '-date_created'
+        )
+    )
+
+    reconciled = set()
+    for submission in candidates.iterator():
+        key = (submission.submitted_by_id, submission.test_set_id)
+        if key not in reconciled:
+            submission.set_primary()
+            reconciled.add(key)
+    return len(reconciled)
+
+
+def get_primary_submissions(team):
+    """Returns primary submissions of the team, one per test set.
+
+    Test sets without a primary submission get the same default as on
+    the team page, the highest-scoring or the latest submission which has
+    not been withdrawn. Its is_primary is set but not saved, see
+    reconcile_primary_submissions() for storing the defaults.
+    """
+    submissions = (
+        team.submission_set.filter(is_valid=True)
+        .select_related(
+            'test_set__competition',
+            'test_set__source_language',
+            'test_set__target_language',
+        )
+        .order_by(
+            'test_set', '-is_primary', '-score_chrf', '-date_created'
+        )
+    )
+
+    primary = {}
+    for submission in submissions:
+        if submission.test_set_id in primary:
+            continue
+        if submission.is_primary or not submission.is_withdrawn:
+            submission.is_primary = True  # Not saved for defaults
+            primary[submission.test_set_id] = submission
+    return list(primary.values())
+
+
+def update_team_submissions(team, withdrawn, primary, contrastive):
+    """Applies team page choices using a fixed number of queries.
+
+    Args:
+        team (Team): Team owning the submissions; other ids are ignored
+        withdrawn (dict): Maps test set ids to withdrawn status
+        primary (dict): Maps primary submission ids to is_constrained
+        contrastive (dict): Maps contrastive submission ids to
+            is_constrained
+
+    Has the same effect as calling set_primary() and then
+    set_contrastive() on every chosen submission.
+    """
+    team_submissions = Submission.objects.filter(submitted_by=team)
+
+    with transaction.atomic():
+        for is_withdrawn in (True, False):
+            test_set_ids = [
+                x for x in withdrawn if withdrawn[x] is is_withdrawn
+            ]
+            if test_set_ids:
+                team_submissions.filter(test_set__in=test_set_ids).update(
+                    is_withdrawn=is_withdrawn
+                )
+
+        for chosen, is_primary in ((primary, True), (contrastive, False)):
+            if not chosen:
+                continue
+
+            candidates = team_submissions.filter(id__in=chosen)
+            if not is_primary:  # Primary submissions stay as they are
+                candidates = candidates.exclude(is_primary=True)
+            candidates = candidates.select_for_update()
+            test_set_ids = dict(candidates.values_list('id', 'test_set'))
+
+            # The last choice for any given test set wins
+            choices = {}
+            for submission_id in chosen:
+                if submission_id in test_set_ids:
+                    choices[test_set_ids[submission_id]] = submission_id
+
+            siblings = team_submissions.filter(test_set__in=choices)
+            if not is_primary:
+                siblings = siblings.exclude(is_primary=True)
+            siblings.exclude(id__in=choices.values()).filter(
+                Q(is_constrained=True)
+                | Q(is_contrastive=True)
+                | Q(is_primary=True)
+            ).update(
+                is_constrained=False,
+                is_contrastive=False,
+                is_primary=False,
+            )
+
+            for constrained in (True, False):
+                submission_ids = [
+                    x for x in choices.values() if chosen[x] == constrained
+                ]
+                if submission_ids:
+                    team_submissions.filter(id__in=submission_ids).update(
+                        is_constrained=constrained,
+                        is_contrastive=not is_primary,
+                        is_primary=is_primary,
+                    )
@@ -0,0 +1,43 @@
+"""
+Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
+"""
+import os
+from tempfile import TemporaryDirectory
+
+from django.test import override_settings
+
+# Settings override and temporary directory, see enable_temp_dirs()
+_TEMP_DIRS = []  # type: list
+
+
+def enable_temp_dirs():
+    """Moves files written by tests out of BASE_DIR.
+
+    Caches, derived files, metrics and reference statistics are written
+    to a temporary directory until disable_temp_dirs() is called. Test
+    modules call these from setUpModule() and tearDownModule().
+    """
+    tmp_dir = TemporaryDirectory()
+    settings_override = override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': (
+                    'django.core.cache.backends.filebased.FileBasedCache'
+                ),
+                'LOCATION': os.path.join(tmp_dir.name, 'cache'),
+            }
+        },
+        DERIVED_ROOT=os.path.join(tmp_dir.name, 'derived'),
+        METRICS_ROOT=os.path.join(tmp_dir.name, 'metrics'),
+        REF_STATS_ROOT=os.path.join(tmp_dir.name, 'refstats'),
+    )
+    settings_override.enable()
+    _TEMP_DIRS.extend((settings_override, tmp_dir))
+
+
+def disable_temp_dirs():
+    """Restores settings and deletes files of enable_temp_dirs()."""
+    settings_override, tmp_dir = _TEMP_DIRS
+    settings_override.disable()
+    tmp_dir.cleanup()
+    del _TEMP_DIRS[:]
@@ -1,30 +1,119 @@
 """
 Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
 """
+import asyncio
+import json
 import os
+import re
+import subprocess
+import sys
+import time
 from datetime import datetime
 from datetime import timedelta
+from io import BytesIO
+from io import StringIO
 from pathlib import Path
 from shutil import copyfile
-
+from tempfile import TemporaryDirectory
+from unittest import skipUnless
+from unittest.mock import patch
+from zipfile import ZIP_DEFLATED
+from zipfile import ZIP_STORED
+from zipfile import ZipFile
+
+import lxml.etree as ET
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.servers.basehttp import WSGIServer
+from django.db import connection
+from django.test import LiveServerTestCase
+from django.test import override_settings
 from django.test import TestCase
+from django.test.testcases import LiveServerThread
+from django.test.testcases import QuietWSGIRequestHandler
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from benchmarks.data import create_dataset
+from benchmarks.loadtest import percentile
+from benchmarks.loadtest import run_load
+from benchmarks.loadtest import setup
+from benchmarks.suite import BENCHMARKS
+from benchmarks.suite import run_benchmarks
+from leaderboard.admin import download_submission_files
+from leaderboard.cache import COMPETITION_SCOPE
+from leaderboard.cache import get_page_version
+from leaderboard.derived import GC_GRACE_SECONDS
+from leaderboard.derived import get_derived_path
+from leaderboard.exports import enqueue_export
+from leaderboard.exports import export_next_job
+from leaderboard.exports import make_team_json
+from leaderboard.exports import purge_old_exports
+from leaderboard.metrics import MERGED_METRICS_FILE
+from leaderboard.metrics import METRICS
 from leaderboard.models import Competition
+from leaderboard.models import EXPORT_DONE
+from leaderboard.models import ExportJob
+from leaderboard.models import get_primary_submissions
+from leaderboard.models import get_ranked_submissions
+from leaderboard.models import get_schema_validator
 from leaderboard.models import Language
+from leaderboard.models import LeaderboardEntry
+from leaderboard.models import process_scoring_queue
+from leaderboard.models import SCORE_DONE
+from leaderboard.models import SCORE_FAILED
+from leaderboard.models import SCORE_QUEUED
 from leaderboard.models import SGML_FILE
 from leaderboard.models import Submission
 from leaderboard.models import Team
 from leaderboard.models import TestSet
 from leaderboard.models import TEXT_FILE
+from leaderboard.models import validate_xml_schema
+from leaderboard.models import warm_up_validators
 from leaderboard.models import XML_FILE
+from leaderboard.tempdirs import disable_temp_dirs
+from leaderboard.tempdirs import enable_temp_dirs
 from leaderboard.utils import analyze_xml_file
+from leaderboard.utils import analyze_xml_tree
+from leaderboard.utils import compute_scores
+from leaderboard.utils import extract_xml_text
+from leaderboard.utils import filter_sgml_docs
+from leaderboard.utils import get_sgml_docids
+from leaderboard.utils import iter_zip_stream
+from leaderboard.utils import process_to_text
 from leaderboard.utils import process_xml_to_text
+from leaderboard.utils import TEXT_CHUNK_SIZE
+from leaderboard.views import get_teampage_submissions
 from ocelot.settings import BASE_DIR
+from ocelot.settings import SLOW_REQUEST_TOP_QUERIES
 
 TESTDATA_DIR = os.path.join(BASE_DIR, 'leaderboard/testdata')
 
 
+def setUpModule():
+    enable_temp_dirs()
+
+
+def tearDownModule():
+    disable_temp_dirs()
+
+
+def _process_sgml_to_text_per_line(sgml_path, txt_path):
+    """Extracts segments line by line, as process_to_text used to."""
+    with open(sgml_path, encoding='utf-8') as fin, open(
+        txt_path, 'w', encoding='utf-8'
+    ) as fout:
+        for line in fin:
+            if line.startswith('<seg '):
+                line = re.sub(r'<seg.*?>(.*)</seg>.*?', '\\1', line)
+                print(re.sub(r'\s+', ' ', line.strip()), file=fout)
+
+
 class UtilsTests(TestCase):
     """Tests for utils."""
 
@@ -32,6 +121,8 @@ class UtilsTests(TestCase):
         file_paths = (
             '/xml/sample-hyp.xml.temp.txt',
             '/xml/multi-src-ref.xml.temp.txt',
+            '/xml/sample-src-multirefs.xml.temp.txt',
+            '/xml/sample-src-multirefs.xml.extracted.txt',
         )
         for file_path in file_paths:
             txt_path = Path(TESTDATA_DIR + file_path)
@@ -111,6 +202,127 @@ class UtilsTests(TestCase):
         with open(txt_file, 'r', encoding='utf8') as content:
             self.assertTrue(len(content.readlines()) == 56)
 
+    def test_analyze_xml_tree_matches_analyze_xml_file(self):
+        """Checks if a parsed tree gives the same results as the file."""
+        xml_path = TESTDATA_DIR + '/xml/multi-src-ref.xml'
+        with open(xml_path, 'rb') as xml_file:
+            tree = ET.parse(xml_file)
+
+        self.assertEqual(
+            analyze_xml_tree(tree), analyze_xml_file(xml_path)
+        )
+
+    def test_extract_xml_text_uses_first_translator(self):
+        """Checks if single-pass extraction selects the first reference."""
+        xml_path = TESTDATA_DIR + '/xml/sample-src-multirefs.xml'
+        txt_path = xml_path + '.extracted.txt'
+        info = extract_xml_text(xml_path, txt_path, 'ref')
+        self.assertEqual(info, analyze_xml_file(xml_path))
+
+        expected_path = xml_path + '.temp.txt'
+        process_xml_to_text(xml_path, expected_path, reference='A')
+        self.assertEqual(
+            Path(txt_path).read_text(encoding='utf-8'),
+            Path(expected_path).read_text(encoding='utf-8'),
+        )
+
+    def test_filter_sgml_docs_reorders_and_serializes_docs(self):
+        """Checks SGML filtering against the expected serialization."""
+        sgml = (
+            '<tstset trglang="de" setid="t">\n'
+            '<DOC sysid="s" docid="A">\n<p>\n'
+            '<seg id="1">a &amp; b</seg>\n<seg id="2">   </seg>\n'
+            '</p>\n</DOC>\n'
+            '<doc docid="testsuite-1"><p><seg id="1">x</seg></p></doc>\n'
+            '<DOC docid="b"><p></p></DOC>\n'
+            '</tstset>'
+        )
+        with TemporaryDirectory() as tmp_dir:
+            sgml_path = os.path.join(tmp_dir, 'hyp.sgm')
+            filtered_path = os.path.join(tmp_dir, 'hyp.filtered.sgm')
+            Path(sgml_path).write_text(sgml, encoding='utf-8')
+
+            self.assertEqual(
+                get_sgml_docids(sgml_path), ['A', 'testsuite-1', 'b']
+            )
+            filter_sgml_docs(sgml_path, ['B', 'a'], filtered_path)
+            self.assertEqual(
+                Path(filtered_path).read_text(encoding='utf-8'),
+                '<tstset setid="t" trglang="de">\n\n\n\n'
+                '<DOC docid="b"><p/></DOC>'
+                '<DOC docid="A" sysid="s">\n<p>\n'
+                '<seg id="1">a &amp; b</seg>\n<seg id="2"> </seg>\n'
+                '</p>\n</DOC></tstset>',
+            )
+
+    def test_process_to_text_extracts_all_segments(self):
+        """Checks that segments are extracted regardless of line layout."""
+        sgml = (
+            '<doc docid="a">\n'
+            '<seg id="1">One  segment </seg>\n'
+            '  <p><seg id="2">Indented</seg><seg id="3">Same line</seg></p>\n'
+            '<seg id="4">Multiple\nlines</seg>\n'
+            '<seg id="5"></seg>\n'
+            '<seg id="6"/><seg id="7">After empty</seg>\n'
+            '<seg id="8" />\n'
+            '</doc>\n'
+        )
+        with TemporaryDirectory() as tmp_dir:
+            sgml_path = os.path.join(tmp_dir, 'hyp.sgm')
+            txt_path = os.path.join(tmp_dir, 'hyp.txt')
+            Path(sgml_path).write_text(sgml, encoding='utf-8')
+            # Also split segments and tags between chunks
+            for size in (TEXT_CHUNK_SIZE, 5):
+                with patch('leaderboard.utils.TEXT_CHUNK_SIZE', size):
+                    process_to_text(sgml_path, txt_path)
+                self.assertEqual(
+                    Path(txt_path).read_text(encoding='utf-8'),
+                    'One segment\nIndented\nSame line\nMultiple lines\n'
+                    '\n\nAfter empty\n\n',
+                )
+
+    def test_process_to_text_benchmark(self):
+        """Compares process_to_text with a per-line regex extractor."""
+        with TemporaryDirectory() as tmp_dir:
+            baseline_time, process_time = 0.0, 0.0
+            for sgml_file in Path(TESTDATA_DIR).glob('*.sgm'):
+                sgml_path = os.path.join(tmp_dir, sgml_file.name)
+                Path(sgml_path).write_text(
+                    sgml_file.read_text(encoding='utf-8') * 100,
+                    encoding='utf-8',
+                )
+
+                baseline_path = sgml_path + '.baseline.txt'
+                start = time.perf_counter()
+                _process_sgml_to_text_per_line(sgml_path, baseline_path)
+                baseline_time += time.perf_counter() - start
+
+                txt_path = sgml_path + '.txt'
+                start = time.perf_counter()
+                process_to_text(sgml_path, txt_path)
+                process_time += time.perf_counter() - start
+
+                self.assertEqual(
+                    Path(txt_path).read_bytes(),
+                    Path(baseline_path).read_bytes(),
+                )
+
+        # Typically 3-5x faster; the margin keeps busy machines green
+        self.assertGreater(baseline_time, 2 * process_time)
+
+    def test_zip_stream_stores_compressed_files(self):
+        """Checks that already compressed files are not compressed again."""
+        entries = [
+            ('a.txt', ContentFile(b'a' * 1000)),
+            ('b.gz', ContentFile(b'b' * 1000)),
+        ]
+        archive = ZipFile(BytesIO(b''.join(iter_zip_stream(entries))))
+        self.assertEqual(
+            archive.getinfo('a.txt').compress_type, ZIP_DEFLATED
+        )
+        self.assertEqual(archive.getinfo('b.gz').compress_type, ZIP_STORED)
+        self.assertEqual(archive.read('b.gz'), b'b' * 1000)
+
 
 class SubmissionTests(TestCase):
     """Tests Submission model."""
@@ -156,8 +368,8 @@ class SubmissionTests(TestCase):
         session.save()
 
     def _make_submission(self, file_name, file_format=TEXT_FILE):
-        """Makes a submission."""
-        return Submission.objects.create(
+        """Makes a submission and runs the scoring queue."""
+        submission = Submission.objects.create(
             name=file_name,
             original_name=file_name,
             test_set=self.testset,
@@ -165,6 +377,9 @@ class SubmissionTests(TestCase):
             file_format=file_format,
             hyp_file=os.path.join(TESTDATA_DIR, file_name),
         )
+        process_scoring_queue()
+        submission.refresh_from_db()
+        return submission
 
     def test_scores_are_computed_for_submission_in_text_format(self):
         """Checks that scores are computed for a submission."""
@@ -184,6 +399,235 @@ class SubmissionTests(TestCase):
         self.assertEqual(round(sub.score, 3), 42.431)
         self.assertEqual(round(sub.score_chrf, 3), 66.444)
 
+    def test_submission_is_queued_for_scoring(self):
+        """Checks that scores are not computed on save(), but by the queue."""
+        _file = 'newstest2019.msft-WMT19-document-level.6808.en-de.txt'
+        sub = Submission.objects.create(
+            name=_file,
+            test_set=self.testset,
+            submitted_by=self.team,
+            file_format=TEXT_FILE,
+            hyp_file=os.path.join(TESTDATA_DIR, _file),
+        )
+        self.assertEqual(sub.score_status, SCORE_QUEUED)
+        self.assertIsNone(sub.score)
+
+        self.assertEqual(process_scoring_queue(), 1)
+        sub.refresh_from_db()
+        self.assertEqual(sub.score_status, SCORE_DONE)
+        self.assertEqual(round(sub.score, 3), 42.431)
+
+        # The queue is empty now
+        self.assertEqual(process_scoring_queue(), 0)
+
+    def test_scoring_failure_is_recorded(self):
+        """Checks that a submission which cannot be scored is marked as failed."""
+        sub = Submission.objects.create(
+            name='missing.txt',
+            test_set=self.testset,
+            submitted_by=self.team,
+            file_format=TEXT_FILE,
+            hyp_file=os.path.join(TESTDATA_DIR, 'missing.txt'),
+        )
+        process_scoring_queue()
+        sub.refresh_from_db()
+        self.assertEqual(sub.score_status, SCORE_FAILED)
+        self.assertEqual(sub.score, -1)
+
+    def test_rescore_command_recomputes_scores(self):
+        """Checks that the rescore command updates scores in bulk."""
+        _file = 'newstest2019.msft-WMT19-document-level.6808.en-de.txt'
+        sub = self._make_submission(_file)
+        Submission.objects.filter(id=sub.id).update(
+            score=0, score_chrf=0, score_status=SCORE_QUEUED
+        )
+
+        output = StringIO()
+        call_command(
+            'rescore', test_set=self.testset.id, workers=2, stdout=output
+        )
+        sub.refresh_from_db()
+        self.assertEqual(sub.score_status, SCORE_DONE)
+        self.assertEqual(round(sub.score, 3), 42.431)
+        self.assertEqual(round(sub.score_chrf, 3), 66.444)
+        self.assertIn('submissions/s', output.getvalue())
+
+    def test_teampage_shows_pending_scores(self):
+        """Checks that the team page shows submissions waiting for scores."""
+        self._set_ocelot_team_token()
+
+        _file = 'newstest2019.msft-WMT19-document-level.6808.en-de.txt'
+        Submission.objects.create(
+            name=_file,
+            test_set=self.testset,
+            submitted_by=self.team,
+            file_format=TEXT_FILE,
+            hyp_file=os.path.join(TESTDATA_DIR, _file),
+        )
+        response = self.client.get('/teampage')
+        self.assertContains(response, 'Scoring pending')
+
+        process_scoring_queue()
+        response = self.client.get('/teampage')
+        self.assertNotContains(response, 'Scoring pending')
+
+    def _post_teampage_choices(self, test_sets):
+        """Posts team page choices for test sets, returns query count."""
+        data = {
+            'testset': [],
+            'withdrawn': [],
+            'primary': [],
+            'contrastive': [],
+            'constrained': [],
+        }
+        for test_set in test_sets:
+            first, second = Submission.objects.filter(
+                test_set=test_set, submitted_by=self.team
+            ).order_by('id')
+            data['testset'].append(test_set.id)
+            data['withdrawn'].append('0')
+            data['primary'].append(first.id)
+            data['contrastive'].append(second.id)
+        data['constrained'] = ['1'] * len(test_sets) + ['0'] * len(
+            test_sets
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/teampage', data)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_teampage_post_uses_constant_number_of_queries(self):
+        """Checks that team page choices are saved with bulk updates."""
+        self._set_ocelot_team_token()
+        other_team = Team.objects.create(name='Team B', email='b@b.com')
+
+        _file = 'newstest2019.msft-WMT19-document-level.6808.en-de.txt'
+        test_sets = [self.testset]
+        for idx in range(3):
+            test_set = TestSet.objects.get(pk=self.testset.pk)
+            test_set.pk = None
+            test_set.name = 'TestSet{0}'.format(idx)
+            test_set.save()
+            test_sets.append(test_set)
+
+        for test_set in test_sets:
+            for team in (self.team, self.team, other_team):
+                Submission.objects.create(
+                    name=_file,
+                    test_set=test_set,
+                    submitted_by=team,
+                    file_format=TEXT_FILE,
+                    hyp_file=os.path.join(TESTDATA_DIR, _file),
+                )
+
+        self.client.get('/teampage')  # Caches team data for the session
+        num_queries = self._post_teampage_choices(test_sets[:1])
+        self.assertEqual(
+            self._post_teampage_choices(test_sets), num_queries
+        )
+
+        for test_set in test_sets:
+            first, second = Submission.objects.filter(
+                test_set=test_set, submitted_by=self.team
+            ).order_by('id')
+            self.assertTrue(first.is_primary)
+            self.assertTrue(first.is_constrained)
+            self.assertTrue(second.is_contrastive)
+            self.assertFalse(second.is_constrained)
+
+        # Other teams' submissions must not be changed
+        self.assertFalse(
+            Submission.objects.filter(submitted_by=other_team)
+            .exclude(is_primary=False, is_contrastive=False)
+            .exists()
+        )
+
+        response = self.client.post(
+            '/teampage',
+            {'testset': [self.testset.id], 'withdrawn': ['1']},
+        )
+        self.assertEqual(response.status_code, 200)
+        withdrawn = Submission.objects.filter(
+            test_set=self.testset, is_withdrawn=True
+        )
+        self.assertEqual(
+            set(withdrawn.values_list('submitted_by', flat=True)),
+            {self.team.id},
+        )
+
+    def test_teampage_get_does_not_write_default_primary(self):
+        """Checks that viewing the team page only reads submissions."""
+        self._set_ocelot_team_token()
+        _file = 'newstest2019.msft-WMT19-document-level.6808.en-de.txt'
+        first = self._make_submission(_file)
+        second = self._make_submission(_file)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/teampage')
+        self.assertFalse(
+            [x for x in queries if not x['sql'].startswith('SELECT')]
+        )
+        self.assertContains(
+            response,
+            '<option value="{0}"selected="selected">'.format(second.id),
+        )
+        self.assertFalse(
+            Submission.objects.filter(is_primary=True).exists()
+        )
+
+        output = StringIO()
+        call_command('reconcile_primary_submissions', stdout=output)
+        self.assertIn('Selected 1 primary', output.getvalue())
+        self.assertTrue(Submission.objects.get(id=second.id).is_primary)
+        self.assertFalse(Submission.objects.get(id=first.id).is_primary)
+
+    def test_team_json_includes_default_primary(self):
+        """Checks that team files list the team page default primary."""
+        _file = 'newstest2019.msft-WMT19-document-level.6808.en-de.txt'
+        first = self._make_submission(_file)
+        second = self._make_submission(_file)
+
+        with CaptureQueriesContext(connection) as queries:
+            team_data = json.loads(
+                make_team_json(Team.objects.filter(id=self.team.id))
+            )
+        self.assertFalse(
+            [x for x in queries if not x['sql'].startswith('SELECT')]
+        )
+        self.assertEqual(team_data[0]['number_of_primary_submissions'], 1)
+        submission_data = team_data[0]['primary_submissions'][0]
+        self.assertEqual(submission_data['submission_id'], second.id)
+        self.assertTrue(submission_data['is_primary'])
+
+        second.is_withdrawn = True
+        second.save()
+        self.assertEqual(
+            [x.id for x in get_primary_submissions(self.team)], [first.id]
+        )
+
+        second.set_primary()
+        self.assertEqual(
+            [x.id for x in get_primary_submissions(self.team)], [second.id]
+        )
+
+    def test_team_data_is_cached_until_team_changes(self):
+        """Checks that signed-in page views do not query the team."""
+        self._set_ocelot_team_token()
+        self.client.get('/welcome')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/welcome')
+        self.assertFalse(
+            [x for x in queries if 'leaderboard_team' in x['sql']]
+        )
+        self.assertContains(response, 'Team A')
+
+        self.team.name = 'Team Renamed'
+        self.team.save()
+        response = self.client.get('/welcome')
+        self.assertContains(response, 'Team Renamed')
+
     def test_inactive_testsets_are_not_shown(self):
         """Checks that inactive test sets are not shown in the submission form."""
         self._set_ocelot_team_token()
@@ -311,6 +755,7 @@ class SubmissionTests(TestCase):
         tst = sub.test_set
         tst.is_public = False
         tst.save()
+        sub.refresh_from_db()
         self.assertIn('Anonymous', str(sub))
 
         comp = sub.test_set.competition
@@ -330,11 +775,13 @@ class SubmissionTests(TestCase):
         tst = sub.test_set
         tst.is_public = True
         tst.save()
+        sub.refresh_from_db()
         self.assertNotIn('Anonymous', str(sub))
 
         comp = sub.test_set.competition
         comp.is_public = False
         comp.save()
+        sub.refresh_from_db()
         self.assertIn('Anonymous', str(sub))
 
         response = self.client.get('/leaderboard/{0}'.format(comp.id))
@@ -354,11 +801,13 @@ class SubmissionTests(TestCase):
         tst = sub.test_set
         tst.is_public = True
         tst.save()
+        sub.refresh_from_db()
         self.assertNotIn('Anonymous', str(sub))
 
         comp = sub.test_set.competition
         comp.is_public = True
         comp.save()
+        sub.refresh_from_db()
         self.assertNotIn('Anonymous', str(sub))
 
         response = self.client.get('/leaderboard/{0}'.format(comp.id))
@@ -391,6 +840,37 @@ class SubmissionTests(TestCase):
             response, 'Anonymous submission #{0}'.format(sub.id)
         )
 
+    def test_set_primary_and_contrastive_update_siblings(self):
+        """Checks that primary and contrastive flags are set in bulk."""
+        _file = 'newstest2019.msft-WMT19-document-level.6808.en-de.txt'
+        first, second, third = [
+            self._make_submission(_file) for _ in '123'
+        ]
+
+        second.is_constrained = True
+        # SELECT FOR UPDATE and two UPDATEs, inside a savepoint in tests
+        with self.assertNumQueries(5):
+            second.set_primary()
+        third.set_contrastive()
+        first.set_primary()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        third.refresh_from_db()
+        self.assertTrue(first.is_primary)
+        self.assertFalse(first.is_contrastive)
+        self.assertFalse(second.is_primary)
+        self.assertFalse(second.is_constrained)
+        self.assertFalse(third.is_primary)
+        self.assertFalse(third.is_contrastive)
+
+        third.is_constrained = True
+        third.set_contrastive()
+        third.refresh_from_db()
+        self.assertTrue(third.is_contrastive)
+        self.assertTrue(third.is_constrained)
+        self.assertTrue(Submission.objects.get(id=first.id).is_primary)
+
 
 class XMLSubmissionTests(TestCase):
     """Tests Submission model."""
@@ -482,8 +962,8 @@ class XMLSubmissionTests(TestCase):
     def _make_submission(
         self, file_name, file_format=TEXT_FILE, test_set=None
     ):
-        """Makes a submission."""
-        return Submission.objects.create(
+        """Makes a submission and runs the scoring queue."""
+        submission = Submission.objects.create(
             name=file_name,
             original_name=file_name,
             test_set=test_set or self.testset,
@@ -491,6 +971,9 @@ class XMLSubmissionTests(TestCase):
             file_format=file_format,
             hyp_file=os.path.join(TESTDATA_DIR, file_name),
         )
+        process_scoring_queue()
+        submission.refresh_from_db()
+        return submission
 
     def _set_ocelot_team_token(self):
         """Set the team token to be able to render the submission form."""
@@ -569,6 +1052,24 @@ class XMLSubmissionTests(TestCase):
 
         self._clean_text_file(_file)
 
+    def test_schema_validators_are_compiled_once(self):
+        """Checks that schema validators are reused across validations."""
+        warm_up_validators()
+        relaxng = get_schema_validator(XML_FILE)
+        xsd = get_schema_validator(SGML_FILE)
+
+        _file = 'xml/sample-hyp.xml'
+        with open(os.path.join(TESTDATA_DIR, _file), 'rb') as xml:
+            validate_xml_schema(File(xml, name=_file))
+
+        _file = 'xml/sample-hyp.invalid.xml'
+        with open(os.path.join(TESTDATA_DIR, _file), 'rb') as xml:
+            with self.assertRaisesMessage(ValidationError, 'Line'):
+                validate_xml_schema(File(xml, name=_file))
+
+        self.assertIs(get_schema_validator(XML_FILE), relaxng)
+        self.assertIs(get_schema_validator(SGML_FILE), xsd)
+
     def test_submission_in_xml_format_must_have_systems(self):
         """Checks that submissions in XML format without system translations are not allowed."""
         self._set_ocelot_team_token()
@@ -641,6 +1142,33 @@ class TestSetTests(TestCase):
         self.assertTrue(tst.ref_file.name.endswith('.sgm'))
         self.assertTrue(tst.has_references())
 
+    def test_reference_stats_are_cached_on_save(self):
+        """Checks that reference statistics are precomputed on save()."""
+        tst = TestSet.objects.create(
+            name='TestSetStats',
+            file_format=TEXT_FILE,
+            src_file=os.path.join(
+                TESTDATA_DIR, 'newstest2019-ende-src.en.txt'
+            ),
+            ref_file=os.path.join(
+                TESTDATA_DIR, 'newstest2019-ende-ref.de.txt'
+            ),
+        )
+        stats_path = Path(tst.get_ref_stats_path())
+        self.assertTrue(stats_path.exists())
+
+        # Scores must not change when computed from cached statistics
+        hyp_path = os.path.join(
+            TESTDATA_DIR,
+            'newstest2019.msft-WMT19-document-level.6808.en-de.txt',
+        )
+        ref_path = tst.get_ref_text_path()
+        cached = compute_scores(hyp_path, ref_path, '13a', str(stats_path))
+        uncached = compute_scores(hyp_path, ref_path, '13a')
+        self.assertEqual(cached, uncached)
+
+        stats_path.unlink()
+
     def test_create_test_set_with_text_files(self):
         """Checks that a test set can be created from text files."""
         TestSet.objects.create(
@@ -677,17 +1205,13 @@ class TestSetTests(TestCase):
         self.assertTrue(tst.has_references())
 
         # Check if text files has been created and are non empty
-        src_txt_file = Path(tst.src_file.name.replace('.xml', '.txt'))
-        ref_txt_file = Path(tst.ref_file.name.replace('.xml', '.txt'))
+        src_txt_file = Path(tst.get_src_text_path())
+        ref_txt_file = Path(tst.get_ref_text_path())
         self.assertTrue(src_txt_file.exists())
         self.assertTrue(ref_txt_file.exists())
         self.assertTrue(src_txt_file.stat().st_size > 0)
         self.assertTrue(ref_txt_file.stat().st_size > 0)
 
-        # Clean up created files
-        src_txt_file.unlink()
-        ref_txt_file.unlink()
-
     def test_create_test_set_with_collections(self):
         """Checks that a test set can be created from a single collection."""
 
@@ -708,8 +1232,8 @@ class TestSetTests(TestCase):
 
         # Check if text files has been created and have only 12 segments from
         # the collection 'B'
-        src_txt_file = Path(tst.src_file.name.replace('.xml', '.txt'))
-        ref_txt_file = Path(tst.ref_file.name.replace('.xml', '.txt'))
+        src_txt_file = Path(tst.get_src_text_path())
+        ref_txt_file = Path(tst.get_ref_text_path())
         self.assertTrue(src_txt_file.exists())
         self.assertTrue(ref_txt_file.exists())
         self.assertTrue(src_txt_file.stat().st_size > 0)
@@ -719,12 +1243,6 @@ class TestSetTests(TestCase):
         with open(ref_txt_file, 'r', encoding='utf8') as cnt:
             self.assertTrue(len(cnt.readlines()) == 12)
 
-        # Clean up created files
-        if src_txt_file.exists():
-            src_txt_file.unlink()
-        if ref_txt_file.exists():
-            ref_txt_file.unlink()
-
     def test_create_test_set_without_reference(self):
         """Checks that a test set can be created without a reference."""
 
@@ -741,13 +1259,61 @@ class TestSetTests(TestCase):
         self.assertFalse(tst.has_references())
 
         # Check if text files has been created
-        src_txt_file = Path(tst.src_file.name.replace('.xml', '.txt'))
+        src_txt_file = Path(tst.get_src_text_path())
         self.assertTrue(src_txt_file.exists())
         self.assertTrue(src_txt_file.stat().st_size > 0)
 
-        # Clean up created files
-        if src_txt_file.exists():
-            src_txt_file.unlink()
+    def test_derived_files_are_shared_and_collected(self):
+        """Checks that derived files are content-addressed and collected."""
+        with TemporaryDirectory() as tmp_dir, override_settings(
+            DERIVED_ROOT=os.path.join(tmp_dir, 'derived')
+        ):
+            src_path = os.path.join(TESTDATA_DIR, 'xml/sample-src.xml')
+            copy_path = os.path.join(tmp_dir, 'sample-src.copy.xml')
+            copyfile(src_path, copy_path)
+
+            tst1 = TestSet.objects.create(
+                name='TestSetF', file_format=XML_FILE, src_file=src_path
+            )
+            tst2 = TestSet.objects.create(
+                name='TestSetG', file_format=XML_FILE, src_file=copy_path
+            )
+            tst3 = TestSet.objects.create(
+                name='TestSetH',
+                file_format=XML_FILE,
+                src_file=copy_path,
+                collection='B',
+            )
+
+            # Identical uploads share a file, other parameters do not
+            self.assertEqual(
+                tst1.get_src_text_path(), tst2.get_src_text_path()
+            )
+            self.assertNotEqual(
+                tst2.get_src_text_path(), tst3.get_src_text_path()
+            )
+            self.assertTrue(tst1.get_src_text_path().startswith(tmp_dir))
+
+            # A changed upload is extracted again
+            with open(copy_path, 'a', encoding='utf-8') as xml_file:
+                xml_file.write('\n')
+            self.assertNotEqual(
+                tst1.get_src_text_path(), tst2.get_src_text_path()
+            )
+            self.assertTrue(Path(tst2.get_src_text_path()).exists())
+
+            # Unused derived files are deleted after the grace period
+            orphan_path = get_derived_path('0' * 64)
+            os.makedirs(os.path.dirname(orphan_path), exist_ok=True)
+            Path(orphan_path).write_text('orphan\n')
+            old_time = time.time() - GC_GRACE_SECONDS - 1
+            os.utime(orphan_path, (old_time, old_time))
+            live_path = tst1.get_src_text_path()
+            os.utime(live_path, (old_time, old_time))
+
+            call_command('gc_derived_files', stdout=StringIO())
+            self.assertFalse(Path(orphan_path).exists())
+            self.assertTrue(Path(live_path).exists())
 
 
 class CompetitionTests(TestCase):
@@ -895,3 +1461,538 @@ class LeaderboardTests(TestCase):
         for sub in subs:
             self.assertContains(response, str(sub))
         self.assertNotContains(response, 'No submissions')
+
+    def test_leaderboard_query_count_does_not_grow_with_test_sets(self):
+        """Checks that leaderboard uses a constant number of queries."""
+        comp = Competition.objects.get(name='Competition A')
+        url = '/leaderboard/{0}'.format(comp.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        num_queries = len(queries)
+
+        test_a = TestSet.objects.get(name='TestSet A')
+        team_a = Team.objects.get(name='Team A')
+        for idx in range(3):
+            test_set = TestSet.objects.get(pk=test_a.pk)
+            test_set.pk = None
+            test_set.name = 'TestSet {0}'.format(idx)
+            test_set.save()
+            for submission in Submission.objects.filter(test_set=test_a):
+                submission.pk = None
+                submission.test_set = test_set
+                submission.submitted_by = team_a
+                submission.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(queries), num_queries)
+        self.assertEqual(len(response.context['data']), 4)
+
+    def test_leaderboard_ranks_submissions_by_chrf(self):
+        """Checks that leaderboard shows top submissions by chrF first."""
+        comp = Competition.objects.get(name='Competition A')
+        first, second = Submission.objects.filter(
+            test_set__competition=comp
+        ).order_by('id')
+        first.score_chrf = 50.0
+        first.save()
+        second.score_chrf = 40.0
+        second.save()
+
+        response = self.client.get('/leaderboard/{0}'.format(comp.id))
+        ((_, rows),) = response.context['data']
+        self.assertEqual(
+            [row['id'] for row in rows], [first.id, second.id]
+        )
+
+        test_set = first.test_set
+        test_set.compute_scores = False
+        test_set.save()
+
+        response = self.client.get('/leaderboard/{0}'.format(comp.id))
+        ((_, rows),) = response.context['data']
+        self.assertEqual(
+            [row['id'] for row in rows], [second.id, first.id]
+        )
+        self.assertIsNone(rows[0]['score_chrf'])
+
+    def test_leaderboard_entries_follow_competition_visibility(self):
+        """Checks that leaderboard entries are refreshed on visibility change."""
+        comp = Competition.objects.get(name='Competition A')
+        self.assertFalse(
+            LeaderboardEntry.objects.filter(is_anonymous=False).exists()
+        )
+
+        comp.is_public = True
+        comp.save()
+        entries = LeaderboardEntry.objects.filter(competition=comp)
+        self.assertEqual(entries.count(), 2)
+        self.assertFalse(entries.filter(is_anonymous=True).exists())
+
+        response = self.client.get('/leaderboard/{0}'.format(comp.id))
+        self.assertNotContains(response, 'Anonymous submission #')
+
+    def test_leaderboard_entries_follow_team_token(self):
+        """Checks that entries are refreshed when a team token changes."""
+        team = Team.objects.get(name='Team A')
+        team.token = 'new-token'
+        team.save()
+        self.assertTrue(
+            LeaderboardEntry.objects.filter(
+                team_token='new-token'
+            ).exists()
+        )
+
+    def test_queryset_delete_promotes_next_submission(self):
+        """Checks that queryset deletes refresh leaderboard entries."""
+        comp = Competition.objects.get(name='Competition A')
+        first, second = Submission.objects.filter(
+            test_set__competition=comp
+        ).order_by('id')
+        with patch('leaderboard.models.LEADERBOARD_SIZE', 1):
+            first.score_chrf = 50.0
+            first.save()
+            second.score_chrf = 40.0
+            second.save()
+            self.assertEqual(
+                list(
+                    LeaderboardEntry.objects.values_list(
+                        'submission', flat=True
+                    )
+                ),
+                [first.id],
+            )
+
+            Submission.objects.filter(id=first.id).delete()
+            self.assertEqual(
+                list(
+                    LeaderboardEntry.objects.values_list(
+                        'submission', flat=True
+                    )
+                ),
+                [second.id],
+            )
+
+    def test_refresh_leaderboards_command_rebuilds_entries(self):
+        """Checks that refresh_leaderboards rebuilds deleted entries."""
+        LeaderboardEntry.objects.all().delete()
+
+        out = StringIO()
+        call_command('refresh_leaderboards', stdout=out)
+        self.assertIn(
+            'Refreshed leaderboards for 1 test set(s)', out.getvalue()
+        )
+        self.assertEqual(LeaderboardEntry.objects.count(), 2)
+
+    def test_anonymous_leaderboard_is_cached_per_competition(self):
+        """Checks that saving a submission invalidates its competition only."""
+        comp_a = Competition.objects.get(name='Competition A')
+        comp_b = Competition.objects.get(name='Competition B')
+        url_a = '/leaderboard/{0}'.format(comp_a.id)
+        url_b = '/leaderboard/{0}'.format(comp_b.id)
+        version_b = get_page_version(COMPETITION_SCOPE, comp_b.id)
+
+        self.client.get(url_a)
+        with self.assertNumQueries(0):
+            response = self.client.get(url_a)
+        self.assertContains(response, comp_a.description)
+
+        submission = Submission.objects.filter(
+            test_set__competition=comp_a
+        ).first()
+        submission.score_chrf = 55.5
+        submission.save()
+
+        self.assertEqual(
+            get_page_version(COMPETITION_SCOPE, comp_b.id), version_b
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url_a)
+        self.assertGreater(len(queries), 0)
+
+        self.client.get(url_b)
+        with self.assertNumQueries(0):
+            self.client.get(url_b)
+
+    def test_pages_invalidated_by_another_process_are_not_served(self):
+        """Checks that page versions are shared with worker processes."""
+        comp = Competition.objects.get(name='Competition A')
+        url = '/leaderboard/{0}'.format(comp.id)
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        # Invalidate like the scoring worker does, in a separate process
+        script = (
+            'import django; django.setup(); '
+            'from leaderboard.cache import invalidate_competition_pages; '
+            'invalidate_competition_pages({0})'.format(comp.id)
+        )
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='ocelot.settings',
+            OCELOT_CACHE_ROOT=settings.CACHES['default']['LOCATION'],
+        )
+        subprocess.run(
+            [sys.executable, '-c', script],
+            check=True,
+            cwd=BASE_DIR,
+            env=env,
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertGreater(len(queries), 0)
+
+    def test_signed_in_team_bypasses_page_cache(self):
+        """Checks that pages of signed-in teams are not served from cache."""
+        comp = Competition.objects.get(name='Competition A')
+        url = '/leaderboard/{0}'.format(comp.id)
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Sign out')
+
+        team = Team.objects.get(name='Team A')
+        session = self.client.session
+        session['ocelot_team_token'] = team.token
+        session.save()
+
+        response = self.client.get(url)
+        self.assertContains(response, 'Sign out')
+
+    def test_performance_middleware_records_view_metrics(self):
+        """Checks logged and exported metrics of a leaderboard request."""
+        cache.clear()
+        METRICS.clear()
+        comp = Competition.objects.get(name='Competition A')
+        with self.assertLogs('ocelot.performance', 'INFO') as logs:
+            response = self.client.get('/leaderboard/{0}'.format(comp.id))
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'leaderboard-view')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['bytes'], len(response.content))
+        self.assertGreater(record['db_queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertEqual(
+            METRICS.get_value(
+                'ocelot_db_queries_total', (('view', 'leaderboard-view'),)
+            ),
+            record['db_queries'],
+        )
+
+        response = self.client.get('/metrics')
+        self.assertContains(
+            response,
+            'ocelot_http_requests_total{view="leaderboard-view",'
+            'method="GET",status="200"} 1.0',
+        )
+        self.assertContains(
+            response,
+            'ocelot_http_request_duration_seconds_count'
+            '{view="leaderboard-view"} 1',
+        )
+
+    def test_metrics_are_added_up_across_processes(self):
+        """Checks that /metrics includes metrics of other processes."""
+        METRICS.clear()
+        labels = (('view', 'leaderboard-view'),)
+        METRICS.inc('ocelot_db_queries_total', labels, 2)
+
+        # Record metrics like another uWSGI worker does
+        script = (
+            'import django; django.setup(); '
+            'from leaderboard.metrics import METRICS; '
+            'METRICS.inc("ocelot_db_queries_total", {0!r}, 3); '
+            'METRICS.observe('
+            '"ocelot_http_request_duration_seconds", {0!r}, 0.2); '
+            'METRICS.flush()'.format(labels)
+        )
+        with TemporaryDirectory() as tmp_dir, override_settings(
+            METRICS_ROOT=tmp_dir
+        ):
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE='ocelot.settings',
+                OCELOT_METRICS_ROOT=tmp_dir,
+            )
+            subprocess.run(
+                [sys.executable, '-c', script],
+                check=True,
+                cwd=BASE_DIR,
+                env=env,
+            )
+            response = self.client.get('/metrics')
+
+            # Metrics of the exited process are merged, and kept
+            self.assertEqual(
+                [
+                    x.split('-')[0]
+                    for x in os.listdir(tmp_dir)
+                    if x.endswith('.json') and '-' in x
+                ],
+                [str(os.getpid())],
+            )
+            self.assertIn(MERGED_METRICS_FILE, os.listdir(tmp_dir))
+            merged_response = self.client.get('/metrics')
+
+        for _response in (response, merged_response):
+            self.assertContains(
+                _response,
+                'ocelot_db_queries_total{view="leaderboard-view"} 5.0',
+            )
+        self.assertContains(
+            response,
+            'ocelot_http_request_duration_seconds_bucket'
+            '{view="leaderboard-view",le="0.25"} 1',
+        )
+        self.assertEqual(
+            METRICS.get_value('ocelot_db_queries_total', labels), 2
+        )
+
+    def test_metrics_are_not_served_to_other_clients(self):
+        """Checks that /metrics is only served to METRICS_ALLOWED_IPS."""
+        response = self.client.get('/metrics', REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_slow_requests_are_logged_with_top_queries(self):
+        """Checks that slow requests are logged with top queries."""
+        cache.clear()
+        comp = Competition.objects.get(name='Competition A')
+        slow_logger = 'ocelot.performance.slow'
+        with patch('leaderboard.metrics.SLOW_REQUEST_SECONDS', 0):
+            with self.assertLogs(slow_logger, 'WARNING') as logs:
+                self.client.get('/leaderboard/{0}'.format(comp.id))
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'leaderboard-view')
+        self.assertGreater(len(record['top_queries']), 0)
+        self.assertLessEqual(
+            len(record['top_queries']), SLOW_REQUEST_TOP_QUERIES
+        )
+        self.assertIn('SELECT', record['top_queries'][0]['sql'])
+
+    def test_download_submission_files_streams_zip(self):
+        """Checks that submission files are streamed as a zip file."""
+        comp = Competition.objects.get(name='Competition A')
+        queryset = Submission.objects.filter(test_set__competition=comp)
+
+        response = download_submission_files(None, None, queryset)
+        self.assertTrue(response.streaming)
+        self.assertIn('submissions.zip', response['Content-Disposition'])
+
+        archive = ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), queryset.count())
+        for submission in queryset:
+            with open(submission.hyp_file.name, 'rb') as hyp_file:
+                self.assertIn(
+                    hyp_file.read(),
+                    [archive.read(name) for name in archive.namelist()],
+                )
+
+    def test_export_job_builds_zip_file(self):
+        """Checks that queued export jobs are written to zip files."""
+        comp = Competition.objects.get(name='Competition A')
+        submissions = Submission.objects.filter(test_set__competition=comp)
+        teams = Team.objects.filter(
+            id__in=submissions.values('submitted_by')
+        )
+
+        job = enqueue_export(
+            'Competition A', submissions=submissions, teams=teams
+        )
+        self.assertEqual(
+            job.submission_ids,
+            sorted(submissions.values_list('id', flat=True)),
+        )
+        self.assertEqual(export_next_job(), job)
+        self.assertIsNone(export_next_job())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EXPORT_DONE)
+        self.assertEqual(job.total_files, submissions.count() + 1)
+        self.assertEqual(job.processed_files, job.total_files)
+
+        with job.archive.open('rb') as archive_file:
+            archive = ZipFile(BytesIO(archive_file.read()))
+        self.assertIn('teams.json', archive.namelist())
+        self.assertEqual(len(archive.namelist()), job.total_files)
+
+        job.date_created = timezone.now() - timedelta(days=30)
+        job.save()
+        archive_path = job.archive.path
+        self.assertEqual(purge_old_exports(retention_days=7), 1)
+        self.assertFalse(ExportJob.objects.exists())
+        self.assertFalse(os.path.exists(archive_path))
+
+    def test_admin_changelists_use_constant_number_of_queries(self):
+        """Checks that team and submission admin columns add no queries."""
+        admin_user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        self.client.force_login(admin_user)
+
+        counts = {}
+        for url in (
+            '/admin/leaderboard/team/',
+            '/admin/leaderboard/submission/',
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            counts[url] = len(queries)
+
+        team_a = Team.objects.get(name='Team A')
+        submissions = Submission.objects.filter(submitted_by=team_a)
+        for idx in range(3):
+            team = Team.objects.create(
+                name='Team {0}'.format(idx),
+                email='team{0}@example.com'.format(idx),
+            )
+            for submission in submissions:
+                submission.pk = None
+                submission.submitted_by = team
+                submission.save()
+
+        for url, num_queries in counts.items():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(len(queries), num_queries)
+
+        response = self.client.get('/admin/leaderboard/team/', {'o': '-5'})
+        team = response.context['cl'].result_list[0]
+        self.assertEqual(
+            team.submission_count,
+            Submission.objects.filter(submitted_by=team).count(),
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plans')
+class QueryPlanTests(TestCase):
+    """Tests that hot submission queries use the composite indexes."""
+
+    def _explain(self, queryset):
+        """Returns SQLite EXPLAIN QUERY PLAN output for queryset."""
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(x[-1] for x in cursor.fetchall())
+
+    def _assert_uses_index(self, queryset, index_name, sorts=0):
+        """Checks EXPLAIN output for index_name and sorting steps."""
+        plan = self._explain(queryset)
+        self.assertIn('USING INDEX {0}'.format(index_name), plan)
+        self.assertEqual(plan.count('TEMP B-TREE'), sorts, plan)
+
+    def test_leaderboard_ranking_uses_partial_index(self):
+        """Checks the ranking query of refresh_leaderboards().
+
+        The window is ordered by a CASE on the joined test set, which no
+        index can provide, so each test set's valid submissions are still
+        sorted once.
+        """
+        queryset = get_ranked_submissions([1, 2])
+        self._assert_uses_index(
+            queryset, 'submission_ranking_idx', sorts=1
+        )
+
+    def test_teampage_submissions_use_team_index(self):
+        """Checks the query of teampage().
+
+        Submissions are ordered by test set name and language codes, so
+        the submissions of the team are still sorted once.
+        """
+        queryset = get_teampage_submissions('TOKEN')
+        self._assert_uses_index(queryset, 'submission_team_idx', sorts=1)
+
+    def test_team_submissions_use_team_index(self):
+        """Checks queries of submit() and _get_submission_upload_path()."""
+        queryset = Submission.objects.filter(
+            submitted_by=1, test_set=1, is_valid=True
+        )
+        self._assert_uses_index(queryset, 'submission_team_idx')
+
+    def test_scoring_queue_uses_partial_index(self):
+        """Checks the query of score_next_submission()."""
+        queryset = Submission.objects.filter(
+            score_status=SCORE_QUEUED
+        ).order_by('id')
+        self._assert_uses_index(queryset, 'submission_queued_idx')
+
+
+class BenchmarkTests(TestCase):
+    """Tests that the benchmark suite runs on a small synthetic dataset."""
+
+    def test_run_benchmarks(self):
+        """Checks that every benchmark reports times and page queries."""
+        with TemporaryDirectory() as tmp_dir:
+            dataset = create_dataset(
+                tmp_dir, docs=2, segments=3, teams=2, submissions=2
+            )
+            self.assertTrue(
+                all(x.score_chrf is not None for x in dataset.submissions)
+            )
+            results = run_benchmarks(dataset, repeat=1)
+
+        self.assertEqual(
+            [x.name for x in results], [x[0] for x in BENCHMARKS]
+        )
+        for result in results:
+            self.assertGreater(result.median_time, 0)
+            if result.name in ('leaderboard', 'teampage', 'submission'):
+                self.assertGreater(result.queries, 0)
+
+
+class SerialLiveServerThread(LiveServerThread):
+    """Live server handling one request at a time.
+
+    Threads of the default server share the in-memory SQLite connection
+    of the tests, so concurrent requests may break its transactions.
+    """
+
+    def _create_server(self, connections_override=None):
+        return WSGIServer(
+            (self.host, self.port),
+            QuietWSGIRequestHandler,
+            allow_reuse_address=False,
+        )
+
+
+class LoadTestTests(LiveServerTestCase):
+    """Tests the load generator against a live server."""
+
+    server_thread_class = SerialLiveServerThread
+
+    def test_percentile(self):
+        """Checks nearest-rank percentiles."""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_run_load(self):
+        """Checks that all scenarios run without errors."""
+        with TemporaryDirectory() as tmp_dir:
+            manifest = setup(
+                tmp_dir, docs=2, segments=3, teams=2, submissions=2
+            )
+            stats = asyncio.run(
+                run_load(
+                    self.live_server_url,
+                    manifest,
+                    users=2,
+                    duration=None,
+                    iterations=8,
+                    think_time=0,
+                )
+            )
+
+        self.assertEqual(dict(stats.errors), {})
+        self.assertEqual(len(stats.latencies['POST /sign-in']), 2)
+        self.assertIn('POST /submit', stats.latencies)
+        self.assertIn('POST /teampage', stats.latencies)
+        self.assertIn('GET /submission/<id>/<id>', stats.latencies)
+        self.assertEqual(
+            Submission.objects.count(),
+            4 + len(stats.latencies['POST /submit']),
+        )
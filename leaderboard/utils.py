@@ -1,54 +1,281 @@
 """
 Project OCELoT: Open, Competitive Evaluation Leaderboard of Translations
 """
-import os.path
+import gzip
+import hashlib
+import io
+import os
+import pickle
 import re
+import time
+from array import array
+from collections import namedtuple
+from collections.abc import Sequence
+from functools import lru_cache
+from tempfile import NamedTemporaryFile
+from tempfile import TemporaryFile
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Tuple
+from zipfile import ZIP_DEFLATED
+from zipfile import ZIP_STORED
+from zipfile import ZipFile
+from zipfile import ZipInfo
 
 import lxml.etree as ET
+from sacrebleu import __version__ as SACREBLEU_VERSION  # type: ignore
+from sacrebleu import corpus_bleu  # type: ignore
+from sacrebleu import corpus_chrf  # type: ignore
+from sacrebleu.metrics import BLEU  # type: ignore
+from sacrebleu.metrics import CHRF  # type: ignore
 from sacrebleu.utils import smart_open
 
 
 MISSING_TRANSLATION_MESSAGE = "NO TRANSLATION AVAILABLE"
 
 
+XMLFileInfo = namedtuple(
+    'XMLFileInfo',
+    ['collections', 'src_langs', 'ref_langs', 'translators', 'systems'],
+)
+
+# Fields which can be extracted from XML files and the elements holding them
+XML_SOURCE = 'src'
+XML_REFERENCE = 'ref'
+XML_SYSTEM = 'hyp'
+
+
+def _new_xml_file_info():
+    """Returns XMLFileInfo with empty sets."""
+    return XMLFileInfo(set(), set(), set(), set(), set())
+
+
+def _update_xml_file_info(info, elem):
+    """Adds collection, language, translator or system of elem to info."""
+    if elem.tag == 'collection':
+        info.collections.add(elem.get('id'))
+
+    elif elem.tag == XML_SOURCE:
+        info.src_langs.add(elem.get('lang'))
+
+    elif elem.tag == XML_REFERENCE:
+        info.ref_langs.add(elem.get('lang'))
+        translator = elem.get('translator')
+        if translator:
+            info.translators.add(translator)
+
+    elif elem.tag == XML_SYSTEM:
+        # hyp_langs.add(hyp_doc.get("lang"))  # Not used in the XML format?
+        system = elem.get('system')
+        if system:
+            info.systems.add(system)
+
+
+def analyze_xml_tree(tree):
+    """
+    Return all collection names, source languages, reference languages,
+    translators, and systems found in an already parsed XML tree.
+    """
+    info = _new_xml_file_info()
+    for elem in tree.getroot().iter('collection', 'src', 'ref', 'hyp'):
+        _update_xml_file_info(info, elem)
+    return info
+
+
+def _iterparse_xml_docs(xml_path, info):
+    """
+    Yields (collection element, doc element) pairs in a single streaming
+    pass over the XML file. Collections, languages, translators and
+    systems are added to info as they are found. Elements are cleared once
+    consumed, so memory use does not grow with the size of the file.
+    """
+    collection = None
+    events = ET.iterparse(
+        xml_path,
+        events=('start', 'end'),
+        tag=('collection', 'doc', 'src', 'ref', 'hyp'),
+    )
+    for event, elem in events:
+        if event == 'start':
+            if elem.tag == 'collection':
+                collection = elem
+                _update_xml_file_info(info, elem)
+            continue
+
+        if elem.tag in (XML_SOURCE, XML_REFERENCE, XML_SYSTEM):
+            _update_xml_file_info(info, elem)
+            continue
+
+        if elem.tag == 'doc':
+            yield collection, elem
+
+        elif elem.tag == 'collection':
+            collection = None
+
+        # Free the consumed element and its already processed siblings
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
 def analyze_xml_file(xml_path):
     """
     Return all collection names, source languages, reference languages,
     translators, and systems found in the XML file. Code extracted from
     https://github.com/wmt-conference/wmt-format-tools/blob/main/wmtformat/unwrap.py
     """
-    collections, src_langs, ref_langs, translators, systems = (
-        set(),
-        set(),
-        set(),
-        set(),
-        set(),
+    info = _new_xml_file_info()
+    for _ in _iterparse_xml_docs(xml_path, info):
+        pass
+    return info
+
+
+@lru_cache(maxsize=256)
+def _file_sha256(file_path, file_size, file_mtime):
+    """Computes SHA-256 for a file; size and mtime invalidate the cache."""
+    del file_size, file_mtime  # only used as cache keys
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(file_path):
+    """Returns hex SHA-256 digest of the file contents."""
+    stat = os.stat(file_path)
+    return _file_sha256(str(file_path), stat.st_size, stat.st_mtime_ns)
+
+
+def get_reference_stats_path(stats_root, test_set_id, tokenize, ref_path):
+    """
+    Returns the path of precomputed reference statistics. The path is keyed
+    by test set, tokenizer and the reference file hash. The sacreBLEU version
+    is part of the key, too, as the statistics are pickled sacreBLEU objects.
+    """
+    return os.path.join(
+        stats_root,
+        'testset-{0}'.format(test_set_id),
+        '{0}.{1}.sacrebleu-{2}.pkl.gz'.format(
+            tokenize, file_sha256(ref_path), SACREBLEU_VERSION
+        ),
     )
-    tree = ET.parse(xml_path)
 
-    for collection in tree.getroot().findall(".//collection"):
-        collections.add(collection.get("id"))
 
-    for src_doc in tree.getroot().findall(".//src"):
-        src_langs.add(src_doc.get("lang"))
+def cache_reference_stats(ref_text_path, tokenize, stats_path):
+    """
+    Precomputes reference n-gram statistics for BLEU and character n-gram
+    statistics for chrF, and stores them in a compressed cache file. Does
+    nothing if the cache file already exists.
+    """
+    if os.path.exists(stats_path):
+        return
 
-    for ref_doc in tree.getroot().findall(".//ref"):
-        ref_langs.add(ref_doc.get("lang"))
-        translator = ref_doc.get("translator")
-        if translator:
-            translators.add(translator)
+    with open(ref_text_path, encoding='utf-8') as ref_file:
+        ref_stream = [r for r in ref_file]
+
+    # These match the defaults of corpus_bleu() and corpus_chrf()
+    bleu = BLEU(tokenize=tokenize, references=[ref_stream])
+    chrf = CHRF(references=[ref_stream])
+
+    # Write to a temporary file first so readers never see partial files
+    os.makedirs(os.path.dirname(stats_path), exist_ok=True)
+    with NamedTemporaryFile(
+        dir=os.path.dirname(stats_path), delete=False
+    ) as tmp_file:
+        with gzip.GzipFile(fileobj=tmp_file, mode='wb') as gzip_file:
+            pickle.dump(
+                (bleu, chrf), gzip_file, protocol=pickle.HIGHEST_PROTOCOL
+            )
+    os.replace(tmp_file.name, stats_path)
+
+
+@lru_cache(maxsize=32)
+def load_reference_stats(stats_path):
+    """Returns (BLEU, CHRF) metrics with cached reference statistics."""
+    with gzip.open(stats_path, 'rb') as gzip_file:
+        return pickle.load(gzip_file)
+
+
+def compute_scores(
+    hyp_text_path, ref_text_path, tokenize='13a', ref_stats_path=None
+):
+    """
+    Computes BLEU and chrF scores for the given hypothesis and reference text
+    files. This does not touch the database, so it is safe to call it from
+    worker processes.
+
+    If precomputed reference statistics exist at ref_stats_path, only the
+    hypothesis side is processed.
+    """
+    with open(hyp_text_path, encoding='utf-8') as hyp_file:
+        hyp_stream = [x for x in hyp_file]
+
+    if ref_stats_path and os.path.exists(ref_stats_path):
+        bleu_metric, chrf_metric = load_reference_stats(ref_stats_path)
+        bleu = bleu_metric.corpus_score(hyp_stream, None)
+        chrf = chrf_metric.corpus_score(hyp_stream, None)
+        return bleu.score, chrf.score
+
+    with open(ref_text_path, encoding='utf-8') as ref_file:
+        ref_stream = [r for r in ref_file]
+
+    bleu = corpus_bleu(hyp_stream, [ref_stream], tokenize=tokenize)
+    chrf = corpus_chrf(hyp_stream, [ref_stream])
+    return bleu.score, chrf.score
 
-    for hyp_doc in tree.getroot().findall(".//hyp"):
-        # hyp_langs.add(hyp_doc.get("lang"))  # Not used in the XML format?
-        system = hyp_doc.get("system")
-        if system:
-            systems.add(system)
 
-    return collections, src_langs, ref_langs, translators, systems
+# Segments in SGML and IWSLT XML files; segments may span multiple lines
+# and there may be any number of segments per line. Self-closing <seg/>
+# tags are empty segments. The text pattern is unrolled, which is several
+# times faster than a lazy (.*?) match
+SEG_PATTERN = re.compile(
+    r'<seg(?:\s[^>]*)?'
+    r'(?:(?<=/)>|(?<!/)>([^<]*(?:<(?!/seg>)[^<]*)*)</seg>)'
+)
 
+# Raw files are read in chunks of this many characters
+TEXT_CHUNK_SIZE = 1024 * 1024
 
-# Taken from sacrebleu which removed this with v2.2
+
+def _iter_seg_chunks(fin):
+    """Yields lists of cleaned segment texts found in fin, chunk by chunk."""
+    pending = ''
+    while True:
+        chunk = fin.read(TEXT_CHUNK_SIZE)
+        text = pending + chunk
+
+        # Complete segments end at the last closing tag in this chunk, and
+        # anywhere in the rest of the file
+        if chunk:
+            end = text.rfind('</seg>')
+            end = 0 if end == -1 else end + len('</seg>')
+        else:
+            end = len(text)
+        if end:
+            segments = SEG_PATTERN.findall(text, 0, end)
+            # Same as re.sub(r'\s+', ' ', s.strip()), but faster
+            yield [' '.join(x.split()) for x in segments]
+        if not chunk:
+            return
+
+        # Keep an incomplete segment, or a partial '<seg', for the next chunk
+        start = text.find('<seg', end)
+        if start == -1:
+            start = max(end, len(text) - len('<seg'))
+        pending = text[start:]
+
+
+def _write_lines(fout, lines):
+    """Writes lines to fout in one call, each followed by a newline."""
+    if lines:
+        fout.write('\n'.join(lines))
+        fout.write('\n')
+
+
+# Adapted from sacrebleu which removed this with v2.2
 #
 # https://github.com/mjpost/sacrebleu/blob/65a8a9eeccd8c0c7875e875e12edf10db33ab0ba/sacrebleu/utils.py#L277
 def process_to_text(rawfile, txtfile, field: Optional[int] = None):
@@ -58,59 +285,176 @@ def process_to_text(rawfile, txtfile, field: Optional[int] = None):
     :param txtfile: the plaintext file
     :param field: For TSV files, which field to extract.
     """
+    if os.path.exists(txtfile) and os.path.getsize(txtfile) > 0:
+        return
+
+    with smart_open(rawfile) as fin, smart_open(txtfile, 'wt') as fout:
+        # SGML and IWSLT XML
+        if rawfile.endswith(('.sgm', '.sgml', '.xml')):
+            for segments in _iter_seg_chunks(fin):
+                _write_lines(fout, segments)
 
-    def _clean(s):
-        """
-        Removes trailing and leading spaces and collapses multiple consecutive internal spaces to a single one.
-        :param s: The string.
-        :return: A cleaned-up string.
-        """
-        return re.sub(r'\s+', ' ', s.strip())
-
-    if not os.path.exists(txtfile) or os.path.getsize(txtfile) == 0:
-        if rawfile.endswith('.sgm') or rawfile.endswith('.sgml'):
-            with smart_open(rawfile) as fin, smart_open(
-                txtfile, 'wt'
-            ) as fout:
-                for line in fin:
-                    if line.startswith('<seg '):
-                        print(
-                            _clean(
-                                re.sub(
-                                    r'<seg.*?>(.*)</seg>.*?', '\\1', line
-                                )
-                            ),
-                            file=fout,
-                        )
-        # IWSLT
-        elif rawfile.endswith('.xml'):
-            with smart_open(rawfile) as fin, smart_open(
-                txtfile, 'wt'
-            ) as fout:
-                for line in fin:
-                    if line.startswith('<seg '):
-                        print(
-                            _clean(
-                                re.sub(
-                                    r'<seg.*?>(.*)</seg>.*?', '\\1', line
-                                )
-                            ),
-                            file=fout,
-                        )
         # MTNT
         elif rawfile.endswith('.tsv'):
-            with smart_open(rawfile) as fin, smart_open(
-                txtfile, 'wt'
-            ) as fout:
-                for line in fin:
-                    print(line.rstrip().split('\t')[field], file=fout)
+            for lines in iter(lambda: fin.readlines(TEXT_CHUNK_SIZE), []):
+                _write_lines(
+                    fout, [x.rstrip().split('\t')[field] for x in lines]
+                )
+
         # PLAIN TEXT
         else:
-            with smart_open(rawfile) as fin, smart_open(
-                txtfile, 'wt'
-            ) as fout:
-                for line in fin:
-                    print(line.rstrip(), file=fout)
+            for lines in iter(lambda: fin.readlines(TEXT_CHUNK_SIZE), []):
+                _write_lines(fout, [x.rstrip() for x in lines])
+
+
+def _get_segments(elem, path='.//seg'):
+    """Returns segments below elem as {segment ID: text} dictionary."""
+    if elem is None:
+        return {}
+    return {int(seg.get('id')): seg.text for seg in elem.iterfind(path)}
+
+
+def _stream_xml_to_text(
+    xml_path, txt_path, field, name=None, collection=None
+):
+    """
+    Extracts source, reference or system texts from the XML file in a single
+    streaming pass, while collecting collections, languages, translators and
+    systems. Segments from test suites are ignored.
+
+    For references and systems, name selects the translator or system. If
+    name is None, the first translator or system in sorted order is used;
+    texts for other candidates are kept in memory until the choice is known
+    at the end of the file, but only the first candidate found is streamed
+    to the text file directly.
+
+    Returns a (XMLFileInfo, collection found, selected name) tuple. The text
+    file is written atomically; it is not created if name is None and no
+    translator or system has been found.
+    """
+    info = _new_xml_file_info()
+    attribute = 'translator' if field == XML_REFERENCE else 'system'
+
+    selected_collection = None
+    streamed = name
+    buffers = {}  # type: Dict[str, List[str]]
+    lines_written = 0
+
+    txt_dir = os.path.dirname(os.path.abspath(txt_path))
+    txt_file = NamedTemporaryFile(
+        'w', dir=txt_dir, encoding='utf-8', delete=False
+    )
+    try:
+        with txt_file:
+            for doc_collection, doc in _iterparse_xml_docs(xml_path, info):
+                candidates = {}
+                if field != XML_SOURCE:
+                    candidates = {
+                        elem.get(attribute): elem
+                        for elem in doc.iterfind('.//' + field)
+                    }
+
+                # Register new candidates; all previous lines are missing for them
+                for candidate in sorted(x for x in candidates if x):
+                    if name is not None or candidate == streamed:
+                        continue
+                    if streamed is None:
+                        streamed = candidate
+                        txt_file.write(
+                            '{}\n'.format(MISSING_TRANSLATION_MESSAGE)
+                            * lines_written
+                        )
+                    elif candidate not in buffers:
+                        buffers[candidate] = [
+                            MISSING_TRANSLATION_MESSAGE
+                        ] * lines_written
+
+                # Restrict to the first collection with the given ID if requested
+                if collection:
+                    if (
+                        selected_collection is None
+                        and doc_collection is not None
+                        and doc_collection.get('id') == collection
+                    ):
+                        selected_collection = doc_collection
+                    if doc_collection is not selected_collection:
+                        continue
+
+                if 'testsuite' in doc.attrib:  # Skip testsuites
+                    continue
+
+                src_sents = _get_segments(doc, './/src//seg')
+                seg_ids = sorted(src_sents.keys())
+
+                if field == XML_SOURCE:
+                    for seg_id in seg_ids:
+                        txt_file.write('{}\n'.format(src_sents[seg_id]))
+                    lines_written += len(seg_ids)
+                    continue
+
+                if streamed is not None:
+                    sents = _get_segments(candidates.get(streamed))
+                    for seg_id in seg_ids:
+                        txt_file.write(
+                            '{}\n'.format(
+                                sents.get(
+                                    seg_id, MISSING_TRANSLATION_MESSAGE
+                                )
+                            )
+                        )
+
+                for candidate, buffer in buffers.items():
+                    sents = _get_segments(candidates.get(candidate))
+                    buffer.extend(
+                        sents.get(seg_id, MISSING_TRANSLATION_MESSAGE)
+                        for seg_id in seg_ids
+                    )
+
+                lines_written += len(seg_ids)
+    except BaseException:
+        os.unlink(txt_file.name)
+        raise
+
+    collection_found = not collection or selected_collection is not None
+
+    selected = name
+    if field != XML_SOURCE and name is None:
+        names = (
+            info.translators if field == XML_REFERENCE else info.systems
+        )
+        selected = sorted(names)[0] if names else None
+
+    if field != XML_SOURCE and selected is None:
+        os.unlink(txt_file.name)
+        return info, collection_found, selected
+
+    if field != XML_SOURCE and selected != streamed:
+        with open(txt_file.name, 'w', encoding='utf-8') as buffer_file:
+            buffer_file.writelines(
+                '{}\n'.format(sent) for sent in buffers[selected]
+            )
+
+    if not collection_found:
+        # Create an empty text file as this case is catched later
+        open(txt_file.name, 'w', encoding='utf-8').close()
+
+    os.replace(txt_file.name, txt_path)
+    return info, collection_found, selected
+
+
+def extract_xml_text(xml_path, txt_path, field, collection=None):
+    """
+    Extracts source (field='src'), first reference (field='ref') or system
+    (field='hyp') texts from the XML file and collects collections,
+    languages, translators and systems, all in a single streaming pass.
+    References and systems are selected by sorted translator or system name.
+
+    Returns XMLFileInfo for the XML file.
+    """
+    info, _, _ = _stream_xml_to_text(
+        xml_path, txt_path, field, collection=collection
+    )
+    return info
 
 
 def process_xml_to_text(
@@ -132,69 +476,502 @@ def process_xml_to_text(
             'Exactly one of source, reference or system must be provided'
         )
 
-    tree = ET.parse(xml_path)
-    src_sents, ref_sents = [], []
-    out_sents = []
+    field, name = XML_SOURCE, None
+    if reference:
+        field, name = XML_REFERENCE, reference
+    elif system:
+        field, name = XML_SYSTEM, system
 
-    root = tree.getroot()
-    if collection:  # Restrict to the given collection if requested
-        root = root.find(f".//collection[@id='{collection}']")
-        if root is None:
-            # Create an empty hypothesis file as this case is catched later
-            with open(txt_path, 'w') as txt_file:
-                pass
-            return False
+    # An explicit name is always streamed, even if it is not in the file
+    _, collection_found, _ = _stream_xml_to_text(
+        xml_path, txt_path, field, name=name, collection=collection
+    )
+    return collection_found
 
-    for doc in root.findall(".//doc"):
-        if 'testsuite' in doc.attrib:  # Skip testsuites
-            continue
 
-        src_sents = {
-            int(seg.get("id")): seg.text
-            for seg in doc.findall(".//src//seg")
-        }
-
-        if reference:
-            ref_docs = doc.findall(".//ref")
-            trans_to_ref = {ref.get("translator"): ref for ref in ref_docs}
-            ref_doc = trans_to_ref.get(reference, None)
-            ref_sents = (
-                {
-                    int(seg.get("id")): seg.text
-                    for seg in ref_doc.findall(".//seg")
-                }
-                if ref_doc is not None
-                else {}
-            )
+# SGML docs are elements whose tag name contains 'doc' in any case
+SGML_DOC_TAG = re.compile('doc', re.IGNORECASE)
 
-        if system:
-            hyp_docs = doc.findall(".//hyp")
-            sys_to_hyp = {hyp.get("system"): hyp for hyp in hyp_docs}
-            hyp_doc = sys_to_hyp.get(system, None)
-            hyp_sents = (
-                {
-                    int(seg.get("id")): seg.text
-                    for seg in hyp_doc.findall(".//seg")
-                }
-                if hyp_doc is not None
-                else {}
+# SGML files are fed to the parser in chunks of this many characters
+SGML_CHUNK_SIZE = 64 * 1024
+
+# Whitespace-only strings are collapsed to a single newline or space
+_SGML_SPACES = ' \n\t\x0c\r'
+
+
+def _feed_sgml_file(sgml_path, target, encoding='utf-8'):
+    """Parses the SGML file in chunks and returns target.close()."""
+    parser = ET.XMLParser(target=target, recover=True)
+    with open(sgml_path, encoding=encoding) as sgml_file:
+        chunk = sgml_file.read(SGML_CHUNK_SIZE)
+        if chunk.startswith('\ufeff'):  # Skip byte order mark
+            chunk = chunk[1:]
+        parser.feed(chunk)
+        while chunk:
+            chunk = sgml_file.read(SGML_CHUNK_SIZE)
+            if chunk:
+                parser.feed(chunk)
+    return parser.close()
+
+
+class _SGMLDocidsTarget:
+    """lxml parser target which collects docids of SGML docs."""
+
+    def __init__(self):
+        self.docids = []
+
+    def start(self, tag, attrib):
+        if SGML_DOC_TAG.search(tag):
+            self.docids.append(attrib.get('docid'))
+
+    def close(self):
+        return self.docids
+
+
+def get_sgml_docids(sgml_path, encoding='utf-8'):
+    """Returns docids of all docs in the SGML file, in document order."""
+    return _feed_sgml_file(sgml_path, _SGMLDocidsTarget(), encoding)
+
+
+def _collapse_sgml_spaces(text):
+    """Collapses whitespace-only text to a single newline or space."""
+    if text.strip(_SGML_SPACES):
+        return None
+    return '\n' if '\n' in text else ' '
+
+
+def _escape_sgml_text(text):
+    """Replaces &, < and > with entities."""
+    return (
+        text.replace('&', '&amp;')
+        .replace('<', '&lt;')
+        .replace('>', '&gt;')
+    )
+
+
+def _quote_sgml_attribute(value):
+    """Escapes and quotes an attribute value."""
+    value = _escape_sgml_text(value)
+    if '"' not in value:
+        return '"' + value + '"'
+    if "'" not in value:
+        return "'" + value + "'"
+    return '"' + value.replace('"', '&quot;') + '"'
+
+
+def _format_sgml_attributes(attrib):
+    """Returns attributes sorted by name, each prefixed with a space."""
+    return ''.join(
+        ' {0}={1}'.format(key, _quote_sgml_attribute(value))
+        for key, value in sorted(attrib.items())
+    )
+
+
+class _SGMLFilterTarget:
+    """
+    lxml parser target which writes the SGML file without docs, and then
+    appends docs with valid docids at the end of the first <tstset>, in the
+    order of docids. Output is written incrementally, while kept docs are
+    spooled to a temporary file and indexed by docid. Serialization matches
+    BeautifulSoup's lxml-xml output: attributes are sorted, empty
+    elements are self-closing and whitespace-only text is collapsed.
+    """
+
+    def __init__(self, out_file, docids):
+        # If a docid is repeated, its last position wins
+        self.order = {docid: i for i, docid in enumerate(docids)}
+        self.out_file = out_file
+        self.output = []  # Main output, written out while in <tstset>
+        self.tail = None  # Main output after </tstset>, if closed
+        self.text = []
+        self.stack = []  # [tag, output list or None, has content, docid]
+        self.tstset = None
+        self.spool = TemporaryFile()
+        self.index = {}  # type: Dict[str, Tuple[int, int]]
+
+    def _get_output(self, entry):
+        """Returns output list of the element, main output for None."""
+        if entry is None or entry[1] is None:
+            return self.output if self.tail is None else self.tail
+        return entry[1]
+
+    def _open_parent(self):
+        """Closes start tag of the current element and returns its output."""
+        entry = self.stack[-1] if self.stack else None
+        output = self._get_output(entry)
+        if entry is not None and not entry[2]:
+            output.append('>')
+            entry[2] = True
+        return output
+
+    def _write(self, text):
+        """Appends text to the current element."""
+        self._open_parent().append(text)
+
+    def _flush_data(self):
+        """Writes text collected since the last tag."""
+        if not self.text:
+            return
+        text = ''.join(self.text)
+        self.text = []
+        self._write(_collapse_sgml_spaces(text) or _escape_sgml_text(text))
+
+    def start(self, tag, attrib):
+        self._flush_data()
+        start_tag = '<' + tag + _format_sgml_attributes(attrib)
+
+        if SGML_DOC_TAG.search(tag):
+            # Docs are moved out of their parents into their own output
+            docid = attrib.get('docid', '').lower()
+            self.stack.append([tag, [start_tag], False, docid])
+            return
+
+        self._open_parent().append(start_tag)
+        entry = [
+            tag,
+            self.stack[-1][1] if self.stack else None,
+            False,
+            None,
+        ]
+        if tag == 'tstset' and self.tstset is None and entry[1] is None:
+            self.tstset = entry
+        self.stack.append(entry)
+
+    def end(self, tag):
+        self._flush_data()
+        entry = self.stack.pop()
+        if entry is self.tstset:
+            # Close <tstset> once all docs are known; the rest of the main
+            # output is kept in memory until then
+            self._flush_output()
+            self.tail = []
+            return
+
+        output = self._get_output(entry)
+        output.append('</' + tag + '>' if entry[2] else '/>')
+
+        docid = entry[3]
+        if docid is not None:
+            if docid in self.order:
+                doc = ''.join(output).encode('utf-8')
+                self.index[docid] = (self.spool.tell(), len(doc))
+                self.spool.write(doc)
+        elif output is self.output and len(output) > 1024:
+            self._flush_output()
+
+    def comment(self, text):
+        self._flush_data()
+        self._write('<!--' + (_collapse_sgml_spaces(text) or text) + '-->')
+
+    def pi(self, target, data):
+        self._flush_data()
+        self._write('<?' + target + ' ' + data + '?>')
+
+    def doctype(self, name, pubid, system):
+        self._flush_data()
+        value = name or ''
+        if pubid is not None:
+            value += ' PUBLIC "%s"' % pubid
+            if system is not None:
+                value += ' "%s"' % system
+        elif system is not None:
+            value += ' SYSTEM "%s"' % system
+        self._write('<!DOCTYPE ' + value + '>\n')
+
+    def data(self, data):
+        self.text.append(data)
+
+    def _flush_output(self):
+        """Writes out the main output collected so far."""
+        self.out_file.write(''.join(self.output))
+        self.output = []
+
+    def close(self):
+        # Elements left open in a truncated file are closed
+        while self.stack:
+            self.end(self.stack[-1][0])
+        self._flush_output()
+        if self.tstset is None:  # Docs are dropped without a <tstset>
+            return
+
+        docids = sorted(self.index, key=self.order.get)
+        if docids and not self.tstset[2]:
+            self.out_file.write('>')
+        for docid in docids:
+            offset, length = self.index[docid]
+            self.spool.seek(offset)
+            self.out_file.write(self.spool.read(length).decode('utf-8'))
+        self.out_file.write(
+            '</tstset>' if docids or self.tstset[2] else '/>'
+        )
+        self.out_file.write(''.join(self.tail))
+
+
+def filter_sgml_docs(sgml_path, docids, filtered_path, encoding='utf-8'):
+    """
+    Writes the SGML file to filtered_path, keeping only docs with docids
+    (compared case-insensitively) in the order of docids.
+    """
+    docids = [x.lower() for x in docids]
+    with open(filtered_path, 'w', encoding=encoding) as out_file:
+        target = _SGMLFilterTarget(out_file, docids)
+        try:
+            _feed_sgml_file(sgml_path, target, encoding)
+        finally:
+            target.spool.close()
+    return filtered_path
+
+
+# Line-offset indexes are stored next to text files with this suffix
+LINE_INDEX_SUFFIX = '.idx'
+
+# Offsets are stored as native unsigned 64-bit integers
+_LINE_INDEX_TYPECODE = 'Q'
+
+# Line breaks recognized by files opened in text mode
+_LINE_BREAK_PATTERN = re.compile(rb'\r\n?|\n')
+
+
+def get_line_index_path(txt_path):
+    """Returns path to the line-offset index of the text file."""
+    return txt_path + LINE_INDEX_SUFFIX
+
+
+def build_line_index(txt_path):
+    """
+    Builds a line-offset index for the text file. The index stores the
+    byte offset of each line followed by the size of the file, so that any
+    range of lines can be read with a single seek(). Lines end with \n,
+    \r\n or a lone \r, as in text mode. The index is written atomically
+    next to the text file.
+
+    Returns path to the index file.
+    """
+    offsets = array(_LINE_INDEX_TYPECODE, [0])
+    with open(txt_path, 'rb') as txt_file:
+        position = 0
+        for chunk in iter(lambda: txt_file.read(TEXT_CHUNK_SIZE), b''):
+            # Do not split \r\n between chunks
+            while chunk.endswith(b'\r'):
+                next_byte = txt_file.read(1)
+                if not next_byte:
+                    break
+                chunk += next_byte
+
+            offsets.extend(
+                position + x.end()
+                for x in _LINE_BREAK_PATTERN.finditer(chunk)
             )
+            position += len(chunk)
 
-        for seg_id in sorted(src_sents.keys()):
-            if source:
-                out_sents.append(src_sents[seg_id])
-            elif reference:
-                ref_sent = ref_sents.get(
-                    seg_id, MISSING_TRANSLATION_MESSAGE
-                )
-                out_sents.append(ref_sent)
-            elif system:
-                hyp_sent = hyp_sents.get(
-                    seg_id, MISSING_TRANSLATION_MESSAGE
+        if position > offsets[-1]:  # The last line has no line break
+            offsets.append(position)
+
+    idx_path = get_line_index_path(txt_path)
+    with NamedTemporaryFile(
+        dir=os.path.dirname(os.path.abspath(idx_path)), delete=False
+    ) as tmp_file:
+        offsets.tofile(tmp_file)
+    os.replace(tmp_file.name, idx_path)
+    return idx_path
+
+
+def _read_line_offsets(idx_file, *positions):
+    """Returns offsets stored at the given positions of the index file."""
+    offsets = array(_LINE_INDEX_TYPECODE)
+    for position in positions:
+        idx_file.seek(position * offsets.itemsize)
+        offsets.frombytes(idx_file.read(offsets.itemsize))
+    return offsets
+
+
+class IndexedTextFile(Sequence):
+    """
+    Read-only sequence of lines in a text file. Slicing seeks directly to
+    the requested lines using the line-offset index of the file, which is
+    (re)built if it is missing or outdated. Lines keep their line endings,
+    as when iterating over a file opened in text mode.
+    """
+
+    def __init__(self, txt_path):
+        self.txt_path = txt_path
+        self.idx_path = get_line_index_path(txt_path)
+
+        txt_size = os.path.getsize(txt_path)
+        if not self._is_index_valid(txt_size):
+            build_line_index(txt_path)
+
+        itemsize = array(_LINE_INDEX_TYPECODE).itemsize
+        self._length = os.path.getsize(self.idx_path) // itemsize - 1
+
+    def _is_index_valid(self, txt_size):
+        """Checks if the index exists and matches the text file."""
+        try:
+            if os.path.getmtime(self.idx_path) < os.path.getmtime(
+                self.txt_path
+            ):
+                return False
+            with open(self.idx_path, 'rb') as idx_file:
+                idx_file.seek(0, os.SEEK_END)
+                itemsize = array(_LINE_INDEX_TYPECODE).itemsize
+                last = idx_file.tell() // itemsize - 1
+                if last < 0:
+                    return False
+                (file_size,) = _read_line_offsets(idx_file, last)
+        except OSError:
+            return False
+        return file_size == txt_size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            if step != 1:
+                return [self[idx] for idx in range(start, stop, step)]
+            return self._read_lines(start, stop)
+
+        if key < 0:
+            key += self._length
+        if not 0 <= key < self._length:
+            raise IndexError('line index out of range')
+        return self._read_lines(key, key + 1)[0]
+
+    def __iter__(self):
+        with open(self.txt_path, encoding='utf-8') as txt_file:
+            yield from txt_file
+
+    def _read_lines(self, start, stop):
+        """Returns lines start..stop-1 reading only their bytes."""
+        if start >= stop:
+            return []
+
+        with open(self.idx_path, 'rb') as idx_file:
+            begin, end = _read_line_offsets(idx_file, start, stop)
+
+        with open(self.txt_path, 'rb') as txt_file:
+            txt_file.seek(begin)
+            data = txt_file.read(end - begin)
+
+        # Translate line endings like a file opened in text mode would
+        lines = (
+            data.decode('utf-8')
+            .replace('\r\n', '\n')
+            .replace('\r', '\n')
+            .split('\n')
+        )
+        result = [line + '\n' for line in lines[:-1]]
+        if lines[-1]:  # The last line of the file may have no line break
+            result.append(lines[-1])
+        return result
+
+
+class ZippedSequence(Sequence):
+    """
+    Read-only sequence of tuples of items from the given sequences, like
+    zip(). Slices are taken from each sequence separately, so it can be
+    paginated without reading whole sequences.
+    """
+
+    def __init__(self, *sequences):
+        self.sequences = sequences
+
+    def __len__(self):
+        return min(len(sequence) for sequence in self.sequences)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            return list(
+                zip(
+                    *(
+                        sequence[start:stop:step]
+                        for sequence in self.sequences
+                    )
                 )
-                out_sents.append(hyp_sent)
+            )
+        return tuple(sequence[key] for sequence in self.sequences)
+
+
+# Files with these extensions are already compressed, so they are STORED
+COMPRESSED_FILE_EXTENSIONS = (
+    '.7z',
+    '.bz2',
+    '.gz',
+    '.tgz',
+    '.xz',
+    '.zip',
+    '.zst',
+)
+
+# Size of chunks read from files added to ZIP archives
+ZIP_CHUNK_SIZE = 64 * 1024
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Unseekable file object collecting data written by ZipFile."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []  # type: List[bytes]
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
 
-    with open(txt_path, 'w') as txt_file:
-        for sent in out_sents:
-            txt_file.write("{}\n".format(sent))
-    return True
+    def pop(self):
+        """Returns and forgets all data written so far."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _write_zip_entry(zip_file, arcname, the_file):
+    """
+    Adds the_file to zip_file, reading it in chunks. Yields after each
+    chunk so that callers can flush written data. The_file can be any
+    Django File, e.g. FieldFile or ContentFile.
+    """
+    zip_info = ZipInfo(arcname, date_time=time.localtime()[:6])
+    zip_info.compress_type = ZIP_DEFLATED
+    if arcname.lower().endswith(COMPRESSED_FILE_EXTENSIONS):
+        zip_info.compress_type = ZIP_STORED
+    # Known size lets zipfile decide if ZIP64 extensions are needed
+    zip_info.file_size = the_file.size
+
+    with the_file.open('rb') as src_file:
+        with zip_file.open(zip_info, 'w') as dst_file:
+            for chunk in iter(lambda: src_file.read(ZIP_CHUNK_SIZE), b''):
+                dst_file.write(chunk)
+                yield
+
+
+def write_zip_file(zip_target, entries):
+    """
+    Writes (arcname, Django File) entries into a ZIP file given by path or
+    file object.
+    """
+    with ZipFile(zip_target, 'w', ZIP_DEFLATED) as zip_file:
+        for arcname, the_file in entries:
+            for _ in _write_zip_entry(zip_file, arcname, the_file):
+                pass
+
+
+def iter_zip_stream(entries):
+    """
+    Yields a ZIP archive of (arcname, Django File) entries as chunks of
+    bytes, while the entries are read. Memory use does not depend on the
+    number or size of the files and no temporary files are created.
+    """
+    buffer = _ZipStreamBuffer()
+    with ZipFile(buffer, 'w', ZIP_DEFLATED) as zip_file:
+        for arcname, the_file in entries:
+            for _ in _write_zip_entry(zip_file, arcname, the_file):
+                data = buffer.pop()
+                if data:
+                    yield data
+    yield buffer.pop()
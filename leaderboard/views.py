@@ -6,44 +6,42 @@ from collections import OrderedDict
 from django.contrib import messages
 from django.db.models import Count
 from django.http import Http404
+from django.http import HttpResponse
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils import timezone
 
+from leaderboard.cache import cache_anonymous_page
+from leaderboard.cache import COMPETITION_SCOPE
+from leaderboard.cache import COMPETITIONS_SCOPE
 from leaderboard.forms import PublicationDescriptionForm
 from leaderboard.forms import PublicationNameForm
 from leaderboard.forms import SigninForm
 from leaderboard.forms import SubmissionForm
 from leaderboard.forms import TeamForm
+from leaderboard.metrics import METRICS
+from leaderboard.metrics import PROMETHEUS_CONTENT_TYPE
 from leaderboard.models import Competition
+from leaderboard.models import LEADERBOARD_SIZE
+from leaderboard.models import LeaderboardEntry
 from leaderboard.models import Submission
 from leaderboard.models import Team
-from leaderboard.models import TestSet
+from leaderboard.models import update_team_submissions
 from leaderboard.models import XML_FILE
+from ocelot.settings import METRICS_ALLOWED_IPS
 
 
-MAX_SUBMISSION_DISPLAY_COUNT = 10
+MAX_SUBMISSION_DISPLAY_COUNT = LEADERBOARD_SIZE
 MAX_SUBMISSION_LIMIT = 7
 
 
 def _get_team_data(request):
-    """Returns team name for session token."""
-    ocelot_team_name = None
-    ocelot_team_email = None
-    ocelot_team_token = request.session.get('ocelot_team_token')
-    ocelot_team_verified = False
-    if ocelot_team_token:
-        the_team = Team.objects.get(token=ocelot_team_token)
-        ocelot_team_name = the_team.name
-        ocelot_team_email = the_team.email
-        ocelot_team_verified = the_team.is_verified
-    return (
-        ocelot_team_name,
-        ocelot_team_email,
-        ocelot_team_token,
-        ocelot_team_verified,
-    )
+    """Returns team name for session token.
+
+    Team data is resolved once per request by TeamMiddleware.
+    """
+    return tuple(request.ocelot_team)
 
 
 def _format_datetime_for_js(stamp):
@@ -53,6 +51,7 @@ def _format_datetime_for_js(stamp):
     return stamp.strftime("%Y-%m-%d %H:%M:%S %Z")
 
 
+@cache_anonymous_page(COMPETITION_SCOPE)
 def leaderboard(request, competition_id=None):
     """Renders leaderboard for a competition."""
 
@@ -80,47 +79,30 @@ def leaderboard(request, competition_id=None):
         'deadline': _format_datetime_for_js(competition.deadline),
     }
 
-    # Collect all test sets for the competition
+    # Top submissions of all test sets are precomputed, so a single indexed
+    # query is enough; see refresh_leaderboards()
+    entries = LeaderboardEntry.objects.filter(
+        competition=competition
+    ).order_by('test_set_name', 'test_set_id', 'rank')
+
     data = OrderedDict()
-    test_sets = TestSet.objects.filter(competition=competition).order_by(
-        'name'
-    )
+    for entry in entries:
+        key = entry.test_set_label
+        if not key in data.keys():
+            data[key] = []
+
+        data[key].append(
+            {
+                "id": entry.submission_id,
+                "name": entry.name,
+                "score_bleu": entry.score_bleu,
+                "score_chrf": entry.score_chrf,
+                "date_created": entry.date_created,
+                "team_token": entry.team_token,
+                "is_anonymous": entry.is_anonymous,
+            }
+        )
 
-    for test_set in test_sets:
-        order_flag = '-score_chrf'
-        if not test_set.compute_scores:
-            order_flag = '-id'
-
-        submissions = Submission.objects.filter(
-            test_set=test_set,
-            is_valid=True,  # Ignore invalid submissions
-            is_removed=False,  # Ignore any removed submissions
-        ).order_by(order_flag,)[:MAX_SUBMISSION_DISPLAY_COUNT]
-
-        for submission in submissions:
-            key = str(test_set)
-            if not key in data.keys():
-                data[key] = []
-
-            score_bleu = submission.score
-            score_chrf = submission.score_chrf
-            if not test_set.compute_scores:
-                score_bleu = None
-                score_chrf = None
-
-            data[key].append(
-                {
-                    "id": submission.id,
-                    "name": str(submission),
-                    "score_bleu": score_bleu,
-                    "score_chrf": score_chrf,
-                    "date_created": submission.date_created,
-                    # TODO: Double check if this foreign key reference does not
-                    # generate an extra query. Optimize otherwise.
-                    "team_token": submission.submitted_by.token,
-                    "is_anonymous": submission.is_anonymous(),
-                }
-            )
     (
         ocelot_team_name,
         ocelot_team_email,
@@ -140,6 +122,7 @@ def leaderboard(request, competition_id=None):
     return render(request, 'leaderboard/competition.html', context=context)
 
 
+@cache_anonymous_page(COMPETITIONS_SCOPE)
 def frontpage(request):
     """Renders OCELoT frontpage with a list of competitions."""
 
@@ -319,25 +302,19 @@ def submit(request):
             new_submission.submitted_by = current_team
             new_submission.save()
 
-            if new_submission.score != -1:
-                _msg = 'You have successfully submitted {0}'.format(
+            # Scores are computed in the background by the scoring worker,
+            # the team page shows the scoring status in the meantime
+            _msg = (
+                'You have successfully submitted {0}. '
+                'Scores will be shown on your team page once computed.'.format(
                     new_submission.hyp_file.name
                 )
-                messages.success(request, _msg)
+            )
+            messages.success(request, _msg)
 
-                # If is_primary has been selected and the submissions was
-                # successful, update new_submission.is_primary field.
-                if form.cleaned_data['is_primary']:
-                    new_submission.set_primary()  # This implicitly calls save()
-            else:
-                _msg = (
-                    'Unsuccessful submission of {0}. '
-                    'Please check the format of the submitted file. '
-                    'Does the submitted file have a .xml extension?'.format(
-                        new_submission.hyp_file.name
-                    )
-                )
-                messages.warning(request, _msg)
+            # If is_primary has been selected, update new_submission.is_primary
+            if form.cleaned_data['is_primary']:
+                new_submission.set_primary()
 
             return HttpResponseRedirect(reverse('teampage-view'))
         else:
@@ -358,6 +335,24 @@ def submit(request):
     return render(request, 'leaderboard/submission.html', context=context)
 
 
+def get_teampage_submissions(ocelot_team_token):
+    """Returns valid submissions of the team in team page order."""
+    submissions = Submission.objects.filter(
+        is_valid=True,  # Ignore invalid submissions
+        submitted_by__token=ocelot_team_token,
+    ).select_related(
+        'test_set__source_language', 'test_set__target_language'
+    )
+    ordering = (
+        'test_set__name',
+        'test_set__source_language__code',
+        'test_set__target_language__code',
+        '-score_chrf',
+        '-date_created',
+    )
+    return submissions.order_by(*ordering)
+
+
 def teampage(request):
     """Renders OCELoT team page."""
 
@@ -418,42 +413,35 @@ def teampage(request):
             _msg = 'You have successfully updated publication information. Thank you!'
             messages.success(request, _msg)
 
-        withdrawn_data = zip(
-            request.POST.getlist('testset'),
-            request.POST.getlist('withdrawn'),
-        )
-        for testset_id, withdrawn in withdrawn_data:
-            for submission in Submission.objects.filter(
-                test_set__id=testset_id
-            ):
-                submission.is_withdrawn = withdrawn
-                submission.save()
-
-        primary_ids_and_constrainedness = zip(
-            request.POST.getlist('primary'),
-            request.POST.getlist('constrained'),
-        )
-        for primary_id, constrained in primary_ids_and_constrainedness:
-            submission = Submission.objects.get(id=int(primary_id))
-            if submission.submitted_by.token == ocelot_team_token:
-                submission.is_constrained = bool(int(constrained))
-                submission.set_primary()  # This implicitly calls save()
-
-        contrastive_ids_and_constrainedness = zip(
-            request.POST.getlist('contrastive'),
-            request.POST.getlist('constrained'),
+        # Primary selectors come first, so constrained values for
+        # contrastive submissions start after those for primary ones
+        primary_ids = request.POST.getlist('primary')
+        contrastive_ids = request.POST.getlist('contrastive')
+        constrained = request.POST.getlist('constrained')
+
+        update_team_submissions(
+            current_team,
+            withdrawn={
+                int(testset_id): bool(int(withdrawn))
+                for testset_id, withdrawn in zip(
+                    request.POST.getlist('testset'),
+                    request.POST.getlist('withdrawn'),
+                )
+            },
+            primary={
+                int(primary_id): is_constrained == '1'
+                for primary_id, is_constrained in zip(
+                    primary_ids, constrained
+                )
+            },
+            contrastive={
+                int(contrastive_id): is_constrained == '1'
+                for contrastive_id, is_constrained in zip(
+                    contrastive_ids, constrained[len(primary_ids) :]
+                )
+                if contrastive_id
+            },
         )
-        for (
-            contrastive_id,
-            constrained,
-        ) in contrastive_ids_and_constrainedness:
-            if not contrastive_id:
-                continue
-
-            submission = Submission.objects.get(id=int(contrastive_id))
-            if submission.submitted_by.token == ocelot_team_token:
-                submission.is_constrained = bool(int(constrained))
-                submission.set_contrastive()  # This implicitly calls save()
 
     else:
         context = {
@@ -468,18 +456,7 @@ def teampage(request):
     data = OrderedDict()
     primary = OrderedDict()
     contrastive = OrderedDict()
-    submissions = Submission.objects.filter(
-        is_valid=True,  # Ignore invalid submissions
-        submitted_by__token=ocelot_team_token,
-    )
-    ordering = (
-        'test_set__name',
-        'test_set__source_language__code',
-        'test_set__target_language__code',
-        '-score_chrf',
-        '-date_created',
-    )
-    for submission in submissions.order_by(*ordering):
+    for submission in get_teampage_submissions(ocelot_team_token):
         key = submission.test_set
         if not key in data.keys():
             data[key] = []
@@ -496,19 +473,20 @@ def teampage(request):
 
     # If no primary system has been selected by the user yet, we will use
     # the highest-scoring or the latest submission for any given test set.
-    # Based on our ordering defined above, this will be the first object
-    # in the data[key] list, for each of the distinct keys.
+    # Based on the ordering of get_teampage_submissions(), this will be
+    # the first object in the data[key] list, for each of the distinct
+    # keys. The default is only shown here and stored once the team
+    # submits the form, or by the reconcile_primary_submissions management
+    # command, so that viewing this page never writes to the database.
     for key in data.keys():
         if not key in primary:
             not_withdrawn = [x for x in data[key] if not x.is_withdrawn]
             if len(not_withdrawn):
-                highest_scoring_or_latest_submission_is_default = (
-                    not_withdrawn[0]
-                )
-                highest_scoring_or_latest_submission_is_default.set_primary()
-                primary[
-                    key
-                ] = highest_scoring_or_latest_submission_is_default
+                primary[key] = not_withdrawn[0]
+                primary[key].is_primary = True  # Not saved
+                if contrastive[key] == primary[key]:
+                    primary[key].is_contrastive = False
+                    contrastive[key] = None
             else:
                 primary[key] = None
 
@@ -570,6 +548,7 @@ def teampage(request):
     return render(request, 'leaderboard/teampage.html', context=context)
 
 
+@cache_anonymous_page()
 def updates(request):
     """Renders OCELoT updates page."""
 
@@ -590,6 +569,7 @@ def updates(request):
     return render(request, 'leaderboard/updates.html', context=context)
 
 
+@cache_anonymous_page()
 def download(request):
     """Renders OCELoT download page."""
 
@@ -632,3 +612,13 @@ def welcome(request):
         'ocelot_team_verified': ocelot_team_verified,
     }
     return render(request, 'leaderboard/welcome.html', context=context)
+
+
+def metrics(request):
+    """Renders request metrics of all processes in Prometheus format."""
+    if request.META.get('REMOTE_ADDR') not in METRICS_ALLOWED_IPS:
+        raise Http404('Page not found')
+
+    return HttpResponse(
+        METRICS.render(), content_type=PROMETHEUS_CONTENT_TYPE
+    )
@@ -74,6 +74,26 @@ else:
 
 FILE_UPLOAD_PERMISSIONS = 0o644
 
+# File-based cache, so it works without external services. It is shared by
+# all processes, so pages invalidated by the scoring worker or the rescore
+# command are not served stale by web server workers. Used to cache
+# anonymous versions of public pages, see leaderboard/cache.py
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'OCELOT_CACHE_ROOT', os.path.join(BASE_DIR, 'cache')
+        ),
+    }
+}
+
+# Seconds for which anonymous public pages are cached
+PAGE_CACHE_TIMEOUT = int(os.environ.get('OCELOT_PAGE_CACHE_TIMEOUT', 300))
+
+# Seconds for which team data of signed-in sessions is cached. Saving a
+# team invalidates its data immediately
+TEAM_CACHE_TIMEOUT = int(os.environ.get('OCELOT_TEAM_CACHE_TIMEOUT', 60))
+
 # Logging settings for this Django project.
 LOG_LEVEL = logging.DEBUG
 LOG_FILENAME = os.path.join(BASE_DIR, 'ocelot.log')
@@ -90,6 +110,72 @@ LOG_HANDLER = RotatingFileHandler(
 LOG_HANDLER.setLevel(level=LOG_LEVEL)
 LOG_HANDLER.setFormatter(LOG_FORMATTER)
 
+# Per-request performance records are logged as JSON lines; requests taking
+# at least SLOW_REQUEST_SECONDS are also logged with their slowest queries.
+# See leaderboard/metrics.py
+PERFORMANCE_LOG_FILENAME = os.environ.get(
+    'OCELOT_PERFORMANCE_LOG', os.path.join(BASE_DIR, 'performance.log')
+)
+SLOW_REQUEST_LOG_FILENAME = os.environ.get(
+    'OCELOT_SLOW_REQUEST_LOG', os.path.join(BASE_DIR, 'slow-requests.log')
+)
+SLOW_REQUEST_SECONDS = float(
+    os.environ.get('OCELOT_SLOW_REQUEST_SECONDS', 1.0)
+)
+SLOW_REQUEST_TOP_QUERIES = 5
+
+# Client addresses allowed to read the /metrics page
+METRICS_ALLOWED_IPS = os.environ.get(
+    'OCELOT_METRICS_ALLOWED_IPS', '127.0.0.1,::1'
+).split(',')
+
+# Each process stores its metrics here at most every METRICS_FLUSH_SECONDS,
+# and the /metrics page adds them up. See leaderboard/metrics.py
+METRICS_ROOT = os.environ.get(
+    'OCELOT_METRICS_ROOT', os.path.join(BASE_DIR, 'metrics')
+)
+METRICS_FLUSH_SECONDS = 1.0
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'performance': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'performance': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': PERFORMANCE_LOG_FILENAME,
+            'maxBytes': 50 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'performance',
+        },
+        'slow_requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_REQUEST_LOG_FILENAME,
+            'maxBytes': 50 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'performance',
+        },
+    },
+    'loggers': {
+        'ocelot.performance': {
+            'handlers': ['performance'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'ocelot.performance.slow': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 
 # Application definition
 
@@ -105,12 +191,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that time spent in other middleware is measured as well
+    'leaderboard.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'leaderboard.middleware.TeamMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -118,7 +207,8 @@ ROOT_URLCONF = 'ocelot.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Measures template render time, see leaderboard/metrics.py
+        'BACKEND': 'leaderboard.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -181,6 +271,26 @@ STATICFILES_DIRS = [
 # Allow to specify absolute filesystem path to the directory that will hold user-uploaded files.
 MEDIA_ROOT = os.environ.get('OCELOT_MEDIA_ROOT', '')
 
+# Directory for precomputed reference statistics used to speed up scoring
+REF_STATS_ROOT = os.environ.get(
+    'OCELOT_REF_STATS_ROOT', os.path.join(BASE_DIR, 'refstats')
+)
+
+# Content-addressed store for text files derived from SGML and XML uploads,
+# see leaderboard/derived.py
+DERIVED_ROOT = os.environ.get(
+    'OCELOT_DERIVED_ROOT', os.path.join(BASE_DIR, 'derived')
+)
+
+# Admin exports are stored in MEDIA_ROOT/exports/ and purged after this
+# number of days
+EXPORT_RETENTION_DAYS = int(
+    os.environ.get('OCELOT_EXPORT_RETENTION_DAYS', 7)
+)
+
+# Number of threads reading files for admin exports
+EXPORT_READ_WORKERS = int(os.environ.get('OCELOT_EXPORT_READ_WORKERS', 4))
+
 # Project version
 # See point 4 from https://packaging.python.org/guides/single-sourcing-package-version/
 
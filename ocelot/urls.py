@@ -22,6 +22,7 @@ from evaluation.views import submission
 from leaderboard.views import download
 from leaderboard.views import frontpage
 from leaderboard.views import leaderboard
+from leaderboard.views import metrics
 from leaderboard.views import signin
 from leaderboard.views import signout
 from leaderboard.views import signup
@@ -52,6 +53,7 @@ urlpatterns = [
     path('updates', updates, name='updates-view'),
     path('download', download, name='download-view'),
     path('welcome', welcome, name='welcome-view'),
+    path('metrics', metrics, name='metrics-view'),
     # evaluation app
     path('submission/<sub_id>', submission, name='submission-view'),
     path(
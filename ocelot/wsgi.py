@@ -14,3 +14,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ocelot.settings')
 
 # pylint: disable-msg=invalid-name
 application = get_wsgi_application()
+
+# Compile schema validators before the first request needs them
+from leaderboard.models import warm_up_validators  # noqa: E402
+
+warm_up_validators()